@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the MGB-BHO Downscaling over synthetic datasets
+
+@author: Mino Sorribas
+
+@info:
+    - datasets from funcs_synthetic at several sizes (number of reaches),
+      binaries are written once with the largest nt and the time scaling
+      uses the first nt steps
+    - each stage is a span of funcs_instrument: wall time, cpu time, peak
+      of traced memory (tracemalloc, python and numpy allocations) and the
+      maximum RSS of the process (unix only)
+    - stages: domain association, table t0, the four rounds of the type 1
+      search, screening of type 2, parameters of types 2/3/4, write/read of
+      the dicts, the per-cotrecho solver loop (on a sample), the stats
+      builder (operator) and the export to GPKG
+    - results are kept as JSON (one file per run) with the commit, to
+      compare runs between commits (see .compare_bench), and the full
+      profile of each dataset is saved in its work directory
+
+@usage:
+    bench = run_benchmarks('../bench_data/', sizes=[10000, 100000])
+    dump_bench(bench, 'bench_<commit>.json')
+    df = compare_bench(read_bench('bench_new.json'), read_bench('bench_ref.json'))
+
+"""
+
+import os
+import gc
+import json
+import platform
+import subprocess
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import funcs_io
+import funcs_op
+import funcs_matlab
+import funcs_solver
+import funcs_engine
+import funcs_gpkg
+import funcs_datasets
+import funcs_pipeline
+import funcs_synthetic
+import funcs_instrument
+
+
+# sizes of networks (reaches) and lengths of binaries (days)
+BENCH_SIZES = [10000, 100000, 500000]
+BENCH_NT = [5*365]
+
+# stages in order of execution (t1_round_<i> and t1_table are spans of make_table_t1)
+BENCH_STAGES = ['read_bho', 'domain', 't0',
+                't1_round_1', 't1_round_2', 't1_round_3', 't1_round_4', 't1_table',
+                'screening_t2', 'parameters_t2', 'parameters_t3', 'parameters_t4',
+                'dicts_write', 'dicts_read',
+                'solver_loop', 'stats_builder', 'gpkg_export']
+
+
+
+
+#-----------------------------------------------------------------------------
+# MEASUREMENTS
+#-----------------------------------------------------------------------------
+def _record(stage, rec, n_reaches, nt=None, items=None):
+    """ Record of a stage from a span (see funcs_instrument.end) """
+    return {'stage': stage, 'n_reaches': n_reaches, 'nt': nt, 'items': items,
+            'wall_s': rec['wall_s'], 'cpu_s': rec['cpu_s'],
+            'peak_mb': rec['peak_traced_mb'], 'maxrss_mb': rec['maxrss_mb']}
+
+
+
+
+#-----------------------------------------------------------------------------
+# STAGES OVER A DATASET
+#-----------------------------------------------------------------------------
+def bench_network(files, n_reaches, list_nt, path_work,
+                  stages = BENCH_STAGES,
+                  n_solver = 2000,
+                  trace_memory = True,
+                  seed = 0):
+    """
+    Benchmark the stages over a synthetic dataset
+
+    Args:
+        files (dict) :: see funcs_synthetic.make_synthetic_dataset
+        n_reaches (int) :: size of the network (label of records)
+        list_nt (list) :: lengths of the binaries to test (<= nt of files)
+        path_work (str) :: directory for the outputs of stages
+        stages (list) :: stages to record (the others still run if needed)
+        n_solver (int) :: sample of cotrechos of the solver loop (None -> all)
+        trace_memory (bool) :: False to skip tracemalloc (less overhead)
+        seed (int) :: random seed of the sample
+
+    Returns:
+        records (list) :: [{'stage','n_reaches','nt','items','wall_s',...}]
+
+    Notes:
+        - restarts the profile of funcs_instrument and saves it as
+          'profile_bench.json/.csv' in path_work
+    """
+    import geopandas as gpd
+
+    os.makedirs(path_work, exist_ok=True)
+    records = []
+    funcs_instrument.start_profile('bench_{}'.format(n_reaches), trace_memory)
+
+    def run(stage, func, *args, nt=None, items=None, **kwargs):
+        gc.collect()
+        frame = funcs_instrument.begin(stage, items)
+        try:
+            out = func(*args, **kwargs)
+        finally:
+            rec = funcs_instrument.end(frame)
+        if stage in stages:
+            records.append(_record(stage, rec, n_reaches, nt, items))
+            print(" - {:<14s} {:>9.2f} s".format(stage, rec['wall_s']))
+        return out
+
+    # inputs
+    gdf_tble_bho = run('read_bho', funcs_io.read_gdf_bho, files['file_gdf_bho'],
+                       items=n_reaches)
+    df_tble_bho = gdf_tble_bho.drop('geometry', axis=1)
+    df_tble_mini = funcs_io.read_tble_mini(files['file_mini'])
+    gdf_mgb_catchments = gpd.read_file(files['file_mgb_catchments_shp'])
+
+    # domain and table t0
+    file_bho_inter = os.path.join(path_work, 'bho_midpts.gpkg')
+    dict_bho_domain = run('domain', funcs_op.associate_bho_mini_domain,
+                          gdf_tble_bho, gdf_mgb_catchments,
+                          pts_to_gpkg=file_bho_inter, to_pickle=False, items=n_reaches)
+    file_t0 = os.path.join(path_work, 'table_t0.xlsx')
+    run('t0', funcs_op.make_tble_t0, df_tble_mini, df_tble_bho, file_bho_inter,
+        fileout=file_t0, items=len(dict_bho_domain))
+
+    # type 1 (one record per round, from the spans of make_table_t1)
+    df_mini_t1, df_bho_t1 = funcs_matlab.read_matlab_input(files['file_mini'], file_t0)
+    df_tble_t1 = run('t1', funcs_matlab.make_table_t1, df_mini_t1, df_bho_t1, verbose=False)
+    for rec in funcs_instrument.get_profile()['spans']:
+        stage = 't1_' + rec['name']
+        if rec['path'].startswith('t1/make_table_t1/') and stage in stages:
+            records.append(_record(stage, rec, n_reaches, items=len(df_mini_t1)))
+            print(" - {:<14s} {:>9.2f} s".format(stage, rec['wall_s']))
+
+    df_tble_t1 = funcs_io.prepare_tble_t1(df_tble_t1[funcs_pipeline.HEADER_TBLE_T1], tol_t1=True)
+    dict_bho_mini_t1 = funcs_op.associate_bho_mini_t1(df_tble_t1)
+    dict_parameters_t1 = funcs_op.define_parameters_t1(df_tble_t1)
+
+    # type 2
+    df_tble_topo_t1 = funcs_op.merge_topologies_t1(df_tble_t1, df_tble_mini, df_tble_bho)
+    dict_routes_t2, dict_mini_afl_t2 = run('screening_t2', funcs_op.screening_candidates_t2,
+                                           df_tble_topo_t1, df_tble_mini, df_tble_bho,
+                                           items=len(df_tble_topo_t1))
+    dict_bho_mini_t2, _ = funcs_op.associate_bho_mini_t2(dict_mini_afl_t2, dict_routes_t2,
+                                                         df_tble_mini)
+    dict_parameters_t2 = run('parameters_t2', funcs_op.define_parameters_t2,
+                             dict_bho_mini_t2, dict_mini_afl_t2, dict_routes_t2,
+                             dict_bho_mini_t1, df_tble_bho, items=len(dict_bho_mini_t2))
+
+    # type 3
+    dict_bho_mini_t3 = funcs_op.associate_bho_mini_t3(dict_bho_domain)
+    dict_parameters_t3 = run('parameters_t3', funcs_op.define_parameters_t3,
+                             dict_bho_mini_t3, df_tble_mini, df_tble_bho,
+                             items=len(dict_bho_mini_t3))
+
+    # validation and type 4
+    groups_t123, dicts_t123, group_t4_candidates = funcs_op.validate_t123(
+        df_tble_bho, dict_bho_domain, 1000., dict_bho_mini_t1, dict_bho_mini_t2,
+        dict_bho_mini_t3)
+    group_t4_post, dict_parameters_t4, _ = run('parameters_t4', funcs_op.define_parameters_t4,
+                                               group_t4_candidates, dict_parameters_t3,
+                                               df_tble_bho, dicts_t123[0], df_tble_mini,
+                                               items=len(group_t4_candidates))
+    dict_bho_solver = funcs_op.make_dict_solver(*groups_t123, group_t4_post)
+
+    # dicts
+    path_dicts = os.path.join(path_work, 'dicts') + os.sep
+    os.makedirs(path_dicts, exist_ok=True)
+    run('dicts_write', funcs_io.dump_the_dicts, *dicts_t123,
+        dict_parameters_t1, dict_parameters_t2, dict_parameters_t3, dict_parameters_t4,
+        dict_bho_solver, pathout=path_dicts, items=len(dict_bho_solver))
+    the_dicts = run('dicts_read', funcs_io.read_the_dicts, path_dicts,
+                    items=len(dict_bho_solver))
+
+    # solver loop (sample) and stats builder, for each nt
+    meta = funcs_datasets.read_sidecar(files['file_sidecar'])
+    nt_max, nc, dstart = meta['nt'], meta['nc'], meta['dstart']
+    dict_var_mmap = {
+        funcs_engine.VAR_QTUDO: funcs_solver.read_mgb_as_mmap(files['file_qtudo'], nc, nt_max),
+        funcs_engine.VAR_QCEL: funcs_solver.read_mgb_as_mmap(files['file_qcel'], nc, nt_max),
+        }
+    dict_type_params = {1: dict_parameters_t1, 2: dict_parameters_t2,
+                        3: dict_parameters_t3, 4: dict_parameters_t4}
+    dict_tipo_fsolver = {1: funcs_solver.f_downscaling_t1, 2: funcs_solver.f_downscaling_t2,
+                         3: funcs_solver.f_downscaling_t3, 4: funcs_solver.f_downscaling_t4}
+    dict_tipo_var = {1: funcs_engine.VAR_QTUDO, 2: funcs_engine.VAR_QTUDO,
+                     3: funcs_engine.VAR_QCEL, 4: funcs_engine.VAR_QTUDO}
+    dict_bho_ixc = funcs_solver.make_dict_bho_ixc(the_dicts)
+
+    list_to_downscale = list(dict_bho_solver.keys())
+    sample = list_to_downscale
+    if n_solver and n_solver < len(sample):
+        rng = np.random.default_rng(seed)
+        sample = [sample[i] for i in np.sort(rng.choice(len(sample), n_solver, replace=False))]
+
+    def solver_loop(list_t):
+        for c in sample:
+            tipo = dict_bho_solver[c]
+            funcs_solver.downscale_cotrecho(c, dict_tipo_fsolver[tipo], dict_type_params[tipo],
+                                            dict_var_mmap[dict_tipo_var[tipo]], list_t,
+                                            dict_bho_ixc[c], dstart)
+
+    def stats_builder(list_t):
+        op = funcs_engine.make_downscaling_operator(dict_bho_solver, dict_type_params,
+                                                    list_to_downscale)
+        dict_stat_mini = {}
+        for var, dados_mmap in dict_var_mmap.items():
+            res = funcs_engine.make_mini_stats(dados_mmap, list_t, ['qmlt', 'q95'], 365)
+            for st, values in res.items():
+                dict_stat_mini.setdefault(st, {})[var] = values
+        return funcs_engine.downscale_stats(op, ['qmlt', 'q95'], dict_stat_mini,
+                                            dict_var_mmap, list_t, chunk_size=365)
+
+    for nt in list_nt:
+        list_t = list(range(min(nt, nt_max)))
+        run('solver_loop', solver_loop, list_t, nt=nt, items=len(sample))
+        results = run('stats_builder', stats_builder, list_t, nt=nt,
+                      items=len(list_to_downscale))
+
+    # export to gpkg (stats of the builder)
+    D = {'D_Q95': dict(zip(list_to_downscale, results['q95'])),
+         'D_QMLT': dict(zip(list_to_downscale, results['qmlt'])),
+         'solver': dict_bho_solver}
+    run('gpkg_export', funcs_gpkg.f_dicts_to_bho_gpkg, gdf_tble_bho, D, to_xlsx=False,
+        prefix=os.path.join(path_work, 'bench'), items=n_reaches)
+
+    funcs_instrument.dump_profile(os.path.join(path_work, 'profile_bench'), verbose=False)
+    funcs_instrument.stop_profile()
+    return records
+
+
+
+
+#-----------------------------------------------------------------------------
+# RUNS AND JSON
+#-----------------------------------------------------------------------------
+def git_commit(path='.'):
+    """ Commit (and dirty flag) of the working tree, None outside git """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=path,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               cwd=path, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(dirty)
+
+
+def bench_meta():
+    """ Description of the machine and code of a run """
+    commit, dirty = git_commit(os.path.dirname(os.path.abspath(__file__)))
+    return {'commit': commit,
+            'dirty': dirty,
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+
+def run_benchmarks(path_data,
+                   sizes = BENCH_SIZES,
+                   list_nt = BENCH_NT,
+                   stages = BENCH_STAGES,
+                   n_solver = 2000,
+                   trace_memory = True,
+                   seed = 0):
+    """
+    Benchmark all sizes (datasets are generated once and reused)
+
+    Args:
+        path_data (str) :: directory of datasets ('<path_data>/n<size>/')
+        sizes (list) :: number of reaches of each dataset
+        list_nt (list) :: lengths of binaries (days)
+        stages, n_solver, trace_memory, seed :: see .bench_network
+
+    Returns:
+        bench (dict) :: {'meta': .bench_meta(), 'params': ..., 'records': [...]}
+    """
+    bench = {'meta': bench_meta(),
+             'params': {'sizes': list(sizes), 'list_nt': list(list_nt),
+                        'n_solver': n_solver, 'trace_memory': trace_memory, 'seed': seed},
+             'records': []}
+
+    for n_reaches in sizes:
+        path = os.path.join(path_data, 'n{}'.format(n_reaches))
+        files = synthetic_files(path, n_reaches, max(list_nt), seed)
+        print(" Network of {} reaches... ".format(n_reaches))
+        bench['records'] += bench_network(files, n_reaches, list_nt,
+                                          os.path.join(path, 'work'),
+                                          stages = stages,
+                                          n_solver = n_solver,
+                                          trace_memory = trace_memory,
+                                          seed = seed)
+    return bench
+
+
+def synthetic_files(path, n_reaches, nt, seed=0, name='synthetic'):
+    """ Files of a synthetic dataset (generated if missing or shorter than nt) """
+    files = funcs_synthetic.dataset_files(path, name)
+    if all(os.path.isfile(f) for f in files.values()):
+        meta = funcs_datasets.read_sidecar(files['file_sidecar'])
+        if meta['nt'] >= nt:
+            return files
+    return funcs_synthetic.make_synthetic_dataset(path, n_reaches, nt, seed, name=name)
+
+
+def dump_bench(bench, fileout):
+    """ Save a run as JSON """
+    with open(fileout, 'w') as f:
+        json.dump(bench, f, indent=1)
+
+
+def read_bench(filein):
+    """ Read a run from JSON """
+    with open(filein, 'r') as f:
+        return json.load(f)
+
+
+def bench_filename(bench, path='./'):
+    """ 'bench_<commit>_<date>.json' """
+    meta = bench['meta']
+    date = meta['date'].replace('-', '').replace(':', '').replace(' ', '_')
+    return os.path.join(path, 'bench_{}_{}.json'.format(meta['commit'] or 'nogit', date))
+
+
+
+
+#-----------------------------------------------------------------------------
+# SCALING AND COMPARISON
+#-----------------------------------------------------------------------------
+def bench_to_dataframe(bench):
+    """ Records of a run as a dataframe """
+    df = pd.DataFrame(bench['records'])
+    df['nt'] = df['nt'].fillna(0).astype(int)
+    return df
+
+
+def scaling_table(bench, metric='wall_s'):
+    """
+    Metric of each stage by size of the network, and the scaling exponent
+        metric ~ n_reaches**exponent (least squares in log-log)
+
+    Returns:
+        df (pd.DataFrame) :: rows (stage, nt), columns sizes and 'exponent'
+    """
+    df = bench_to_dataframe(bench)
+    table = df.pivot_table(index=['stage', 'nt'], columns='n_reaches', values=metric)
+    sizes = np.array(table.columns, dtype=float)
+
+    def _exponent(row):
+        ok = np.isfinite(row.values) & (row.values > 0)
+        if ok.sum() < 2:
+            return np.nan
+        return np.polyfit(np.log(sizes[ok]), np.log(row.values[ok]), 1)[0]
+
+    table['exponent'] = table.apply(_exponent, axis=1)
+    order = {s: i for i, s in enumerate(BENCH_STAGES)}
+    table = table.iloc[np.argsort([order.get(s, len(order)) for s, _ in table.index], kind='stable')]
+    return table
+
+
+def compare_bench(bench, bench_ref, metric='wall_s', tol=0.2):
+    """
+    Compare a run against a reference (e.g. previous commit)
+
+    Args:
+        bench, bench_ref (dict) :: see .run_benchmarks or .read_bench
+        metric (str) :: 'wall_s', 'cpu_s', 'peak_mb' or 'maxrss_mb'
+        tol (float) :: relative increase flagged as regression
+
+    Returns:
+        df (pd.DataFrame) :: metric of both runs, ratio and 'regression'
+                             for common (stage, n_reaches, nt)
+    """
+    keys = ['stage', 'n_reaches', 'nt']
+    df = pd.merge(bench_to_dataframe(bench)[keys + [metric]],
+                  bench_to_dataframe(bench_ref)[keys + [metric]],
+                  on=keys, suffixes=('', '_ref'))
+    df['ratio'] = df[metric]/df[metric + '_ref']
+    df['regression'] = df['ratio'] > 1. + tol
+    return df
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoint and resume of long runs over cotrechos
+
+    - cotrechos are processed in blocks (fixed partition of the list)
+    - results of each block are saved atomically (tmp file + os.replace)
+    - a manifest (json) keeps the completed blocks, the hash of the
+      configuration and the hash of the list of cotrechos
+    - a re-run with --resume skips finished blocks, and the final
+      merge checks that no cotrecho is duplicated or missing
+
+@author: Mino Sorribas
+
+@usage:
+    ckpt = init_checkpoint(path, config, list_to_downscale, 2000, resume_from_argv())
+    for iblock, list_block in pending_blocks(ckpt):
+        ...
+        save_block(ckpt, iblock, {'D_Q95': D_Q95_block, ...})
+    merged = merge_blocks(ckpt)
+
+"""
+
+import os
+import sys
+import glob
+import json
+import pickle
+import hashlib
+import tempfile
+
+
+FILE_MANIFEST = 'manifest.json'
+
+
+
+
+#-----------------------------------------------------------------------------
+# UTILS
+#-----------------------------------------------------------------------------
+def resume_from_argv(argv=None):
+    """ True if the script was called with --resume """
+    argv = sys.argv[1:] if argv is None else argv
+    return '--resume' in argv
+
+
+def make_hash(obj):
+    """ Hash (sha256) of a json-serializable object (keys sorted) """
+    s = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+
+def data_hash(obj):
+    """ Hash (sha256) of a picklable object, e.g. dicts of parameters (order of keys matters) """
+    return hashlib.sha256(pickle.dumps(obj, protocol=4)).hexdigest()
+
+
+def atomic_write(filename, write_func, mode='wb'):
+    """
+    Write a file atomically (a crash never leaves a partial file)
+
+    Args:
+        filename (str) :: final path
+        write_func (function) :: write_func(f) writes the content to f
+        mode (str) :: 'wb' or 'w'
+    """
+    path = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=path, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write_func(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return None
+
+
+def _block_file(ckpt, iblock):
+    return os.path.join(ckpt['path'], 'block_{:06d}.pickle'.format(iblock))
+
+
+def _dump_manifest(ckpt):
+    manifest = {
+        'config_hash': ckpt['config_hash'],
+        'items_hash': ckpt['items_hash'],
+        'block_size': ckpt['block_size'],
+        'nblocks': len(ckpt['blocks']),
+        'done': sorted(ckpt['done']),
+        }
+    filename = os.path.join(ckpt['path'], FILE_MANIFEST)
+    atomic_write(filename, lambda f: json.dump(manifest, f, indent=1), mode='w')
+    return None
+
+
+
+
+#-----------------------------------------------------------------------------
+# CHECKPOINT
+#-----------------------------------------------------------------------------
+def init_checkpoint(path, config, list_items, block_size=2000, resume=False):
+    """
+    Prepare the checkpoint directory of a run
+
+    Args:
+        path (str) :: directory of the checkpoint
+        config (dict) :: settings that change results (version, hotstart...)
+        list_items (list) :: cotrechos (order defines the blocks)
+        block_size (int) :: number of cotrechos in each block
+        resume (bool) :: True to keep finished blocks of a previous run
+
+    Returns:
+        ckpt (dict) :: state of the checkpoint
+
+    Notes:
+        - resume with a different configuration or list of cotrechos raises
+          ValueError (remove the directory or run without --resume)
+        - without resume the blocks of a previous checkpoint are removed
+    """
+    list_items = list(list_items)
+    blocks = [list_items[i:i+block_size] for i in range(0, len(list_items), block_size)]
+
+    ckpt = {
+        'path': path,
+        'config_hash': make_hash(config),
+        'items_hash': make_hash(list_items),
+        'block_size': block_size,
+        'blocks': blocks,
+        'items': list_items,
+        'done': set(),
+        }
+
+    filename = os.path.join(path, FILE_MANIFEST)
+    if resume and os.path.isfile(filename):
+        with open(filename) as f:
+            manifest = json.load(f)
+        for key in ('config_hash', 'items_hash', 'block_size'):
+            if manifest[key] != ckpt[key]:
+                raise ValueError("checkpoint at {} has a different {} (run without --resume)"
+                                 .format(path, key))
+        # only blocks with a results file are finished
+        ckpt['done'] = {i for i in manifest['done'] if os.path.isfile(_block_file(ckpt, i))}
+        print(" - resume: {}/{} blocks finished".format(len(ckpt['done']), len(blocks)))
+    else:
+        # new run: remove blocks of a previous checkpoint
+        os.makedirs(path, exist_ok=True)
+        for f in glob.glob(os.path.join(path, 'block_*.pickle')):
+            os.remove(f)
+
+    _dump_manifest(ckpt)
+    return ckpt
+
+
+def pending_blocks(ckpt):
+    """ Blocks not finished yet [(iblock, list_block),...] """
+    return [(i, b) for i, b in enumerate(ckpt['blocks']) if i not in ckpt['done']]
+
+
+def save_block(ckpt, iblock, results):
+    """
+    Save results of a block and mark it as finished
+
+    Args:
+        ckpt (dict) :: see .init_checkpoint
+        iblock (int) :: index of the block
+        results (dict) :: {label: {cotrecho: value}} (may be empty)
+    """
+    atomic_write(_block_file(ckpt, iblock), lambda f: pickle.dump(results, f))
+    ckpt['done'].add(iblock)
+    _dump_manifest(ckpt)
+    return None
+
+
+def merge_blocks(ckpt, check=True, expect_all=False):
+    """
+    Merge results of all blocks
+
+    Args:
+        ckpt (dict) :: see .init_checkpoint
+        check (bool) :: check for duplicated/out of block cotrechos
+        expect_all (bool) :: every cotrecho must have results in every label
+
+    Returns:
+        merged (dict) :: {label: {cotrecho: value}}
+    """
+    missing = [i for i in range(len(ckpt['blocks'])) if i not in ckpt['done']]
+    if missing:
+        raise ValueError("{} blocks are not finished (e.g. {})".format(len(missing), missing[:5]))
+
+    merged = {}
+    for iblock in range(len(ckpt['blocks'])):
+        with open(_block_file(ckpt, iblock), 'rb') as f:
+            results = pickle.load(f)
+        for label, d in results.items():
+            m = merged.setdefault(label, {})
+            if check:
+                dup = m.keys() & d.keys()
+                if dup:
+                    raise ValueError("duplicated cotrechos in {} (e.g. {})".format(label, list(dup)[:5]))
+                extra = set(d.keys()) - set(ckpt['blocks'][iblock])
+                if extra:
+                    raise ValueError("cotrechos out of block {} in {} (e.g. {})"
+                                     .format(iblock, label, list(extra)[:5]))
+            m.update(d)
+
+    if expect_all:
+        for label, m in merged.items():
+            if len(m) != len(set(ckpt['items'])):
+                missing = set(ckpt['items']) - m.keys()
+                raise ValueError("missing cotrechos in {} (e.g. {})".format(label, list(missing)[:5]))
+
+    return merged
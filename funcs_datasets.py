@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of MGB runs (datasets) described by JSON sidecar files
+    replaces the hardcoded settings of funcs_solver.mgbsa_default
+
+@author: Mino Sorribas
+
+@info:
+    - each run has a sidecar '<name>.mgbrun.json' in the input directory
+        {
+         "name": "1979",
+         "nt": 13149,
+         "nc": 33749,
+         "dstart": "1979-01-01",
+         "dt_hours": 24,
+         "member": null,
+         "variables": {"qtudo": {"file": "QTUDO_1979.MGB", "checksum": null},
+                       "qcel":  {"file": "QITUDO_1979.MGB", "checksum": null}}
+        }
+    - files are relative to the sidecar directory
+    - "qtudo" is the discharge and "qcel" is the local runoff (QITUDO)
+    - checksum is optional ("sha256:<hex>"), it is slow for large binaries
+    - solvers take timesteps as days, a run with dt_hours != 24 is rejected
+      when it is opened by a solver (see .dataset_default)
+    - malformed sidecars are skipped (with a warning) by .discover_datasets
+    - "qtudo" and "qcel" are both required by .dataset_default
+
+"""
+
+import os
+import glob
+import json
+import hashlib
+import warnings
+from datetime import datetime, timedelta
+
+import funcs_store
+
+
+SIDECAR_SUFFIX = '.mgbrun.json'
+
+# variables of the registry and codes of funcs_engine
+dict_registry_var = {'qtudo': 0, 'qcel': 1}
+
+# time step of the runs [hours] (solvers take timesteps as days)
+SIDECAR_DT_HOURS = 24
+
+
+
+
+#-----------------------------------------------------------------------------
+# SIDECAR FILES
+#-----------------------------------------------------------------------------
+def file_checksum(filename, block_size=2**24):
+    """ Checksum (sha256) of a file read in blocks """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return 'sha256:' + h.hexdigest()
+
+
+def sidecar_path(path_input, name):
+    """ Path of the sidecar of a run """
+    return os.path.join(path_input, name + SIDECAR_SUFFIX)
+
+
+def write_sidecar(path_input, name, nt, nc, dstart, files,
+                  dt_hours = 24,
+                  member = None,
+                  checksum = False):
+    """
+    Write the sidecar of a MGB run
+
+    Args:
+        path_input (str) :: directory of the binaries (and of the sidecar)
+        name (str) :: name of the run (e.g. '1979', 'enkf_1979_m48')
+        nt, nc (int) :: number of intervals and catchments
+        dstart (datetime) :: first date of the run
+        files (dict) :: {variable: binary file} e.g. {'qtudo':'QTUDO.MGB'}
+        dt_hours (float) :: time step [hours] (only daily runs, see SIDECAR_DT_HOURS)
+        member (int) :: ensemble member (None -> deterministic run)
+        checksum (bool) :: True to store the sha256 of each binary
+
+    Returns:
+        meta (dict) :: content of the sidecar
+    """
+    variables = {}
+    for var, filebin in files.items():
+        cks = None
+        if checksum:
+            cks = file_checksum(os.path.join(path_input, filebin))
+        variables[var] = {'file': filebin, 'checksum': cks}
+
+    meta = {
+        'name': name,
+        'nt': int(nt),
+        'nc': int(nc),
+        'dstart': dstart.strftime('%Y-%m-%d %H:%M:%S'),
+        'dt_hours': dt_hours,
+        'member': member,
+        'variables': variables,
+        }
+
+    with open(sidecar_path(path_input, name), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    return meta
+
+
+def read_sidecar(filejson):
+    """
+    Read the sidecar of a MGB run
+
+    Returns:
+        meta (dict) :: content of the sidecar with
+                       'dstart' as datetime and 'path' of the sidecar directory
+    """
+    with open(filejson) as f:
+        meta = json.load(f)
+
+    for key in ('name', 'nt', 'nc', 'dstart', 'variables'):
+        if key not in meta:
+            raise ValueError("missing '{}' in {}".format(key, filejson))
+
+    meta['dstart'] = datetime.fromisoformat(meta['dstart'])
+    meta.setdefault('dt_hours', SIDECAR_DT_HOURS)
+    meta.setdefault('member', None)
+    meta['path'] = os.path.dirname(os.path.abspath(filejson))
+    return meta
+
+
+
+
+#-----------------------------------------------------------------------------
+# REGISTRY
+#-----------------------------------------------------------------------------
+def discover_datasets(path_input):
+    """
+    Find the sidecars of MGB runs in a directory
+
+    Returns:
+        registry (dict) :: {name: meta} (malformed sidecars are skipped)
+    """
+    registry = {}
+    for filejson in sorted(glob.glob(os.path.join(path_input, '*' + SIDECAR_SUFFIX))):
+        try:
+            meta = read_sidecar(filejson)
+        except (ValueError, OSError) as e:
+            warnings.warn("skipped sidecar {} ({})".format(filejson, e))
+            continue
+        if meta['name'] in registry:
+            raise ValueError("duplicated run '{}' in {}".format(meta['name'], path_input))
+        registry[meta['name']] = meta
+    return registry
+
+
+def dataset_file(meta, var):
+    """ Full path of the binary of a variable of the run """
+    return os.path.join(meta['path'], meta['variables'][var]['file'])
+
+
+def validate_dataset(meta, fmt='mgb', check_checksum=False):
+    """
+    Check the binaries of a run against its sidecar
+
+    Args:
+        meta (dict) :: see .read_sidecar
+        fmt (str) :: format of binaries, 'mgb' (raw) or 'zarr'
+        check_checksum (bool) :: True to check the stored checksums (slow)
+
+    Returns:
+        None (raises FileNotFoundError or ValueError)
+    """
+    nt, nc = meta['nt'], meta['nc']
+    for var, info in meta['variables'].items():
+        filebin = dataset_file(meta, var)
+
+        # size of file (or shape of the container)
+        dados_mmap = funcs_store.open_mgb(filebin, nc, nt, fmt)
+        del dados_mmap
+
+        if check_checksum and info.get('checksum') and fmt == 'mgb':
+            if file_checksum(filebin) != info['checksum']:
+                raise ValueError("checksum of {} does not match {}"
+                                 .format(filebin, meta['name'] + SIDECAR_SUFFIX))
+    return None
+
+
+def open_dataset(meta, variables=None, fmt='mgb'):
+    """
+    Memory-maps of the binaries of a run
+
+    Args:
+        meta (dict) :: see .read_sidecar
+        variables (list) :: variables to open (None -> all of the sidecar)
+        fmt (str) :: format of binaries, 'mgb' (raw) or 'zarr'
+
+    Returns:
+        dict_var_mmap (dict) :: {variable: memmap (nt x nc)}
+    """
+    variables = variables or list(meta['variables'].keys())
+    dict_var_mmap = {}
+    for var in variables:
+        filebin = dataset_file(meta, var)
+        dict_var_mmap[var] = funcs_store.open_mgb(filebin, meta['nc'], meta['nt'], fmt)
+    return dict_var_mmap
+
+
+def open_datasets(path_input, names=None, variables=None, fmt='mgb'):
+    """
+    Memory-maps of many runs at once (e.g. scenarios or ensemble members)
+
+    Returns:
+        dict_run_mmap (dict) :: {name: {variable: memmap}}
+    """
+    registry = discover_datasets(path_input)
+    names = names or list(registry.keys())
+    return {name: open_dataset(registry[name], variables, fmt) for name in names}
+
+
+def dataset_times(meta, list_t):
+    """ Dates of the selected timesteps of a run """
+    dt = timedelta(hours=meta['dt_hours'])
+    return [meta['dstart'] + i*dt for i in list_t]
+
+
+def dataset_default(meta):
+    """
+    Settings of a run in the tuple of funcs_solver.mgbsa_default
+        (nt, nc, dstart, file_qtudo, file_qcel)
+    """
+    if float(meta['dt_hours']) != SIDECAR_DT_HOURS:
+        raise ValueError("dt_hours = {} in run '{}', solvers take timesteps as days ({} hours)"
+                         .format(meta['dt_hours'], meta['name'], SIDECAR_DT_HOURS))
+    var = meta['variables']
+    missing = [v for v in ('qtudo', 'qcel') if v not in var]
+    if missing:
+        raise ValueError("run '{}' has no {} in its sidecar (see dict_registry_var)"
+                         .format(meta['name'], missing))
+    return (meta['nt'], meta['nc'], meta['dstart'], var['qtudo']['file'], var['qcel']['file'])
@@ -0,0 +1,1072 @@
+# -*- coding: utf-8 -*-
+"""
+Batched engine for the solver step of the Downscaling
+    works over all cotrechos (or blocks of cotrechos) at once
+    instead of one cotrecho per iteration
+
+@author: Mino Sorribas
+
+@info:
+    - variables of MGB binaries are coded as
+        0 -> discharge (QTUDO)           used by types 1, 2 and 4
+        1 -> local runoff (QITUDO/QCEL)  used by type 3
+    - mini are 1-based (as in MGB), columns in arrays are 0-based
+
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from scipy import sparse
+
+import funcs_extremes
+import funcs_topology
+import funcs_instrument
+
+
+# variable of MGB binary used by each type of solver
+VAR_QTUDO = 0
+VAR_QCEL = 1
+dict_tipo_var = {1: VAR_QTUDO, 2: VAR_QTUDO, 3: VAR_QCEL, 4: VAR_QTUDO}
+
+
+
+
+#-----------------------------------------------------------------------------
+# MINI-LEVEL ANNUAL EXTREMES
+#-----------------------------------------------------------------------------
+def make_mini_annual_extremes(dados_mmap, list_t, dstart):
+    """
+    Annual maxima and minima of every mini in a single streaming pass
+        over the MGB binary (one block of contiguous rows per year)
+
+    Args:
+        dados_mmap (np.memmap) :: memory map of binary (nt x nc)
+        list_t (list) :: list of integer of selected timesteps
+        dstart (datetime) :: first date in dados_mmap
+
+    Returns:
+        years (np.array) :: years (ny,)
+        amax (np.array) :: annual maxima (ny x nc)
+        amin (np.array) :: annual minima (ny x nc)
+    """
+
+    # positions of years in list_t
+    times = [dstart + timedelta(days=i) for i in list_t]
+    years, ystart = funcs_extremes.year_bounds(times)
+    yend = np.append(ystart[1:], len(times))
+
+    ixt = np.asarray(list_t, dtype=int)
+    nc = dados_mmap.shape[1]
+    amax = np.empty((len(years), nc), dtype=np.float32)
+    amin = np.empty((len(years), nc), dtype=np.float32)
+
+    for iy, (a, b) in enumerate(zip(ystart, yend)):
+        rows = ixt[a:b]
+        if rows[-1] - rows[0] == len(rows) - 1:
+            block = dados_mmap[rows[0]:rows[-1]+1, :]  # contiguous -> sequential read
+        else:
+            block = dados_mmap[rows, :]
+        amax[iy] = block.max(axis=0)
+        amin[iy] = block.min(axis=0)
+
+    return years, amax, amin
+
+
+def dump_mini_annual_extremes(fileout, years, amax, amin):
+    """ Save mini-level annual extremes (.npz) """
+    np.savez(fileout, years=years, amax=amax, amin=amin)
+    return None
+
+
+def read_mini_annual_extremes(filein):
+    """ Read mini-level annual extremes (.npz) -> years, amax, amin """
+    with np.load(filein) as f:
+        years, amax, amin = f['years'], f['amax'], f['amin']
+    return years, amax, amin
+
+
+
+
+#-----------------------------------------------------------------------------
+# SINGLE-MINI SOLVERS (TYPES 1, 3 AND 4)
+#-----------------------------------------------------------------------------
+def _first(x):
+    """ list -> scalar (parameters are stored as lists for serialization) """
+    return x[0] if isinstance(x, list) else x
+
+
+def single_mini_factor(tipo, param):
+    """
+    Mini and constant factor of solvers that are linear in a single mini
+        i.e. outflow = factor * Q[mini]
+        mirrors funcs_solver.f_downscaling_t1, _t3 and _t4
+
+    Args:
+        tipo (int) :: type of solver (1, 3 or 4)
+        param (dict) :: parameters of the cotrecho
+
+    Returns:
+        mini (int) :: mini (1-based)
+        var (int) :: variable of the MGB binary (VAR_QTUDO or VAR_QCEL)
+        factor (float) :: scaling factor
+    """
+
+    if tipo == 1:
+        # direct transfer
+        mini = _first(param.get('mini'))
+        factor = 1.
+
+    elif tipo == 3:
+        # local runoff scaled by area
+        mini = _first(param.get('mini'))
+        factor = _first(param.get('nuareamont'))/_first(param.get('area_km2'))
+
+    elif tipo == 4:
+        t4_mini = param.get('t4_mini')
+        if t4_mini:
+            # specific discharge from downstream type 1
+            mini = _first(t4_mini)
+            factor = _first(param.get('t4_nuareamont'))/_first(param.get('t4_aream_km2'))
+        else:
+            # "poor man solution" (like type 3)
+            mini = _first(param.get('mini'))
+            factor = _first(param.get('nuareamont'))/_first(param.get('aream_km2'))
+
+    else:
+        raise ValueError("type {} is not a single-mini solver (funcs_engine)".format(tipo))
+
+    return int(mini), dict_tipo_var[tipo], float(factor)
+
+
+def make_scaling_t134(dict_bho_solver, dict_type_params, list_to_downscale):
+    """
+    Arrays of mini/factor for the cotrechos solved by a single mini
+
+    Args:
+        dict_bho_solver (dict) :: {cotrecho:solver}
+        dict_type_params (dict) :: {solver:dict_parameters_t<solver>}
+        list_to_downscale (list) :: cotrechos to downscale
+
+    Returns:
+        scaling (dict) :: {'cotrecho','tipo','mini','var','factor'} np.arrays
+                          for types 1, 3 and 4
+        fallback (list) :: cotrechos that require the full time series
+                           (type 2 or non-positive factors)
+
+    Notes:
+        - max(f*Q) = f*max(Q) only holds for f>0, otherwise it falls back
+    """
+    cols = {'cotrecho':[], 'tipo':[], 'mini':[], 'var':[], 'factor':[]}
+    fallback = []
+
+    for c in list_to_downscale:
+        tipo = dict_bho_solver.get(c)
+        if tipo is None:
+            continue
+        if tipo == 2:
+            fallback.append(c)
+            continue
+
+        param = dict_type_params.get(tipo).get(c)
+        mini, var, factor = single_mini_factor(tipo, param)
+        if not factor > 0.:
+            fallback.append(c)
+            continue
+
+        cols['cotrecho'].append(c)
+        cols['tipo'].append(tipo)
+        cols['mini'].append(mini)
+        cols['var'].append(var)
+        cols['factor'].append(factor)
+
+    scaling = {
+        'cotrecho': np.array(cols['cotrecho'], dtype=np.int64),
+        'tipo': np.array(cols['tipo'], dtype=np.int8),
+        'mini': np.array(cols['mini'], dtype=np.int64),
+        'var': np.array(cols['var'], dtype=np.int8),
+        'factor': np.array(cols['factor'], dtype=float),
+        }
+
+    return scaling, fallback
+
+
+def scale_mini_extremes(scaling, dict_var_extremes):
+    """
+    Annual extremes of cotrechos (types 1, 3 and 4) from mini-level extremes
+
+    Args:
+        scaling (dict) :: see .make_scaling_t134
+        dict_var_extremes (dict) :: {var: (ny x nc) mini-level annual extremes}
+
+    Returns:
+        a (np.array) :: annual extremes (ny x ncotrecho)
+                        same order as scaling['cotrecho']
+    """
+    ny = next(iter(dict_var_extremes.values())).shape[0]
+    a = np.full((ny, len(scaling['cotrecho'])), np.nan)
+
+    for var, amini in dict_var_extremes.items():
+        if amini is None:
+            continue
+        sel = scaling['var'] == var
+        ixc = scaling['mini'][sel] - 1
+        a[:, sel] = amini[:, ixc] * scaling['factor'][sel][None, :]
+
+    return a
+
+
+
+
+#-----------------------------------------------------------------------------
+# DOWNSCALING AS A LINEAR OPERATOR
+#-----------------------------------------------------------------------------
+@funcs_instrument.timed()
+def make_downscaling_operator(dict_bho_solver, dict_type_params, list_to_downscale):
+    """
+    Compiles the downscaling of all types into a weight matrix (triplets)
+        such as outflow[cotrecho] = sum(val * Q[var][mini])
+
+        - type 1, 3 and 4 -> single mini (see .single_mini_factor)
+        - type 2 -> inflows + (outflow - inflows_all)*fracarea, i.e.
+              +1          for each mini in minimon
+              +fracarea   for each mini in miniref
+              -fracarea   for each mini in minimonall
+          (mirrors funcs_solver.f_downscaling_t2)
+
+    Args:
+        dict_bho_solver (dict) :: {cotrecho:solver}
+        dict_type_params (dict) :: {solver:dict_parameters_t<solver>}
+        list_to_downscale (list) :: cotrechos to downscale (rows)
+
+    Returns:
+        op (dict) :: downscaling operator
+                     'cotrecho' (n,) :: cotrecho of each row
+                     'tipo' (n,) :: solver of each row
+                     'nuareamont' (n,) :: drainage area of each row [km2]
+                     'row', 'col', 'val', 'var' (nnz,) :: triplets with
+                         row (0-based), col (mini-1), weight and variable
+
+    Notes:
+        - repeated mini are kept as repeated entries (same as summing
+          the columns of the dataframe in the solver functions)
+    """
+    list_cotrecho, list_tipo, list_area = [], [], []
+    row, col, val, var = [], [], [], []
+
+    for c in list_to_downscale:
+        tipo = dict_bho_solver.get(c)
+        if tipo is None:
+            continue
+        param = dict_type_params.get(tipo).get(c)
+        irow = len(list_cotrecho)
+
+        if tipo == 2:
+            minimon = param.get('minimon', None) or []
+            miniref = param.get('miniref') or []
+            minimonall = param.get('minimonall', None) or []
+            fracarea = param.get('fracarea')[0]
+            terms = ([(m, 1.) for m in minimon]
+                     + [(m, fracarea) for m in miniref]
+                     + [(m, -fracarea) for m in minimonall])
+            for mini, w in terms:
+                row.append(irow)
+                col.append(int(mini) - 1)
+                val.append(w)
+                var.append(VAR_QTUDO)
+        else:
+            mini, v, factor = single_mini_factor(tipo, param)
+            row.append(irow)
+            col.append(mini - 1)
+            val.append(factor)
+            var.append(v)
+
+        list_cotrecho.append(c)
+        list_tipo.append(tipo)
+        list_area.append(_first(param.get('nuareamont')))
+
+    op = {
+        'cotrecho': np.array(list_cotrecho, dtype=np.int64),
+        'tipo': np.array(list_tipo, dtype=np.int8),
+        'nuareamont': np.array(list_area, dtype=float),
+        'row': np.array(row, dtype=np.int64),
+        'col': np.array(col, dtype=np.int64),
+        'val': np.array(val, dtype=float),
+        'var': np.array(var, dtype=np.int8),
+        }
+    return op
+
+
+def apply_operator(op, dict_var_values, rows=None):
+    """
+    Applies the downscaling operator to values of mini
+
+    Args:
+        op (dict) :: see .make_downscaling_operator
+        dict_var_values (dict) :: {var: values of mini (nc,) or (nt x nc)}
+        rows (np.array,optional) :: subset of rows of op (default = all)
+
+    Returns:
+        y (np.array) :: downscaled values (nrows,) or (nt x nrows)
+    """
+    if rows is None:
+        rows = np.arange(len(op['cotrecho']))
+    rows = np.asarray(rows)
+
+    # map operator rows into positions of the output
+    pos = np.full(len(op['cotrecho']), -1)
+    pos[rows] = np.arange(len(rows))
+
+    x0 = next(iter(dict_var_values.values()))
+    y = np.zeros(np.shape(x0)[:-1] + (len(rows),))
+
+    for var, x in dict_var_values.items():
+        if x is None:
+            continue
+        sel = (op['var'] == var) & (pos[op['row']] >= 0)
+        if not sel.any():
+            continue
+        irow = pos[op['row'][sel]]
+        contrib = np.asarray(x)[..., op['col'][sel]] * op['val'][sel]
+
+        # sum entries of the same row
+        isort = np.argsort(irow, kind='stable')
+        irow, contrib = irow[isort], contrib[..., isort]
+        urows, istart = np.unique(irow, return_index=True)
+        y[..., urows] += np.add.reduceat(contrib, istart, axis=-1)
+
+    return y
+
+
+
+
+#-----------------------------------------------------------------------------
+# STATISTICS: LINEAR (FAST) AND NONLINEAR (EXACT) PATHS
+#-----------------------------------------------------------------------------
+# class of each statistic and function over time series (axis=0)
+dict_stats = {
+    'qmlt': ('linear', lambda a: np.mean(a, axis=0)),
+    'qsum': ('linear', lambda a: np.sum(a, axis=0)),
+    'q95':  ('nonlinear', lambda a: np.quantile(a, 0.05, axis=0)),
+    'q90':  ('nonlinear', lambda a: np.quantile(a, 0.10, axis=0)),
+    'q50':  ('nonlinear', lambda a: np.quantile(a, 0.50, axis=0)),
+    'qmax': ('nonlinear', lambda a: np.max(a, axis=0)),
+    'qmin': ('nonlinear', lambda a: np.min(a, axis=0)),
+    }
+
+
+def classify_stats(list_stats):
+    """
+    Split statistics into linear (mean, totals) and nonlinear (quantiles, extremes)
+
+    Returns:
+        linear (list), nonlinear (list)
+    """
+    linear = [s for s in list_stats if dict_stats[s][0] == 'linear']
+    nonlinear = [s for s in list_stats if dict_stats[s][0] != 'linear']
+    return linear, nonlinear
+
+
+def single_positive_rows(op):
+    """
+    Rows of op solved by a single mini with positive weight
+        where quantiles/extremes commute with the operator
+        i.e. q(f*Q) = f*q(Q) for f>0
+    """
+    n = len(op['cotrecho'])
+    nnz = np.bincount(op['row'], minlength=n)
+    npos = np.bincount(op['row'], weights=(op['val'] > 0.), minlength=n)
+    return np.flatnonzero((nnz == 1) & (npos == 1))
+
+
+def read_block(dados_mmap, list_t, cols):
+    """ Read selected rows (time) and columns (0-based) of a binary """
+    idx = np.ix_(np.asarray(list_t), np.asarray(cols))
+    return np.asarray(dados_mmap[idx], dtype=float)
+
+
+def downscale_timeseries_block(op, rows, dict_var_mmap, list_t):
+    """
+    Exact time series of a block of cotrechos (batched time-domain path)
+        reads only the union of mini required by the block, once
+
+    Args:
+        op (dict) :: see .make_downscaling_operator
+        rows (np.array) :: rows of op in this block
+        dict_var_mmap (dict) :: {var: memmap of binary (nt x nc)}
+        list_t (list) :: list of integer of selected timesteps
+
+    Returns:
+        y (np.array) :: time series (len(list_t) x len(rows))
+    """
+    rows = np.asarray(rows)
+    pos = np.full(len(op['cotrecho']), -1)
+    pos[rows] = np.arange(len(rows))
+    y = np.zeros((len(list_t), len(rows)))
+
+    for var, dados_mmap in dict_var_mmap.items():
+        sel = (op['var'] == var) & (pos[op['row']] >= 0)
+        if not sel.any():
+            continue
+
+        # local (dense) weights for the union of required mini
+        ucols, icol = np.unique(op['col'][sel], return_inverse=True)
+        w = np.zeros((len(ucols), len(rows)))
+        np.add.at(w, (icol, pos[op['row'][sel]]), op['val'][sel])
+
+        x = read_block(dados_mmap, list_t, ucols)
+        y += x @ w
+
+    return y
+
+
+@funcs_instrument.timed()
+def downscale_stats(op,
+                    list_stats,
+                    dict_stat_mini = None,
+                    dict_var_mmap = None,
+                    list_t = None,
+                    block_size = 2000,
+                    exact = True,
+                    chunk_size = None):
+    """
+    Downscale statistics for all rows of the operator
+
+        - linear statistics: straight from mini-level statistics (W @ stat)
+        - nonlinear statistics:
+            * single mini with positive weight: scaled mini-level statistic
+            * otherwise (type 2): exact time-domain path in blocks of rows
+              (or W @ stat if exact=False, which is only an approximation)
+
+    Args:
+        op (dict) :: see .make_downscaling_operator
+        list_stats (list) :: statistics (keys of dict_stats)
+        dict_stat_mini (dict) :: {stat: {var: mini-level values (nc,)}}
+        dict_var_mmap (dict) :: {var: memmap of binary (nt x nc)}
+        list_t (list) :: list of integer of selected timesteps
+        block_size (int) :: number of rows in each block (time-domain path)
+        exact (bool) :: False to skip the time-domain path
+        chunk_size (int) :: timesteps per chunk of the time-domain path
+                            (None -> whole list_t at once, see .chunked_stats)
+
+    Returns:
+        results (dict) :: {stat: np.array (n,)} same order as op['cotrecho']
+
+    """
+    dict_stat_mini = dict_stat_mini or {}
+    n = len(op['cotrecho'])
+    results = {}
+
+    linear, nonlinear = classify_stats(list_stats)
+
+    # linear: operator over mini-level stats (or time domain if not available)
+    for st in linear:
+        if st in dict_stat_mini:
+            results[st] = apply_operator(op, dict_stat_mini[st])
+        else:
+            nonlinear.append(st)
+
+    if not nonlinear:
+        return results
+
+    # nonlinear: single mini with positive weight commutes with stats
+    rows_single = single_positive_rows(op)
+    rows_multi = np.setdiff1d(np.arange(n), rows_single)
+    for st in nonlinear:
+        results[st] = np.full(n, np.nan)
+        if st in dict_stat_mini:
+            results[st][rows_single] = apply_operator(op, dict_stat_mini[st], rows_single)
+            if not exact:
+                results[st][rows_multi] = apply_operator(op, dict_stat_mini[st], rows_multi)
+
+    # exact time-domain path for the remaining rows
+    pending = [st for st in nonlinear if np.isnan(results[st]).any()]
+    if pending and dict_var_mmap is not None:
+        rows_todo = np.flatnonzero(np.isnan(np.column_stack([results[st] for st in pending])).any(axis=1))
+        for i in range(0, len(rows_todo), block_size):
+            rows = rows_todo[i:i+block_size]
+            read_chunk = lambda tt: downscale_timeseries_block(op, rows, dict_var_mmap, tt)
+            res = chunked_stats(read_chunk, len(rows), list_t, pending, chunk_size)
+            for st in pending:
+                results[st][rows] = res[st]
+
+    return results
+
+
+
+
+#-----------------------------------------------------------------------------
+# CHUNKED EVALUATION (MERGEABLE ACCUMULATORS)
+#-----------------------------------------------------------------------------
+# signed log-spaced bins for the quantiles of chunked evaluation [m3/s]
+# (~1% of relative resolution, values are interpolated inside the bin)
+#   [-QHIGH, -QLOW] log bins of negative values (e.g. type 2)
+#   [-QLOW, QLOW]   linear bins around zero
+#   [QLOW, QHIGH]   log bins of positive values
+HIST_QLOW = 1.e-4
+HIST_QHIGH = 1.e6
+HIST_NBINS = 2400
+HIST_NLIN = 20
+
+
+def make_time_chunks(list_t, chunk_size):
+    """
+    Split the list of timesteps into chunks of contiguous positions
+
+    Args:
+        list_t (list) :: list of integer of selected timesteps
+        chunk_size (int) :: number of timesteps in each chunk
+                            e.g. 5*365 for 5 years of daily data
+                            (None -> a single chunk)
+
+    Returns:
+        list_chunks (list) :: list of lists of timesteps
+    """
+    list_t = list(list_t)
+    if not chunk_size:
+        return [list_t]
+    return [list_t[i:i+chunk_size] for i in range(0, len(list_t), chunk_size)]
+
+
+def hist_edges(qlow=HIST_QLOW, qhigh=HIST_QHIGH, nbins=HIST_NBINS, nlin=HIST_NLIN):
+    """
+    Signed edges of the histogram (2*nbins + nlin + 1,)
+        nbins log bins of each sign and nlin linear bins in [-qlow, qlow]
+    """
+    pos = np.geomspace(qlow, qhigh, nbins+1)
+    lin = np.linspace(-qlow, qlow, nlin+1)[1:-1]
+    return np.concatenate((-pos[::-1], lin, pos))
+
+
+def new_accumulator(ncol, edges=None):
+    """
+    Empty accumulator of statistics for ncol columns
+
+    Args:
+        ncol (int) :: number of columns (mini or cotrechos)
+        edges (np.array) :: edges of histogram (see .hist_edges)
+
+    Returns:
+        acc (dict) :: {'n','sum','sumsq','min','max','hist','edges'}
+
+    Notes:
+        - values below the first edge go to the first bin and values above
+          the last edge go to the last bin
+        - min/max are exact, so quantiles are clipped into [min, max]
+    """
+    edges = hist_edges() if edges is None else edges
+    acc = {
+        'n': 0,
+        'sum': np.zeros(ncol),
+        'sumsq': np.zeros(ncol),
+        'min': np.full(ncol, np.inf),
+        'max': np.full(ncol, -np.inf),
+        'hist': np.zeros((len(edges)-1, ncol), dtype=np.int32),
+        'edges': edges,
+        }
+    return acc
+
+
+def update_accumulator(acc, y):
+    """
+    Add a chunk of time series to the accumulator (in place)
+
+    Args:
+        acc (dict) :: see .new_accumulator
+        y (np.array) :: time series of the chunk (nt_chunk x ncol)
+
+    Returns:
+        acc (dict) :: same object, updated
+    """
+    y = np.asarray(y, dtype=float)
+    nb, ncol = acc['hist'].shape
+    acc['n'] += y.shape[0]
+    acc['sum'] += y.sum(axis=0)
+    acc['sumsq'] += (y*y).sum(axis=0)
+    acc['min'] = np.minimum(acc['min'], y.min(axis=0))
+    acc['max'] = np.maximum(acc['max'], y.max(axis=0))
+
+    # counts by (bin,column) in a single bincount
+    ib = np.clip(np.searchsorted(acc['edges'], y, side='right') - 1, 0, nb-1)
+    flat = (ib*ncol + np.arange(ncol)[None,:]).ravel()
+    acc['hist'] += np.bincount(flat, minlength=nb*ncol).reshape(nb, ncol).astype(np.int32)
+    return acc
+
+
+def merge_accumulators(acc_a, acc_b):
+    """
+    Merge two accumulators of the same columns and edges
+        (e.g. chunks processed separately or in parallel)
+    """
+    acc = {
+        'n': acc_a['n'] + acc_b['n'],
+        'sum': acc_a['sum'] + acc_b['sum'],
+        'sumsq': acc_a['sumsq'] + acc_b['sumsq'],
+        'min': np.minimum(acc_a['min'], acc_b['min']),
+        'max': np.maximum(acc_a['max'], acc_b['max']),
+        'hist': acc_a['hist'] + acc_b['hist'],
+        'edges': acc_a['edges'],
+        }
+    return acc
+
+
+def accumulator_quantile(acc, p):
+    """
+    Quantile p of each column from the histogram of the accumulator
+        (same rank convention as np.quantile, interpolated inside the bin:
+        log of magnitude in bins of a single sign, linear around zero)
+    """
+    edges = acc['edges']
+    hist = acc['hist']
+    n = acc['n']
+    ncol = hist.shape[1]
+
+    # 0-based rank and the bin that contains it
+    h = (n - 1)*p
+    cum = np.cumsum(hist, axis=0)
+    ib = np.argmax(cum > h, axis=0)
+    below = np.where(ib > 0, cum[ib-1, np.arange(ncol)], 0)
+    cnt = hist[ib, np.arange(ncol)]
+
+    # fraction inside the bin (counts at the center of its subinterval)
+    frac = np.clip((h - below + 0.5)/np.maximum(cnt, 1), 0., 1.)
+    lo, hi = edges[ib], edges[ib+1]
+    q = lo + (hi - lo)*frac
+    with np.errstate(divide='ignore', invalid='ignore'):
+        qpos = np.exp(np.log(lo) + (np.log(hi) - np.log(lo))*frac)
+        qneg = -np.exp(np.log(-lo) + (np.log(-hi) - np.log(-lo))*frac)
+    q = np.where(lo > 0., qpos, np.where(hi < 0., qneg, q))
+
+    # first/last bins also hold under/overflow -> linear from the exact min/max
+    nb = hist.shape[0]
+    qa = acc['min'] + (edges[1] - acc['min'])*frac
+    qb = edges[-2] + (acc['max'] - edges[-2])*frac
+    q = np.where(ib == 0, qa, np.where(ib == nb-1, qb, q))
+
+    return np.clip(q, acc['min'], acc['max'])
+
+
+# statistics from accumulators (same keys of dict_stats)
+dict_acc_stats = {
+    'qmlt': lambda acc: acc['sum']/acc['n'],
+    'qsum': lambda acc: acc['sum'],
+    'q95':  lambda acc: accumulator_quantile(acc, 0.05),
+    'q90':  lambda acc: accumulator_quantile(acc, 0.10),
+    'q50':  lambda acc: accumulator_quantile(acc, 0.50),
+    'qmax': lambda acc: acc['max'],
+    'qmin': lambda acc: acc['min'],
+    }
+
+
+def finalize_accumulator(acc, list_stats):
+    """ Statistics {stat: (ncol,)} from the accumulator """
+    return {st: dict_acc_stats[st](acc) for st in list_stats}
+
+
+def chunked_stats(read_chunk, ncol, list_t, list_stats, chunk_size, edges=None):
+    """
+    Statistics over list_t evaluated by chunks of time
+        peak memory ~ chunk_size x ncol (plus histogram nbins x ncol)
+
+    Args:
+        read_chunk (function) :: read_chunk(list_t_chunk) -> (nt_chunk x ncol)
+        ncol (int) :: number of columns returned by read_chunk
+        list_t (list) :: list of integer of selected timesteps
+        list_stats (list) :: statistics (keys of dict_stats)
+        chunk_size (int) :: timesteps per chunk (None -> exact, single chunk)
+        edges (np.array) :: edges of histogram (see .hist_edges)
+
+    Returns:
+        results (dict) :: {stat: np.array (ncol,)}
+    """
+    list_chunks = make_time_chunks(list_t, chunk_size)
+
+    # single chunk: exact statistics
+    if len(list_chunks) == 1:
+        y = read_chunk(list_chunks[0])
+        return {st: dict_stats[st][1](y) for st in list_stats}
+
+    acc = new_accumulator(ncol, edges)
+    for chunk in list_chunks:
+        update_accumulator(acc, read_chunk(chunk))
+    return finalize_accumulator(acc, list_stats)
+
+
+@funcs_instrument.timed()
+def make_mini_stats(dados_mmap, list_t, list_stats, chunk_size=None, col_block=4000,
+                    cols=None):
+    """
+    Mini-level statistics of a MGB binary by chunks of time and blocks of mini
+
+    Args:
+        dados_mmap (np.memmap) :: memory map of binary (nt x nc)
+        list_t (list) :: list of integer of selected timesteps
+        list_stats (list) :: statistics (keys of dict_stats)
+        chunk_size (int) :: timesteps per chunk (None -> exact, single chunk)
+        col_block (int) :: number of mini in each block
+        cols (np.array) :: mini columns to read, 0-based (None -> all)
+
+    Returns:
+        results (dict) :: {stat: np.array (nc,)} (nan outside cols)
+    """
+    nc = dados_mmap.shape[1]
+    cols_all = np.arange(nc) if cols is None else np.asarray(cols, dtype=np.int64)
+    results = {st: np.full(nc, np.nan) for st in list_stats}
+    for i in range(0, len(cols_all), col_block):
+        cols = cols_all[i:i+col_block]
+        read_chunk = lambda tt: read_block(dados_mmap, tt, cols)
+        res = chunked_stats(read_chunk, len(cols), list_t, list_stats, chunk_size)
+        for st in list_stats:
+            results[st][cols] = res[st]
+    return results
+
+
+
+#-----------------------------------------------------------------------------
+# SPARSE EXPORT OF THE OPERATOR (REUSE BY EXTERNAL MODELS)
+#-----------------------------------------------------------------------------
+def operator_to_sparse(op, nc):
+    """
+    Compiles the operator into scipy.sparse CSR matrices (n_cotrecho x nc)
+        one for each variable of the MGB binaries, so that
+        outflow = W_qtudo @ Q_qtudo + W_qcel @ Q_qcel + offset
+
+    Args:
+        op (dict) :: see .make_downscaling_operator
+        nc (int) :: number of mini
+
+    Returns:
+        dict_var_w (dict) :: {var: scipy.sparse.csr_matrix (n x nc)}
+        offset (np.array) :: offset of each cotrecho (n,)
+
+    Notes:
+        - current solvers are homogeneous (offset = 0), it is kept in the
+          format for operators with constant terms
+        - repeated entries (row,col) are summed by the CSR conversion
+    """
+    n = len(op['cotrecho'])
+    dict_var_w = {}
+    for var in (VAR_QTUDO, VAR_QCEL):
+        sel = op['var'] == var
+        w = sparse.coo_matrix((op['val'][sel], (op['row'][sel], op['col'][sel])),
+                              shape=(n, nc))
+        dict_var_w[var] = w.tocsr()
+
+    offset = np.zeros(n)
+    return dict_var_w, offset
+
+
+def dump_operator_npz(fileout, op, nc):
+    """
+    Save the downscaling operator (.npz) for reuse outside this project
+
+    The file contains:
+        cotrecho (n,) :: cotrecho of each row
+        tipo (n,) :: solver of each row
+        nuareamont (n,) :: drainage area of each row [km2]
+        mini (nc,) :: mini of each column (1..nc)
+        offset (n,) :: constant term of each row
+        w<var>_data, w<var>_indices, w<var>_indptr :: CSR arrays of
+            w0 (QTUDO) and w1 (QITUDO/QCEL), shape (n x nc)
+
+    Usage (no dependency on this project):
+        f = np.load(fileout)
+        w0 = scipy.sparse.csr_matrix((f['w0_data'], f['w0_indices'], f['w0_indptr']),
+                                     shape=(len(f['cotrecho']), len(f['mini'])))
+        q = w0 @ qtudo.T + w1 @ qitudo.T + f['offset'][:,None]  # (n x nt)
+    """
+    dict_var_w, offset = operator_to_sparse(op, nc)
+
+    arrays = {
+        'cotrecho': op['cotrecho'],
+        'tipo': op['tipo'],
+        'nuareamont': op['nuareamont'],
+        'mini': np.arange(1, nc+1, dtype=np.int64),
+        'offset': offset,
+        }
+    for var, w in dict_var_w.items():
+        arrays['w{}_data'.format(var)] = w.data
+        arrays['w{}_indices'.format(var)] = w.indices
+        arrays['w{}_indptr'.format(var)] = w.indptr
+
+    np.savez_compressed(fileout, **arrays)
+    return None
+
+
+def read_operator_npz(filein):
+    """
+    Read the downscaling operator saved with .dump_operator_npz
+
+    Returns:
+        sp_op (dict) :: {'cotrecho','tipo','nuareamont','mini','offset'} arrays
+                        and 'w' = {var: scipy.sparse.csr_matrix}
+    """
+    with np.load(filein) as f:
+        sp_op = {k: f[k] for k in ('cotrecho', 'tipo', 'nuareamont', 'mini', 'offset')}
+        shape = (len(sp_op['cotrecho']), len(sp_op['mini']))
+        sp_op['w'] = {}
+        for var in (VAR_QTUDO, VAR_QCEL):
+            key = 'w{}'.format(var)
+            sp_op['w'][var] = sparse.csr_matrix(
+                (f[key+'_data'], f[key+'_indices'], f[key+'_indptr']), shape=shape)
+
+    return sp_op
+
+
+def apply_sparse_operator(sp_op, dict_var_values):
+    """
+    Downscale values of mini with the sparse operator (single W @ Q product)
+
+    Args:
+        sp_op (dict) :: see .read_operator_npz
+        dict_var_values (dict) :: {var: values of mini (nc,) or (nt x nc)}
+                                  e.g. discharge, runoff, ensemble member...
+
+    Returns:
+        y (np.array) :: downscaled values (n,) or (nt x n)
+    """
+    y = None
+    for var, x in dict_var_values.items():
+        if x is None:
+            continue
+        x = np.asarray(x, dtype=float)
+        yv = (sp_op['w'][var] @ x.T).T
+        y = yv if y is None else y + yv
+    if y is None:
+        raise ValueError("no values of mini to downscale (all variables are None)")
+    return y + sp_op['offset']
+
+
+
+
+#-----------------------------------------------------------------------------
+# NETWORK ACCUMULATION SOLVER (TYPE 5)
+#-----------------------------------------------------------------------------
+# solver tag of the network accumulation
+TIPO_ACCUM = 5
+
+
+@funcs_instrument.timed()
+def make_network(df_tble_bho, dict_bho_mini, dict_bho_mini_t1):
+    """
+    Network of BHO reaches for the accumulation solver
+
+        - local runoff (QITUDO) of each mini is distributed to its reaches
+          by nuareacont: weight = nuareacont / sum(nuareacont of the mini)
+        - flow is accumulated downstream along nutrjus
+        - at type 1 reaches the balance is closed with the discharge of
+          MGB (QTUDO), which is the inflow of the downstream reach
+
+    Args:
+        df_tble_bho (pd.DataFrame) :: table of BHO drainage
+        dict_bho_mini (dict) :: {cotrecho:mini} of reaches in the domain
+        dict_bho_mini_t1 (dict) :: {cotrecho:mini} of type 1
+
+    Returns:
+        net (dict) :: network
+            'cotrecho', 'nuareamont' (n,) :: reaches
+            'down' (n,) :: downstream row (-1 at outlets and type 1)
+            'col', 'weight' (n,) :: mini (0-based) and share of local runoff
+            't1_col' (n,) :: mini (0-based) of type 1 rows (-1 elsewhere)
+            'inj_row', 'inj_col' :: rows receiving the discharge of a type 1
+            'level' (n,) :: level from headwaters (see funcs_topology)
+
+    Notes:
+        - edges leaving type 1 reaches are cut (replaced by injections),
+          so the network splits into independent parts between type 1
+    """
+    sel = df_tble_bho['cotrecho'].isin(list(dict_bho_mini.keys()))
+    df = df_tble_bho.loc[sel, ['cotrecho', 'nutrjus', 'nuareacont', 'nuareamont']]
+
+    cot = df['cotrecho'].to_numpy(dtype=np.int64)
+    down = funcs_topology.downstream_index(cot, df['nutrjus'])
+
+    # share of local runoff of each mini
+    col = np.array([dict_bho_mini[c] for c in cot.tolist()], dtype=np.int64) - 1
+    areacont = df['nuareacont'].fillna(0.).to_numpy(dtype=float)
+    area_mini = np.bincount(col, weights=areacont)
+    weight = np.divide(areacont, area_mini[col], out=np.zeros(len(cot)), where=area_mini[col] > 0)
+
+    # type 1: balance with MGB discharge, injected downstream
+    t1_col = np.array([dict_bho_mini_t1.get(c, 0) for c in cot.tolist()], dtype=np.int64) - 1
+    is_t1 = t1_col >= 0
+    inj = is_t1 & (down >= 0)
+    inj_row, inj_col = down[inj], t1_col[inj]
+    down = np.where(is_t1, -1, down)
+
+    net = {
+        'cotrecho': cot,
+        'nuareamont': df['nuareamont'].to_numpy(dtype=float),
+        'down': down,
+        'col': col,
+        'weight': weight,
+        't1_col': t1_col,
+        'inj_row': inj_row,
+        'inj_col': inj_col,
+        'level': funcs_topology.levels_from_headwaters(down),
+        }
+    return net
+
+
+def network_blocks(net, col_block=20000):
+    """
+    Blocks of rows made of whole independent parts of the network
+
+    Returns:
+        list_rows (list) :: [np.array of rows,...] (a part larger than
+                            col_block makes a block alone)
+    """
+    down = net['down']
+    n = len(down)
+
+    # outlet of each row (pointer jumping)
+    root = np.where(down >= 0, down, np.arange(n))
+    while True:
+        nxt = root[root]
+        if np.array_equal(nxt, root):
+            break
+        root = nxt
+
+    order = np.argsort(root, kind='stable')
+    uroots, istart, counts = np.unique(root[order], return_index=True, return_counts=True)
+
+    list_rows, block, size = [], [], 0
+    for i0, cnt in zip(istart, counts):
+        if size and size + cnt > col_block:
+            list_rows.append(np.sort(np.concatenate(block)))
+            block, size = [], 0
+        block.append(order[i0:i0+cnt])
+        size += cnt
+    if block:
+        list_rows.append(np.sort(np.concatenate(block)))
+    return list_rows
+
+
+def subnetwork(net, rows):
+    """
+    Part of the network with local rows and local columns of mini
+
+    Returns:
+        sub (dict) :: as .make_network, plus 'topo' (funcs_topology.make_topology)
+                      'cols_qcel' and 'cols_qtudo' (mini to read, 0-based)
+    """
+    rows = np.asarray(rows)
+    pos = np.full(len(net['cotrecho']), -1)
+    pos[rows] = np.arange(len(rows))
+
+    down = net['down'][rows]
+    down = np.where(down >= 0, pos[np.maximum(down, 0)], -1)
+
+    # local columns of mini
+    cols_qcel, col = np.unique(net['col'][rows], return_inverse=True)
+
+    inj = pos[net['inj_row']] >= 0
+    t1_col = net['t1_col'][rows]
+    cols_qtudo, icol = np.unique(np.concatenate([t1_col[t1_col >= 0], net['inj_col'][inj]]),
+                                 return_inverse=True)
+    nt1 = int((t1_col >= 0).sum())
+    t1_local = np.full(len(rows), -1)
+    t1_local[t1_col >= 0] = icol[:nt1]
+
+    sub = {
+        'cotrecho': net['cotrecho'][rows],
+        'nuareamont': net['nuareamont'][rows],
+        'down': down,
+        'col': col,
+        'weight': net['weight'][rows],
+        't1_col': t1_local,
+        'inj_row': pos[net['inj_row'][inj]],
+        'inj_col': icol[nt1:],
+        'level': net['level'][rows],
+        'cols_qcel': cols_qcel,
+        'cols_qtudo': cols_qtudo,
+        }
+    sub['topo'] = funcs_topology.make_topology(down)
+    return sub
+
+
+def accumulate_network(net, qcel, qtudo, return_residual=False):
+    """
+    Discharge of all reaches by accumulation of local runoff
+        vectorized over time (see funcs_topology.accumulate_upstream)
+
+    Args:
+        net (dict) :: see .subnetwork
+        qcel (np.array) :: local runoff of mini (nt x ncol of net['col'])
+        qtudo (np.array) :: discharge of mini (nt x ncol of net['t1_col'])
+        return_residual (bool) :: also return the balance at type 1
+
+    Returns:
+        q (np.array) :: discharge (nt x n)
+        resid (np.array) :: accumulated minus MGB discharge at type 1 rows
+                            (nt x n, zero elsewhere), if return_residual
+    """
+    topo = net.get('topo') or funcs_topology.make_topology(net['down'])
+
+    # local runoff and inflow from type 1 upstream (reach x time)
+    q = np.asarray(qcel, dtype=float)[:, net['col']].T * net['weight'][:, None]
+    qt = np.asarray(qtudo, dtype=float).T
+    np.add.at(q, net['inj_row'], qt[net['inj_col']])
+
+    q = funcs_topology.accumulate_upstream(topo, q)
+
+    # closes the balance at type 1 with MGB discharge
+    # (type 1 rows do not flow downstream, see .make_network)
+    r1 = np.flatnonzero(net['t1_col'] >= 0)
+    resid = None
+    if return_residual:
+        resid = np.zeros_like(q)
+        resid[r1] = q[r1] - qt[net['t1_col'][r1]]
+    q[r1] = qt[net['t1_col'][r1]]
+
+    if return_residual:
+        return q.T, resid.T
+    return q.T
+
+
+@funcs_instrument.timed()
+def network_stats(net, mmap_qcel, mmap_qtudo, list_t, list_stats,
+                  chunk_size = None,
+                  col_block = 20000):
+    """
+    Statistics of the accumulated discharge of all reaches of the network
+        by blocks of independent parts and chunks of time
+
+    Args:
+        net (dict) :: see .make_network
+        mmap_qcel, mmap_qtudo (np.memmap) :: binaries QITUDO and QTUDO (nt x nc)
+        list_t (list) :: list of integer of selected timesteps
+        list_stats (list) :: statistics (keys of dict_stats)
+        chunk_size (int) :: timesteps per chunk (None -> exact, single chunk)
+        col_block (int) :: approximate number of reaches in each block
+
+    Returns:
+        results (dict) :: {stat: (n,)} and 'resid_mlt' (n,), mean balance
+                          residual at type 1 rows (nan elsewhere)
+    """
+    n = len(net['cotrecho'])
+    results = {st: np.full(n, np.nan) for st in list_stats}
+    results['resid_mlt'] = np.full(n, np.nan)
+
+    for rows in network_blocks(net, col_block):
+        sub = subnetwork(net, rows)
+        resid_sum = np.zeros(len(rows))
+
+        def read_chunk(tt):
+            qc = read_block(mmap_qcel, tt, sub['cols_qcel'])
+            if len(sub['cols_qtudo']):
+                qt = read_block(mmap_qtudo, tt, sub['cols_qtudo'])
+            else:
+                qt = np.zeros((len(tt), 0))
+            q, resid = accumulate_network(sub, qc, qt, return_residual=True)
+            resid_sum[:] += resid.sum(axis=0)
+            return q
+
+        res = chunked_stats(read_chunk, len(rows), list_t, list_stats, chunk_size)
+        for st in list_stats:
+            results[st][rows] = res[st]
+
+        t1 = sub['t1_col'] >= 0
+        results['resid_mlt'][rows[t1]] = resid_sum[t1]/len(list_t)
+
+    return results
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Functions for extreme value statistics (annual maxima/minima)
+    vectorized over all cotrechos (columns) at once
+
+@author: Mino Sorribas
+
+@info:
+    - annual extremes are stored as (years x cotrechos) matrices
+    - gumbel (moments) follows the frequency factor approach (aula plinio tomaz)
+        yt = - ln(ln(T/(T-1)))
+        K = (yt-yn)/sn
+        xt = x_mu + K*x_std
+        b = sqrt(1+1.3*K + 1.1*K*K)
+        s.e. = b*x_std/(sqrt(N)) ::  (xt-z*s.e. , xt+z*s.e.)
+      where yn and sn are the mean and std of the reduced variates
+      -ln(-ln(i/(n+1))), i=1..n, which reproduces the usual yn/sn tables
+      (e.g. n=35 -> yn=0.5403, sn=1.1285; n->inf -> yn=0.5772, sn=1.2825)
+    - l-moments and gev fit follows Hosking (1990) and Hosking et al. (1985)
+
+"""
+
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+
+#-----------------------------------------------------------------------------
+# ANNUAL EXTREMES
+#-----------------------------------------------------------------------------
+def year_bounds(times):
+    """
+    Identify the position where each year begins in a (sorted) list of dates
+
+    Args:
+        times (list/pd.DatetimeIndex) :: dates of the time series
+
+    Returns:
+        years (np.array) :: years in the time series
+        ystart (np.array) :: first position (row) of each year in times
+    """
+    ayears = np.array([t.year for t in times])
+    years, ystart = np.unique(ayears, return_index=True)
+    return years, ystart
+
+
+def annual_maxima(a, ystart):
+    """
+    Annual maxima of time series (rows) for each column
+
+    Args:
+        a (np.array) :: time series (nt x ncol) or (nt,)
+        ystart (np.array) :: first row of each year (see .year_bounds)
+
+    Returns:
+        amax (np.array) :: annual maxima (nyears x ncol)
+    """
+    a = np.asarray(a, dtype=float)
+    if a.ndim == 1:
+        a = a[:,None]
+    return np.maximum.reduceat(a, ystart, axis=0)
+
+
+def annual_minima(a, ystart):
+    """
+    Annual minima of time series (rows) for each column
+
+    Args:
+        a (np.array) :: time series (nt x ncol) or (nt,)
+        ystart (np.array) :: first row of each year (see .year_bounds)
+
+    Returns:
+        amin (np.array) :: annual minima (nyears x ncol)
+    """
+    a = np.asarray(a, dtype=float)
+    if a.ndim == 1:
+        a = a[:,None]
+    return np.minimum.reduceat(a, ystart, axis=0)
+
+
+
+
+#-----------------------------------------------------------------------------
+# SAMPLE STATISTICS
+#-----------------------------------------------------------------------------
+def gumbel_yn_sn(n):
+    """
+    Mean (yn) and standard deviation (sn) of gumbel reduced variates
+        for sample size n (replaces the tables of yn and sn)
+
+    Args:
+        n (int/np.array) :: sample size(s)
+
+    Returns:
+        yn, sn (np.array) :: same shape as n
+    """
+    n = np.atleast_1d(np.asarray(n, dtype=int))
+    yn = np.full(n.shape, np.nan)
+    sn = np.full(n.shape, np.nan)
+    for nk in np.unique(n):
+        if nk < 2:
+            continue
+        pp = np.arange(1, nk+1)/(nk+1.)
+        y = -np.log(-np.log(pp))
+        yn[n==nk] = y.mean()
+        sn[n==nk] = y.std()
+    return yn, sn
+
+
+def sample_lmoments(amax):
+    """
+    Sample l-moments (l1, l2, t3) for each column of annual extremes
+        (unbiased probability weighted moments, ignoring nans)
+
+    Args:
+        amax (np.array) :: annual extremes (nyears x ncol)
+
+    Returns:
+        l1, l2, t3 (np.array) :: l-moments for each column (ncol,)
+        n (np.array) :: number of valid years for each column (ncol,)
+    """
+    x = np.sort(np.asarray(amax, dtype=float), axis=0)    # nans go last
+    n = np.sum(np.isfinite(x), axis=0).astype(float)
+
+    # ranks (1..n) and mask of valid values
+    i = np.arange(1, x.shape[0]+1, dtype=float)[:,None]
+    valid = i <= n[None,:]
+    x = np.where(valid, x, 0.)
+
+    # probability weighted moments
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w1 = np.where(valid, (i-1.)/(n-1.), 0.)
+        w2 = np.where(valid, (i-1.)*(i-2.)/((n-1.)*(n-2.)), 0.)
+        b0 = x.sum(axis=0)/n
+        b1 = (w1*x).sum(axis=0)/n
+        b2 = (w2*x).sum(axis=0)/n
+
+        l1 = b0
+        l2 = 2.*b1 - b0
+        l3 = 6.*b2 - 6.*b1 + b0
+        t3 = l3/l2
+
+    return l1, l2, t3, n
+
+
+
+
+#-----------------------------------------------------------------------------
+# RETURN LEVELS
+#-----------------------------------------------------------------------------
+def _reduced_variate(return_periods):
+    """ Gumbel reduced variate yt = -ln(ln(T/(T-1))) for each T (ntr,1) """
+    tr = np.atleast_1d(np.asarray(return_periods, dtype=float))
+    return -np.log(np.log(tr/(tr-1.)))[:,None]
+
+
+def _gamma(x):
+    """ Gamma function over arrays (nan-safe) """
+    f = np.frompyfunc(lambda v: math.gamma(v) if np.isfinite(v) else np.nan, 1, 1)
+    return f(x).astype(float)
+
+
+def _fit_quantiles(amax, return_periods, method):
+    """ Return levels (ntr x ncol) for the selected method """
+
+    yt = _reduced_variate(return_periods)
+
+    if method == 'gumbel':
+        # gumbel by moments and frequency factor (sample-size correct yn/sn)
+        mu = np.nanmean(amax, axis=0)
+        std = np.nanstd(amax, axis=0, ddof=1)
+        n = np.sum(np.isfinite(amax), axis=0)
+        yn, sn = gumbel_yn_sn(n)
+        k = (yt - yn[None,:])/sn[None,:]
+        q = mu[None,:] + k*std[None,:]
+        return q, k, std, n
+
+    # l-moments based methods
+    l1, l2, t3, n = sample_lmoments(amax)
+
+    if method == 'gumbel_lmom':
+        alpha = l2/np.log(2.)
+        xi = l1 - 0.5772156649*alpha
+        q = xi[None,:] + alpha[None,:]*yt
+
+    elif method == 'gev_lmom':
+        # hosking approximation for shape parameter
+        c = 2./(3.+t3) - np.log(2.)/np.log(3.)
+        k = 7.8590*c + 2.9554*c**2
+        k = np.where(np.abs(k) < 1e-6, np.nan, k)     # -> gumbel limit
+        gk = _gamma(1.+k)
+        alpha = l2*k/((1.-2.**(-k))*gk)
+        xi = l1 - alpha*(1.-gk)/k
+        # gev quantile (k!=0) or gumbel (k=0)
+        yf = np.exp(-yt)                              # -ln(F)
+        with np.errstate(invalid='ignore'):
+            q = xi[None,:] + alpha[None,:]/k[None,:]*(1.-yf**k[None,:])
+        # gumbel limit
+        alpha_g = l2/np.log(2.)
+        xi_g = l1 - 0.5772156649*alpha_g
+        q_g = xi_g[None,:] + alpha_g[None,:]*yt
+        q = np.where(np.isnan(k)[None,:], q_g, q)
+
+    else:
+        raise ValueError("unknown method '{}' (funcs_extremes)".format(method))
+
+    return q, None, None, n
+
+
+def return_levels(amax,
+                  return_periods = (2.,),
+                  method = 'gumbel',
+                  how = 'max',
+                  conf = 0.95,
+                  n_boot = 0,
+                  seed = 0):
+    """
+    Return levels for multiple return periods and all columns at once
+
+    Args:
+        amax (np.array) :: annual extremes (nyears x ncol), nans are ignored
+
+        return_periods (list) :: return periods [years], e.g. [2.,10.,100.]
+
+        method (str) :: 'gumbel'      - moments and frequency factor
+                        'gumbel_lmom' - gumbel fitted by l-moments
+                        'gev_lmom'    - gev fitted by l-moments
+
+        how (str) :: 'max' for annual maxima, 'min' for annual minima
+                     (minima are fitted as the maxima of -x)
+
+        conf (float) :: confidence level of the bounds (default=0.95)
+
+        n_boot (int) :: number of bootstrap samples for the bounds of
+                        l-moments methods (0 -> no bounds)
+
+        seed (int) :: seed of the bootstrap resampling
+
+    Returns:
+        rl (dict) :: {'tr': return periods (ntr,),
+                      'q': return levels (ntr x ncol),
+                      'lb': lower bound (ntr x ncol),
+                      'ub': upper bound (ntr x ncol),
+                      'n': number of valid years (ncol,)}
+
+    Notes:
+        - 'gumbel' bounds are analytical (frequency factor standard error)
+        - bootstrap uses the same resampled years for every column, so it
+          stays vectorized (memory ~ n_boot x ntr x ncol)
+
+    """
+    amax = np.asarray(amax, dtype=float)
+    if amax.ndim == 1:
+        amax = amax[:,None]
+
+    sign = -1. if how == 'min' else 1.
+    x = sign*amax
+
+    tr = np.atleast_1d(np.asarray(return_periods, dtype=float))
+    z = NormalDist().inv_cdf(0.5 + conf/2.)
+
+    q, k, std, n = _fit_quantiles(x, tr, method)
+
+    lb = np.full(q.shape, np.nan)
+    ub = np.full(q.shape, np.nan)
+
+    if method == 'gumbel':
+        se = np.sqrt(1. + 1.3*k + 1.1*k**2)*std[None,:]/np.sqrt(n)[None,:]
+        lb = q - z*se
+        ub = q + z*se
+
+    elif n_boot > 0:
+        rng = np.random.default_rng(seed)
+        ny = x.shape[0]
+        qb = np.empty((n_boot,) + q.shape)
+        for b in range(n_boot):
+            idx = rng.integers(0, ny, ny)
+            qb[b], _, _, _ = _fit_quantiles(x[idx,:], tr, method)
+        plow = 100.*(1.-conf)/2.
+        lb = np.nanpercentile(qb, plow, axis=0)
+        ub = np.nanpercentile(qb, 100.-plow, axis=0)
+
+    # back to the original sign (minima)
+    if sign < 0:
+        q, lb, ub = -q, -ub, -lb
+
+    rl = {'tr': tr, 'q': q, 'lb': lb, 'ub': ub, 'n': n}
+    return rl
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Gauges (postos) and arbitrary points snapped to BHO reaches
+    regenerates dict_posto_cotrecho / dict_cotrecho_posto
+
+@author: Mino Sorribas
+
+@info:
+    - the snap index is a STRtree (shapely 2) over the line geometries of
+      the BHO, built once and cached in a .npz (WKB of geometries,
+      cotrecho and nuareamont) with the fingerprint of the BHO file
+    - candidates of each point are the reaches within max_dist (degrees,
+      EPSG:4674), or the nearest reach if there is none
+    - candidates are ranked by a score of distance and agreement of the
+      drainage area of the gauge with nuareamont:
+        score = dist/max_dist + w_area*|ln(nuareamont/area)|
+      (distance only if the area of the gauge is unknown)
+    - shapely is imported only when needed
+
+@usage:
+    index = snap_index_from_file(FILE_GDF_BHO, filecache='snap_index_bho.npz')
+    df_snap = snap_points(index, df_gauges)
+    dict_posto_cotrecho, dict_cotrecho_posto = gauge_mapping(df_snap)
+
+"""
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+import funcs_io
+import funcs_pipeline
+
+
+# search distance [degrees] and number of candidates kept by point
+SNAP_MAX_DIST = 0.02
+SNAP_K = 5
+
+# weight of the area agreement in the score
+SNAP_W_AREA = 1.
+
+# maximum difference of drainage area accepted in the mapping [%]
+SNAP_AREA_TOL = 25.
+
+# columns of the candidates (see .snap_points)
+HEADER_SNAP = ['posto', 'rank', 'cotrecho', 'dist', 'area', 'nuareamont',
+               'area_diff_perc', 'score']
+
+
+
+
+#-----------------------------------------------------------------------------
+# SHAPELY DEPENDENCY
+#-----------------------------------------------------------------------------
+def _import_shapely():
+    """ Import shapely 2 (optional dependency, vectorized STRtree) """
+    try:
+        import shapely
+    except ImportError:
+        raise ImportError("shapely>=2 is required to snap points "
+                          "(conda install -c conda-forge shapely)")
+    if int(shapely.__version__.split('.')[0]) < 2:
+        raise ImportError("shapely>=2 is required to snap points "
+                          "(found {})".format(shapely.__version__))
+    return shapely
+
+
+
+
+#-----------------------------------------------------------------------------
+# SNAP INDEX
+#-----------------------------------------------------------------------------
+def make_snap_index(cotrecho, nuareamont, geoms):
+    """
+    Snap index of BHO reaches
+
+    Args:
+        cotrecho (np.array) :: cotrecho of reaches
+        nuareamont (np.array) :: drainage area of reaches [km2]
+        geoms (np.array) :: shapely line geometries (object array)
+
+    Returns:
+        index (dict) :: 'cotrecho', 'nuareamont', 'geoms' and 'tree' (STRtree)
+    """
+    shapely = _import_shapely()
+    geoms = np.asarray(geoms, dtype=object)
+    return {'cotrecho': np.asarray(cotrecho, dtype=np.int64),
+            'nuareamont': np.asarray(nuareamont, dtype=np.float64),
+            'geoms': geoms,
+            'tree': shapely.STRtree(geoms)}
+
+
+def dump_snap_index(index, filecache, key=''):
+    """ Save the snap index in .npz (geometries as WKB) """
+    shapely = _import_shapely()
+    wkb = shapely.to_wkb(index['geoms'])
+    offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(w) for w in wkb])
+    blob = np.frombuffer(b''.join(wkb), dtype=np.uint8)
+    with open(filecache, 'wb') as f:
+        np.savez(f, key=key, cotrecho=index['cotrecho'], nuareamont=index['nuareamont'],
+                 wkb=blob, offsets=offsets)
+
+
+def read_snap_index(filecache, key=None):
+    """
+    Read the snap index from .npz
+
+    Args:
+        filecache (str) :: file of .dump_snap_index
+        key (str) :: expected key (None -> not checked)
+
+    Returns:
+        index (dict) :: see .make_snap_index (None if key does not match)
+    """
+    shapely = _import_shapely()
+    with np.load(filecache) as f:
+        if key is not None and str(f['key']) != key:
+            return None
+        blob, offsets = f['wkb'].tobytes(), f['offsets']
+        cotrecho, nuareamont = f['cotrecho'], f['nuareamont']
+    wkb = [blob[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)]
+    return make_snap_index(cotrecho, nuareamont, shapely.from_wkb(wkb))
+
+
+def snap_index_from_file(file_gdf_bho, filecache=None):
+    """
+    Snap index of the BHO file (cached by the fingerprint of the file)
+
+    Args:
+        file_gdf_bho (str) :: geopackage of BHO drainage
+        filecache (str) :: optional .npz to keep the index between runs
+
+    Returns:
+        index (dict) :: see .make_snap_index
+    """
+    key = json.dumps(funcs_pipeline.file_fingerprint(file_gdf_bho))
+
+    if filecache and os.path.isfile(filecache):
+        index = read_snap_index(filecache, key)
+        if index is not None:
+            return index
+
+    gdf_tble_bho = funcs_io.read_gdf_bho(file_gdf_bho)
+    index = make_snap_index(gdf_tble_bho['cotrecho'].to_numpy(),
+                            gdf_tble_bho['nuareamont'].to_numpy(),
+                            np.asarray(gdf_tble_bho.geometry.values, dtype=object))
+    if filecache:
+        dump_snap_index(index, filecache, key)
+    return index
+
+
+
+
+#-----------------------------------------------------------------------------
+# SNAPPING
+#-----------------------------------------------------------------------------
+def rank_candidates(df_cand, max_dist=SNAP_MAX_DIST, k=SNAP_K, w_area=SNAP_W_AREA):
+    """
+    Rank the candidate reaches of each point by distance and area agreement
+
+    Args:
+        df_cand (pd.DataFrame) :: pairs 'posto', 'cotrecho', 'dist',
+                                  'area' (of gauge, NaN if unknown), 'nuareamont'
+        max_dist (float) :: search distance [degrees] (scale of distances)
+        k (int) :: candidates kept by point (None -> all)
+        w_area (float) :: weight of the area agreement
+
+    Returns:
+        df_snap (pd.DataFrame) :: columns HEADER_SNAP, sorted by posto and rank
+    """
+    dist = df_cand['dist'].to_numpy(dtype=float)
+    ratio = df_cand['nuareamont'].to_numpy(dtype=float)/df_cand['area'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        area_err = np.abs(np.log(ratio))
+    score = dist/max_dist + w_area*np.where(np.isfinite(area_err), area_err, 0.)
+
+    # rank inside each posto (sorted by posto, score and distance)
+    group = pd.factorize(df_cand['posto'], sort=True)[0]
+    order = np.lexsort((dist, score, group))
+    group = group[order]
+    first = np.r_[0, np.flatnonzero(np.diff(group)) + 1]
+    rank = np.arange(len(order)) - np.repeat(first, np.diff(np.r_[first, len(order)])) + 1
+    if k is not None:
+        order, rank = order[rank <= k], rank[rank <= k]
+
+    df = df_cand.iloc[order].copy()
+    df['rank'] = rank
+    df['area_diff_perc'] = 100.*(ratio[order] - 1.)
+    df['score'] = score[order]
+    return df[HEADER_SNAP].reset_index(drop=True)
+
+
+def snap_points(index, df_points, max_dist=SNAP_MAX_DIST, k=SNAP_K, w_area=SNAP_W_AREA):
+    """
+    Candidate reaches of points (gauges), ranked (see .rank_candidates)
+
+    Args:
+        index (dict) :: see .make_snap_index
+        df_points (pd.DataFrame) :: 'posto', 'lon', 'lat' and, optional,
+                                    'area' (drainage area of gauge [km2])
+        max_dist (float) :: search distance [degrees]
+        k (int) :: candidates kept by point
+        w_area (float) :: weight of the area agreement
+
+    Returns:
+        df_snap (pd.DataFrame) :: columns HEADER_SNAP
+    """
+    shapely = _import_shapely()
+    tree, geoms = index['tree'], index['geoms']
+    points = shapely.points(df_points['lon'].to_numpy(dtype=float),
+                            df_points['lat'].to_numpy(dtype=float))
+
+    # all reaches within max_dist (pairs point x reach)
+    ip, ig = tree.query(points, predicate='dwithin', distance=max_dist)
+
+    # nearest reach of points without candidates
+    miss = np.setdiff1d(np.arange(len(points)), ip)
+    if len(miss):
+        (jp, jg) = tree.query_nearest(points[miss])
+        ip = np.concatenate((ip, miss[jp]))
+        ig = np.concatenate((ig, jg))
+
+    area = df_points['area'].to_numpy(dtype=float) if 'area' in df_points else np.full(len(points), np.nan)
+    df_cand = pd.DataFrame({'posto': df_points['posto'].to_numpy()[ip],
+                            'cotrecho': index['cotrecho'][ig],
+                            'dist': shapely.distance(points[ip], geoms[ig]),
+                            'area': area[ip],
+                            'nuareamont': index['nuareamont'][ig]})
+    return rank_candidates(df_cand, max_dist, k, w_area)
+
+
+def gauge_mapping(df_snap, area_tol=SNAP_AREA_TOL, max_dist=SNAP_MAX_DIST):
+    """
+    Mapping gauge <-> cotrecho from the best candidate of each gauge
+
+    Args:
+        df_snap (pd.DataFrame) :: see .snap_points
+        area_tol (float) :: maximum |area_diff_perc| [%] of gauges with
+                            known area (None -> no check)
+        max_dist (float) :: maximum distance [degrees] (None -> no check,
+                            e.g. to accept the nearest reach beyond it)
+
+    Returns:
+        dict_posto_cotrecho (dict) :: {posto: cotrecho}
+        dict_cotrecho_posto (dict) :: {cotrecho: [postos]}
+    """
+    best = df_snap[df_snap['rank'] == 1]
+    if area_tol is not None:
+        diff = best['area_diff_perc'].abs()
+        best = best[diff.isna() | (diff <= area_tol)]
+    if max_dist is not None:
+        best = best[best['dist'] <= max_dist]
+
+    dict_posto_cotrecho = dict(zip(best['posto'].tolist(), best['cotrecho'].tolist()))
+    dict_cotrecho_posto = best.groupby('cotrecho')['posto'].agg(list).to_dict()
+    return dict_posto_cotrecho, dict_cotrecho_posto
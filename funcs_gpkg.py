@@ -6,6 +6,7 @@
 
 import pandas as pd
 import geopandas as gpd
+import funcs_instrument
 
 
 
@@ -13,6 +14,7 @@ import geopandas as gpd
 # FUNCTIONS TO INSERT NEW COLUMNS IN BHO TABLE AND EXPORT AS GEOPACKAGE
 #-----------------------------------------------------------------------------
 
+@funcs_instrument.timed()
 def f_dicts_to_bho_gpkg(
         gdf_tble_bho,
         dict_bho_targets,
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of stages: nested timed spans, memory and run profiles
+    replaces funcs_decorators (measure_time, block_print)
+
+@author: Mino Sorribas
+
+@info:
+    - a span measures a stage: wall time, cpu time, items processed,
+      current/maximum RSS of the process and, with trace_memory, the
+      peak of traced memory (tracemalloc) inside the span
+    - spans are nested (path 'parent/child') and aggregated by path
+      (calls, totals), so the profile stays small for repeated calls
+    - with span(...) as context manager, @timed() as decorator, or
+      begin(...)/end(...) around blocks of flat scripts; end(frame) of an
+      outer span also closes spans left open inside it (e.g. by an
+      exception between begin and end)
+    - progress replaces the prints of each iteration: rate-limited
+      messages (every 'interval' seconds) with throughput and remaining
+      time, items counted in the span and a quiet mode (see .set_progress)
+    - the profile of the run is saved as JSON and CSV (see .dump_profile)
+    - psutil is optional (current RSS), see .rss_mb
+
+@usage:
+    start_profile('solver_base')
+    with span('solver_loop'):
+        prog = new_progress(len(list_c), 'downscaling')
+        for c in list_c:
+            ...
+            update_progress(prog)
+        close_progress(prog)
+    dump_profile('profile_solver_base')
+
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import tracemalloc
+from functools import wraps
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# state of the run (see .start_profile)
+_STATE = {}
+
+# defaults of the progress of loops (see .set_progress)
+PROGRESS = {'interval': 2., 'quiet': False}
+
+# columns of the CSV profile
+PROFILE_COLUMNS = ['path', 'name', 'depth', 'calls', 'start_s', 'wall_s', 'cpu_s',
+                   'items', 'items_per_s', 'peak_traced_mb', 'rss_mb', 'maxrss_mb']
+
+
+
+
+#-----------------------------------------------------------------------------
+# MEMORY OF THE PROCESS
+#-----------------------------------------------------------------------------
+def maxrss_mb():
+    """ Maximum resident set size of the process [MB] (None if not available) """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss/2**20 if sys.platform == 'darwin' else rss/2**10
+
+
+def rss_mb():
+    """ Current resident set size of the process [MB] (None if not available) """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss/2**20
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+
+
+#-----------------------------------------------------------------------------
+# SPANS
+#-----------------------------------------------------------------------------
+def start_profile(name='run', trace_memory=False):
+    """
+    Start (or restart) the profile of a run
+
+    Args:
+        name (str) :: name of the run (e.g. name of the script)
+        trace_memory (bool) :: True to trace python/numpy allocations
+                               (tracemalloc, slows python loops ~2x)
+    """
+    if tracemalloc.is_tracing() and _STATE.get('trace_memory'):
+        tracemalloc.stop()
+    _STATE.clear()
+    _STATE.update(name=name,
+                  date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                  t0=time.perf_counter(),
+                  c0=time.process_time(),
+                  trace_memory=trace_memory,
+                  records={},
+                  stack=[])
+    if trace_memory:
+        tracemalloc.start()
+
+
+def stop_profile():
+    """ Stop tracing memory (the records of the profile are kept) """
+    if tracemalloc.is_tracing() and _STATE.get('trace_memory'):
+        tracemalloc.stop()
+    _STATE['trace_memory'] = False
+
+
+def _state():
+    if not _STATE:
+        start_profile()
+    return _STATE
+
+
+def _traced_peak():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]/2**20
+    return None
+
+
+def begin(name, items=0):
+    """
+    Open a span (nested in the current one)
+
+    Returns:
+        frame (dict) :: open span, see .add_items and .end
+    """
+    st = _state()
+    stack = st['stack']
+    parent = stack[-1] if stack else None
+
+    # traced peak of the parent so far, then a new peak for the child
+    peak = _traced_peak()
+    if peak is not None:
+        if parent is not None:
+            parent['peak'] = max(parent['peak'] or 0., peak)
+        tracemalloc.reset_peak()
+
+    frame = {'name': name,
+             'path': parent['path'] + '/' + name if parent else name,
+             'depth': len(stack),
+             'items': items or 0,
+             'peak': _traced_peak(),
+             't0': time.perf_counter(),
+             'c0': time.process_time()}
+    stack.append(frame)
+    return frame
+
+
+def end(frame=None):
+    """
+    Close the current span, or unwind the stack down to the given span
+
+    Args:
+        frame (dict) :: open span (see .begin), spans still open inside it
+                        are closed (and recorded) first (None -> current span)
+
+    Returns:
+        rec (dict) :: measurements of this call
+    """
+    st = _state()
+    stack = st['stack']
+    if not stack or (frame is not None and not any(f is frame for f in stack)):
+        raise RuntimeError("span '{}' is not open"
+                           .format(frame['name'] if frame else None))
+    while frame is not None and stack[-1] is not frame:
+        _close(st)
+    return _close(st)
+
+
+def _close(st):
+    """ Close the span at the top of the stack (see .end) """
+    stack = st['stack']
+    frame = stack.pop()
+
+    peak = _traced_peak()
+    if peak is not None:
+        frame['peak'] = max(frame['peak'] or 0., peak)
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'] or 0., frame['peak'])
+
+    rec = {'path': frame['path'],
+           'name': frame['name'],
+           'depth': frame['depth'],
+           'calls': 1,
+           'start_s': frame['t0'] - st['t0'],
+           'wall_s': time.perf_counter() - frame['t0'],
+           'cpu_s': time.process_time() - frame['c0'],
+           'items': frame['items'],
+           'peak_traced_mb': frame['peak'],
+           'rss_mb': rss_mb(),
+           'maxrss_mb': maxrss_mb()}
+
+    # aggregate by path
+    agg = st['records'].get(rec['path'])
+    if agg is None:
+        st['records'][rec['path']] = dict(rec)
+    else:
+        agg['calls'] += 1
+        for k in ('wall_s', 'cpu_s', 'items'):
+            agg[k] += rec[k]
+        for k in ('peak_traced_mb', 'rss_mb', 'maxrss_mb'):
+            if rec[k] is not None:
+                agg[k] = max(agg[k] or 0., rec[k])
+    return rec
+
+
+@contextmanager
+def span(name, items=0):
+    """ Timed span as context manager (yields the frame, see .add_items) """
+    frame = begin(name, items)
+    try:
+        yield frame
+    finally:
+        end(frame)
+
+
+def timed(name=None):
+    """ Decorator: each call of the function is a span (default: function name) """
+    def decorator(f):
+        label = name or f.__name__
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_items(n=1, frame=None):
+    """ Count items processed in the span (default: current span) """
+    if frame is None:
+        stack = _state()['stack']
+        if not stack:
+            return
+        frame = stack[-1]
+    frame['items'] += n
+
+
+
+
+#-----------------------------------------------------------------------------
+# PROGRESS (RATE-LIMITED)
+#-----------------------------------------------------------------------------
+def set_progress(interval=None, quiet=None):
+    """
+    Defaults of the progress of loops (for the whole run)
+
+    Args:
+        interval (float) :: minimum seconds between messages
+        quiet (bool) :: True to print no messages (items are still counted)
+    """
+    if interval is not None:
+        PROGRESS['interval'] = interval
+    if quiet is not None:
+        PROGRESS['quiet'] = quiet
+
+
+def new_progress(total=None, label='progress', interval=None, quiet=None,
+                 count_items=True, count=0):
+    """
+    Progress of a loop, printed at most every 'interval' seconds
+        with throughput (items/s) and remaining time (if total is known)
+
+    Args:
+        total (int) :: number of iterations (None if unknown)
+        label (str) :: message, e.g. 'downscaling'
+        interval (float) :: minimum seconds between messages (None -> default)
+        quiet (bool) :: True to print no messages (None -> default)
+        count_items (bool) :: True to count iterations as items of the
+                              current span
+        count (int) :: iterations already done (e.g. resumed run), not
+                       considered in the throughput
+
+    Returns:
+        prog (dict) :: see .update_progress and .close_progress
+    """
+    frame = None
+    if count_items:
+        stack = _state()['stack']
+        frame = stack[-1] if stack else None
+    t0 = time.perf_counter()
+    return {'total': total, 'label': label,
+            'interval': PROGRESS['interval'] if interval is None else interval,
+            'quiet': PROGRESS['quiet'] if quiet is None else quiet,
+            'count': count, 'count0': count, 'frame': frame, 't0': t0, 'tlast': t0}
+
+
+def _fmt_seconds(sec):
+    """ Seconds as 'h:mm:ss' (or 'm:ss') """
+    m, s = divmod(int(round(sec)), 60)
+    h, m = divmod(m, 60)
+    return '{}:{:02d}:{:02d}'.format(h, m, s) if h else '{}:{:02d}'.format(m, s)
+
+
+def _print_progress(prog, final=False):
+    elapsed = time.perf_counter() - prog['t0']
+    done = prog['count'] - prog['count0']
+    rate = done/elapsed if elapsed > 0. else 0.
+
+    msg = " - {}: {}".format(prog['label'], prog['count'])
+    if prog['total']:
+        msg += "/{} ({:.1f}%)".format(prog['total'], 100.*prog['count']/prog['total'])
+    msg += " {:.1f}/s".format(rate)
+    if final:
+        msg += " in {}".format(_fmt_seconds(elapsed))
+    elif prog['total'] and rate > 0.:
+        msg += " eta {}".format(_fmt_seconds(max(prog['total'] - prog['count'], 0)/rate))
+    print(msg)
+
+
+def update_progress(prog, n=1):
+    """ Add n iterations (prints if the interval has passed) """
+    prog['count'] += n
+    if prog['frame'] is not None:
+        prog['frame']['items'] += n
+    if prog['quiet']:
+        return
+    t = time.perf_counter()
+    if t - prog['tlast'] >= prog['interval']:
+        prog['tlast'] = t
+        _print_progress(prog)
+
+
+def close_progress(prog):
+    """ Final message of the loop (total time and throughput) """
+    if not prog['quiet']:
+        _print_progress(prog, final=True)
+
+
+
+
+#-----------------------------------------------------------------------------
+# PROFILE OF THE RUN
+#-----------------------------------------------------------------------------
+def get_profile():
+    """
+    Profile of the run
+
+    Returns:
+        profile (dict) :: 'name', 'date', 'wall_s', 'cpu_s', 'maxrss_mb'
+                          and 'spans' (aggregated by path, in order of start)
+    """
+    st = _state()
+    spans = sorted(st['records'].values(), key=lambda r: r['start_s'])
+    for r in spans:
+        r['items_per_s'] = r['items']/r['wall_s'] if r['items'] and r['wall_s'] > 0. else None
+    return {'name': st['name'],
+            'date': st['date'],
+            'wall_s': time.perf_counter() - st['t0'],
+            'cpu_s': time.process_time() - st['c0'],
+            'maxrss_mb': maxrss_mb(),
+            'spans': spans}
+
+
+def print_profile(profile=None):
+    """ Table of spans on screen """
+    profile = profile or get_profile()
+    print(" Profile of {} ({:.1f} s)".format(profile['name'], profile['wall_s']))
+    for r in profile['spans']:
+        print("  {:<40s} {:>6d} x {:>10.2f} s {:>10.2f} cpu {:>10}".format(
+            '  '*r['depth'] + r['name'], r['calls'], r['wall_s'], r['cpu_s'],
+            r['items'] or ''))
+
+
+def dump_profile(filebase=None, verbose=True):
+    """
+    Save the profile of the run as '<filebase>.json' and '<filebase>.csv'
+
+    Args:
+        filebase (str) :: path without extension (default 'profile_<name>')
+        verbose (bool) :: print the table of spans
+
+    Returns:
+        profile (dict) :: see .get_profile
+    """
+    profile = get_profile()
+    filebase = filebase or 'profile_{}'.format(profile['name'])
+
+    with open(filebase + '.json', 'w') as f:
+        json.dump(profile, f, indent=1)
+
+    with open(filebase + '.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=PROFILE_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(profile['spans'])
+
+    if verbose:
+        print_profile(profile)
+    return profile
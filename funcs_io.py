@@ -14,11 +14,13 @@ import pandas as pd
 import geopandas as gpd
 import pickle
 import json
+import funcs_instrument
 
 
 #-----------------------------------------------------------------------------
 # FUNCTIONS TO READ MGB TOPOLOGY
 #-----------------------------------------------------------------------------
+@funcs_instrument.timed()
 def read_tble_mini(file_mini, mgb_version = 'MGB-AS', set_index = None):
     """
     Read mini.xlsx, adjust headers and return as dataframe
@@ -67,7 +69,23 @@ def read_tble_mini(file_mini, mgb_version = 'MGB-AS', set_index = None):
 #-----------------------------------------------------------------------------
 # FUNCTIONS TO READ AND FILTER TABLE TYPE 1
 #-----------------------------------------------------------------------------
-def f_test_area(a_diff_perc, area_to_test):
+# tolerance table for type 1 association (area_lb, area_ub, max_error %)
+# ad hoc criteria by Vinicius Siqueira (MATLAB algorithm for type 1)
+TBLE_AREA_TOL_T1 = (
+    (0., 1500., 30.),
+    (1500., 3000., 25.),
+    (3000., 5000., 20.),
+    (5000., 10000., 15.),
+    (10000., 20000., 10.),
+    (20000., 50000., 7.),
+    (50000., 200000., 5.),
+    (200000., 500000., 3.),
+    (500000., 1000000., 2.),
+    (1000000., 6000000., 1.5),
+    )
+
+
+def f_test_area(a_diff_perc, area_to_test, tble_tol=None):
     """
     Function to test if error in area is acceptable for type 1 association
         based on table below
@@ -87,6 +105,8 @@ def f_test_area(a_diff_perc, area_to_test):
     Args:
         a_diff_perc (float) :: relative error in area
         area_to_test (float) :: drainage area [km2]
+        tble_tol (tuple) :: rows of (area_lb, area_ub, max_error)
+                            None -> TBLE_AREA_TOL_T1 (table above)
 
     Returns:
         accept (bool):: True(False) for accepted (or not)
@@ -94,24 +114,21 @@ def f_test_area(a_diff_perc, area_to_test):
     """
 
     # sets table - based on MATLAB algorithm for type 1
-    tble_area_min = [0., 1500., 3000., 5000., 10000., 20000., 50000., 200000., 500000., 1000000.]
-    tble_area_max = [1500., 3000., 5000., 10000., 20000., 50000., 200000., 500000., 1000000., 6000000.]
-    tble_area_tol = [30., 25., 20., 15., 10., 7., 5., 3., 2., 1.5]
+    tble_tol = TBLE_AREA_TOL_T1 if tble_tol is None else tble_tol
 
     # begin table search
     accept = False
-    npts = len(tble_area_tol)
-    for j in range(npts):
+    for area_min, area_max, area_tol in tble_tol:
         # find position in table
-        if (area_to_test >= tble_area_min[j]) & (area_to_test < tble_area_max[j]):
+        if (area_to_test >= area_min) & (area_to_test < area_max):
             # test if is acceptable
-            a_thre = tble_area_tol[j]
+            a_thre = area_tol
             accept = a_diff_perc < a_thre
             break
     return accept
 
 
-def f_area_acceptable_t1(row, iostat=False):
+def f_area_acceptable_t1(row, iostat=False, tble_tol=None):
     """
     Row-based function to test area errors as in criteria for type 1 association
 
@@ -121,6 +138,7 @@ def f_area_acceptable_t1(row, iostat=False):
     Args:
         row (pd.Series)  :: row of df_tble_t1
         iostat (bool)    :: true/false to print on screen
+        tble_tol (tuple) :: tolerance table (see .f_test_area)
 
     Returns:
         accept (pd.DataFrame) :: True/False for each row (same index as dataframe)
@@ -132,7 +150,7 @@ def f_area_acceptable_t1(row, iostat=False):
     a_diff_perc = np.abs(row['diffp_areamont'])
 
     # function to test area
-    accept = f_test_area(a_diff_perc, area_to_test)
+    accept = f_test_area(a_diff_perc, area_to_test, tble_tol)
 
     if iostat == True:
         if accept:
@@ -145,7 +163,8 @@ def f_area_acceptable_t1(row, iostat=False):
 
 
 
-def read_tble_t1(file_tble_t1, sheet_name='Data', tol_t1 = True, tol_diffp = None):
+def read_tble_t1(file_tble_t1, sheet_name='Data', tol_t1 = True, tol_diffp = None,
+                 tble_tol = None):
     """
     Read and pre-processing of 'tabela_tipo_1.xlsx'
         and returns as dataframe
@@ -156,6 +175,7 @@ def read_tble_t1(file_tble_t1, sheet_name='Data', tol_t1 = True, tol_diffp = Non
         tol_t1 (bool)       :: True  - apply f_area_acceptable
         tol_diffp (float)   :: None (default), else apply filter by absolute
                                error in area <= tol_diffp
+        tble_tol (tuple)    :: tolerance table of tol_t1 (see .f_test_area)
 
     Returns:
         df_tble_t1(pd.DataFrame) :: table type 1
@@ -210,7 +230,22 @@ def read_tble_t1(file_tble_t1, sheet_name='Data', tol_t1 = True, tol_diffp = Non
         df_tble_t1 = df_tble_t1[header_xls]
         print(" -- table 1 from python")
 
+    df_tble_t1 = prepare_tble_t1(df_tble_t1, tol_t1, tol_diffp, tble_tol)
 
+    return df_tble_t1
+
+
+
+
+def prepare_tble_t1(df_tble_t1, tol_t1 = True, tol_diffp = None, tble_tol = None):
+    """
+    Pre-processing of table type 1 (see .read_tble_t1)
+        for tables already in memory (e.g. funcs_matlab.make_table_t1)
+
+    Returns:
+        df_tble_t1(pd.DataFrame) :: table type 1
+    """
+    df_tble_t1 = df_tble_t1.copy()
 
     # calculate relative error in drainage area
     # reference to bho (#ms)
@@ -228,7 +263,7 @@ def read_tble_t1(file_tble_t1, sheet_name='Data', tol_t1 = True, tol_diffp = Non
 
     # filter based on table 1 criteria
     if tol_t1:
-        iaccept = df_tble_t1.apply(f_area_acceptable_t1,axis=1)
+        iaccept = df_tble_t1.apply(f_area_acceptable_t1,axis=1,tble_tol=tble_tol)
         df_tble_t1 = df_tble_t1[iaccept]
 
     # optional: remove rows by tol_diffp
@@ -243,13 +278,16 @@ def read_tble_t1(file_tble_t1, sheet_name='Data', tol_t1 = True, tol_diffp = Non
 #-----------------------------------------------------------------------------
 # FUNCTIONS TO READ BHO GEOPACKAGE OR TABLE
 #-----------------------------------------------------------------------------
-def read_gdf_bho(file_gdf_bho):
+@funcs_instrument.timed()
+def read_gdf_bho(file_gdf_bho, bbox=None):
     """
     Read geopackage file with BHO drainage (cotrecho)
         adjust dtypes and returns as geodataframe
 
     Args:
         file_gdf_bho(str)  :: pathfile to BHO drainage in .gpkg/shp
+        bbox(tuple)  :: (xmin, ymin, xmax, ymax) to read only the reaches
+                        intersecting the box (None -> all)
 
     Returns:
         gdf_tble_bho (gpd.GeoDataFrame) :: table for BHO drainage (polyline)
@@ -258,7 +296,7 @@ def read_gdf_bho(file_gdf_bho):
         - see required columns in variable 'cols'
 
     """
-    gdf_tble_bho = gpd.GeoDataFrame.from_file(file_gdf_bho)
+    gdf_tble_bho = gpd.GeoDataFrame.from_file(file_gdf_bho, bbox=bbox)
 
     # save crs for later
     crs = gdf_tble_bho.crs
@@ -394,6 +432,7 @@ def read_tble_bho(file_tble_bho):
 #-----------------------------------------------------------------------------
 # FUNCTIONS TO DUMP AND LOAD THE DOWNSCALING PRE-PROCESSING RESULTS (DICTS)
 #-----------------------------------------------------------------------------
+@funcs_instrument.timed()
 def dump_the_dicts(
         dict_bho_mini_t1_post,
         dict_bho_mini_t2_post,
@@ -475,6 +514,7 @@ def dump_the_dicts(
 
 
 
+@funcs_instrument.timed()
 def read_the_dicts(pathin='./'):
     """
     Read main dictionaries
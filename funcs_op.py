@@ -11,13 +11,13 @@ Main functions for OPerations
     - associate_domain using bbox OR pre-processed midpoints (reduce memory)
 
 @info:
-    - the @block_print decorator cane be used to enable-disable printing.
+    - stages are timed spans (funcs_instrument.timed) and long loops
+      report a rate-limited progress instead of printing each iteration
 
 
 """
 import sys
 import pickle
-import time
 from collections import defaultdict
 import warnings
 import itertools
@@ -26,10 +26,12 @@ import numpy as np
 import pandas as pd
 import geopandas as gpd
 
-from funcs_decorators import *
+import funcs_topology
+import funcs_instrument
 
 
 
+@funcs_instrument.timed()
 def associate_bho_mini_domain(gdf_tble_bho,
                               gdf_mgb_catchments,
                               node_pos = 0.5,
@@ -128,7 +130,8 @@ def associate_bho_mini_domain(gdf_tble_bho,
 
 
 
-def make_tble_t0(df_tble_mini, df_tble_bho, file_bho_inter):
+@funcs_instrument.timed()
+def make_tble_t0(df_tble_mini, df_tble_bho, file_bho_inter, fileout='table_t0.xlsx'):
     """
     Make initial table (type 0) like the MGB x BHO domain and
         save as "table_t0.xlsx"
@@ -137,6 +140,7 @@ def make_tble_t0(df_tble_mini, df_tble_bho, file_bho_inter):
         df_tble_mini (pd.DataFrame) :: table of mini.gtp (.xlsx)
         df_tble_bho (pd.DataFrame) :: table of BHO drainage
         fileout_bho_inter (str) :: pathfile to BHO points intersected with MGB
+        fileout (str) :: pathfile of the table (None -> not saved)
 
     Returns:
         df_pts (pd.DataFrame) :: initial table of BHO x MGB for domain
@@ -173,7 +177,8 @@ def make_tble_t0(df_tble_mini, df_tble_bho, file_bho_inter):
 
     # save as excel table
     df_xls = df_pts.drop('geometry',axis=1)
-    df_xls.to_excel('table_t0.xlsx',index=False)
+    if fileout is not None:
+        df_xls.to_excel(fileout,index=False)
 
     # save as gpkg
     #df_pts.to_file('table_t0.gpkg',driver='GPKG') #some dtype error here
@@ -184,6 +189,7 @@ def make_tble_t0(df_tble_mini, df_tble_bho, file_bho_inter):
 
 
 
+@funcs_instrument.timed()
 def associate_bho_mini_t3(dict_bho_mini):
     """
     Associates BHO drainage (cotrecho) with MGB catchments (mini)
@@ -208,7 +214,7 @@ def associate_bho_mini_t3(dict_bho_mini):
 
 
 
-@block_print   #imported from funcs_decorators.
+@funcs_instrument.timed()
 def define_parameters_t3(dict_bho_mini_t3, df_tble_mini, df_tble_bho):
     """
     Defines parameters for type 3 features
@@ -230,15 +236,10 @@ def define_parameters_t3(dict_bho_mini_t3, df_tble_mini, df_tble_bho):
     """
     dict_parameters_t3 = defaultdict(dict)
 
-    conta = 0
-
-    itot = len(dict_bho_mini_t3)
-    tot = float(itot)
-    hh = 100./tot
+    prog = funcs_instrument.new_progress(len(dict_bho_mini_t3), 'type 3 parameters')
 
     for cotrecho, mini in dict_bho_mini_t3.items():
-        conta = conta+1
-        print("  extracting type 3 parameters: {}%".format(round(hh*conta,2)))
+        funcs_instrument.update_progress(prog)
         # mgb related parameters
         imini = df_tble_mini['mini'] == mini
         area_km2 = df_tble_mini.loc[imini,'area_km2'].values[0]
@@ -262,6 +263,7 @@ def define_parameters_t3(dict_bho_mini_t3, df_tble_mini, df_tble_bho):
 
         dict_parameters_t3[cint] = parameters
 
+    funcs_instrument.close_progress(prog)
     return dict_parameters_t3
 
 
@@ -366,6 +368,7 @@ def define_bho_target_t12(df_tble_bho, area_threshold_t12):
 
 
 
+@funcs_instrument.timed()
 def merge_topologies_t1(df_tble_t1, df_tble_mini, df_tble_bho):
     """
     Merge topology (both MGB and BHO) at table type 1
@@ -411,7 +414,6 @@ def merge_topologies_t1(df_tble_t1, df_tble_mini, df_tble_bho):
     return df_tble_topo_t1
 
 
-@block_print
 def check_route_t2(codafl, codexu, df_tble_bho):
     """
     Check the connectivity between codafl and codexu (both cotrechos of BHO)
@@ -458,7 +460,6 @@ def check_route_t2(codafl, codexu, df_tble_bho):
     # loop for downstream walk (at bho) from codafl towards codexu
     desce = True
     codigo = codafl   #starting cotrecho
-    print(" > walking route from {}".format(codafl) )
     while desce:
 
         # find index of current cotrecho
@@ -480,7 +481,6 @@ def check_route_t2(codafl, codexu, df_tble_bho):
 
             # test if is the end position
             if codjus == codexu:
-                print(" - done: cotrecho {} walked to {} in {} steps".format(codafl,codexu,conta))
                 desce = False
                 continue
                 #note: codexu is also stored in the list
@@ -490,7 +490,6 @@ def check_route_t2(codafl, codexu, df_tble_bho):
 
         elif status == 0:
             # end of line -> fails and drop current route
-            print(" - fail: cotrecho {} without nutrjus".format(codigo))
             desce = False
             routes.pop(codafl)        # remove current route
             continue
@@ -539,7 +538,7 @@ def check_route_t2(codafl, codexu, df_tble_bho):
 
 
 
-@block_print
+@funcs_instrument.timed()
 def screening_candidates_t2(df_tble_topo_t1, df_tble_mini, df_tble_bho):
     """
     Screening candidates routes for type 2 association
@@ -575,13 +574,8 @@ def screening_candidates_t2(df_tble_topo_t1, df_tble_mini, df_tble_bho):
 
     """
 
-    # "progress bar"
-    tot = float(len(df_tble_topo_t1))
-    hh = 100./tot
-
-    # begin timer and iteration counter
-    start = time.time()
-    conta = 0
+    # progress of the loop
+    prog = funcs_instrument.new_progress(len(df_tble_topo_t1), 'screening type 2')
 
     # main dictionaries for results
     dict_routes_t2 = {}
@@ -595,8 +589,7 @@ def screening_candidates_t2(df_tble_topo_t1, df_tble_mini, df_tble_bho):
     # loop over table 1 targets
     for row in df_tble_topo_t1.itertuples():
 
-        conta = conta+1
-        print(" screening: {}%".format(round(hh*conta,4)))
+        funcs_instrument.update_progress(prog)
 
         # current row
         mini = row.mini
@@ -604,7 +597,6 @@ def screening_candidates_t2(df_tble_topo_t1, df_tble_mini, df_tble_bho):
         codexu  = row.cotrecho   # table 1 outlet
         cobacia = row.cobacia
 
-        print("  - mini: {} cotrecho: {} cobacia: {} ".format(mini,codexu,cobacia))
 
         # ignore if cant find type 1 association
         if np.isnan(codexu):
@@ -656,7 +648,6 @@ def screening_candidates_t2(df_tble_topo_t1, df_tble_mini, df_tble_bho):
                     if len(runover)>0:
                         status = 50
                         fail = True
-                        print(" - status 50 (funcs_op.screening_candidates_2)")
                         continue
                         #TODO: could just break in 1st fail, but wont record
 
@@ -694,12 +685,11 @@ def screening_candidates_t2(df_tble_topo_t1, df_tble_mini, df_tble_bho):
         dict_mini_afl_t2[mini] = list(local_routes.keys())
 
 
-    finish = time.time()
-    print("  ... took {} seconds".format(round(finish-start,1)) )
+    funcs_instrument.close_progress(prog)
     return dict_routes_t2, dict_mini_afl_t2
 
 
-@block_print
+@funcs_instrument.timed()
 def associate_bho_mini_t2(dict_mini_afl_t2, dict_routes_t2, df_tble_mini):
     """
     Associates type 2 BHO drainage (cotrecho) with MGB catchments (mini)
@@ -745,15 +735,12 @@ def associate_bho_mini_t2(dict_mini_afl_t2, dict_routes_t2, df_tble_mini):
 
 
     # loop each mini with type 2 routes
-    hh = 100./float(len(dict_mini_afl_t2))
-    conta = 0
+    prog = funcs_instrument.new_progress(len(dict_mini_afl_t2), 'associating type 2')
     for k,v in dict_mini_afl_t2.items():
 
         mini, afluentes = k, v   #current  mini & starting points of each route
 
-        conta = conta+1
-        print(" associating type 2: {}%".format(round(hh*conta,4)))
-
+        funcs_instrument.update_progress(prog)
 
         # check dummy route
         nafl = len(afluentes)
@@ -785,11 +772,67 @@ def associate_bho_mini_t2(dict_mini_afl_t2, dict_routes_t2, df_tble_mini):
     # ensures dtypes as integer
     dict_bho_mini_t2 = {int(k):int(v) for k,v in dict_bho_mini_t2.items()}
 
+    funcs_instrument.close_progress(prog)
     return dict_bho_mini_t2, dict_mini_coddum_t2
 
 
 
-@block_print
+def explode_routes_t2(dict_bho_mini_t2, dict_mini_afl_t2, dict_routes_t2, dict_bho_mini_t1):
+    """
+    Flat table of type 2 routes, one row for each cotrecho of each route
+
+    Args:
+        see .define_parameters_t2
+
+    Returns:
+        df_routes (pd.DataFrame) :: columns
+            'imini' :: order of the mini (as in the former loops)
+            'mini' :: mini of reference
+            'codafl' :: inlet cotrecho of the route
+            'miniafl' :: upstream mini of the inlet (type 1)
+            'cotrecho' :: cotrecho in the route
+            'position' :: position of the cotrecho in the route
+
+    Notes:
+        - inlets after the first one without type 1 are skipped
+    """
+    list_imini, list_mini, list_afl, list_miniafl, list_route = [], [], [], [], []
+
+    # identify catchments (mini) with type 2 routes
+    miniref = list(set(dict_bho_mini_t2.values()))
+    for imini, mini in enumerate(miniref):
+        for codafl in dict_mini_afl_t2[mini]:
+
+            # identify upstream mini (must be in type 1 dict!)
+            miniafl = dict_bho_mini_t1.get(codafl,None)
+            if miniafl is None:
+                # error: didnt find upstream mini in dict_bho_mini_t1
+                print(" - issue: cotrecho {} (.define_parameters_t2)".format(codafl))
+                break
+
+            list_imini.append(imini)
+            list_mini.append(mini)
+            list_afl.append(codafl)
+            list_miniafl.append(miniafl)
+            list_route.append(dict_routes_t2[codafl])
+
+    nroute = np.array([len(r) for r in list_route], dtype=np.int64)
+    cotrechos = list(itertools.chain.from_iterable(list_route))
+    start = np.repeat(np.cumsum(nroute) - nroute, nroute)
+
+    df_routes = pd.DataFrame({
+        'imini': np.repeat(np.array(list_imini, dtype=np.int64), nroute),
+        'mini': np.repeat(np.array(list_mini, dtype=object), nroute),
+        'codafl': np.repeat(np.array(list_afl, dtype=np.int64), nroute),
+        'miniafl': np.repeat(np.array(list_miniafl, dtype=object), nroute),
+        'cotrecho': np.array(cotrechos, dtype=np.int64),
+        'position': np.arange(len(cotrechos), dtype=np.int64) - start,
+        })
+    return df_routes
+
+
+
+@funcs_instrument.timed()
 def define_parameters_t2(dict_bho_mini_t2,
                          dict_mini_afl_t2,
                          dict_routes_t2,
@@ -833,6 +876,10 @@ def define_parameters_t2(dict_bho_mini_t2,
          - stores values in list, so it can be serializable in json
          - repeats 'cotrecho', so it is easier to serialize parameters.
 
+         - routes are exploded into a flat table (see .explode_routes_t2)
+           and the areas are reduced by groupby (same values of the former
+           loops, up to rounding in the sums)
+
     #TODO: INCLUIR MINI AFLUENTE
 
    """
@@ -840,124 +887,61 @@ def define_parameters_t2(dict_bho_mini_t2,
 
     dict_bho_parameters_t2 = defaultdict(dict)
 
-
-    # identify catchments (mini) with type 2 routes
-    miniaux = list(dict_bho_mini_t2.values())
-    miniref = list(set(miniaux))
-
-    # loop each catchment
-    hh = 100./float(len(miniref))
-    conta = 0
-    for mini in miniref:
-
-        conta = conta+1
-        print("  extracting type 2 parameters: {}%".format(round(hh*conta,2)))
-
-        # initialize dicts to map relative positions
-        #  - such as for each inner cotrecho (key)
-        #    a) makes a list of "catchments upstream of cotrecho"
-        #    b) makes a list of "inlet cotrechos upstream of cotrecho"
-        #  - which are used to extract parameters such as local area factor
-        d_interno_minimon = defaultdict(list)    #{cotrecho_interno:[minimon]}
-        d_interno_afl     = defaultdict(list)    #{cotrecho_interno:[cotrecho_afl]}
-
-        # loops over 'inlet cotrechos' of current mini
-        for codafl in dict_mini_afl_t2[mini]:
-
-            # identify upstream mini (must be in type 1 dict!)
-            miniafl = dict_bho_mini_t1.get(codafl,None)
-            if miniafl is None:
-                # error: didnt find upstream mini in dict_bho_mini_t1
-                print(" - issue: cotrecho {} (.define_parameters_t2)".format(cotrecho))
-                break
-
-            # get cotrechos in this route
-            cotrechos_in_route = dict_routes_t2[codafl]
-
-            # check dummy route
-            #assert len(cotrechos_in_route)>1,"erro!"
-
-            # get partial info in route
-            ##testing
-            ##codexu_n1 = cotrechos_in_route[-1]              #only outlet (t1)
-            ##codigo_ini_ao_fim = [afl] + cotrechos_in_route  #include inlet
-            ##codigos_work = cotrechos_in_route[:-1]          #except outlet
-            cotrechos_work = cotrechos_in_route[:]            #whole route
-
-            for c in cotrechos_work:
-                d_interno_minimon[c].append(miniafl)  #include tag "upstream mini"
-                d_interno_afl[c].append(codafl)       #include tag "upstream codafl"
-
-
-        # store list of all mini upstream of current mini
-        list_minimonall = d_interno_minimon.values()
-        list_minimonall = set(list(itertools.chain.from_iterable(list_minimonall)))
-        list_minimonall = list(list_minimonall)
-
-
-        # we tagged the relative position for each cotrecho
-        # so we know which cotrecho is downstream of upstream mini/codafl
-        # ...
-
-        #---------------------------------------------------------
-        # calculate local cumulative drainage area (based on BHO)
-        #---------------------------------------------------------
-        # list of cotrechos to be processed
-        internos = list(d_interno_afl.keys())
-
-        # (1) each feature starts with its total drainage area
-        interno_acum = {}
-        for c in internos:
-            ic = df_tble_bho['cotrecho'] == c
-            areap = df_tble_bho.loc[ic,'nuareamont'].to_numpy()   #at point
-            interno_acum[c] = areap                   # np.array for calcs
-
-        # (2) removes "upstream inlets drainage area" of each feature
-        for c in internos:
-            for codafl in d_interno_afl[c]:
-                ia = df_tble_bho['cotrecho'] == codafl
-                amont = df_tble_bho.loc[ia,'nuareamont'].to_numpy()
-                if amont.size == 0:
-                    print('erro ao buscar area drenagem')
-                interno_acum[c] = interno_acum[c] - amont   #km2
-
-        #... now we have the "local total drainage area"
-
-        # (3) scale by the local area
-        acum_scale = sum(interno_acum.values())
-        for c in internos:
-            interno_acum[c] = interno_acum[c]/acum_scale  #<--
-
-        #print("  local drain area {} km2".format(acum_norm[0]))
-        #for c in internos:
-        #    print("   cotrecho {}: {} %".format(c,interno_acum[c]))
-
-
-        # Update dictionary with parameters
-        for c in internos:
-
-            # get total drainage area
-            ia = df_tble_bho['cotrecho']==c
-            atot = df_tble_bho.loc[ia,'nuareamont'].to_numpy()
-
-            # cotrecho ->int
-            codint = int(c)
-
-            # parameters
-            dict_bho_parameters_t2[codint] = {
-                'cotrecho': [codint],
-                'miniref': [mini],                       # mini of reference
-                'nuareamont': atot.tolist(),             # drainage area
-                'fracarea': interno_acum[c].tolist(),    # % of total local area (bho)
-                'minimon': d_interno_minimon[c],         # list of upstream neighbour catchments (mini) relative to bho
-                'minimonall': list_minimonall,              # list of all upstream neigh catchments of miniref
-                }
+    # flat table of routes (one row per cotrecho of each route)
+    df_routes = explode_routes_t2(dict_bho_mini_t2, dict_mini_afl_t2,
+                                  dict_routes_t2, dict_bho_mini_t1)
+    if df_routes.empty:
+        return dict_bho_parameters_t2
+
+    # drainage area of cotrechos and of inlets (single join)
+    s_area = df_tble_bho.set_index('cotrecho')['nuareamont']
+    df_routes['area'] = s_area.reindex(df_routes['cotrecho']).to_numpy()
+    df_routes['area_afl'] = s_area.reindex(df_routes['codafl']).to_numpy()
+    if df_routes['area_afl'].isna().any():
+        print('erro ao buscar area drenagem')
+
+    #---------------------------------------------------------
+    # calculate local cumulative drainage area (based on BHO)
+    #---------------------------------------------------------
+    # (1) total drainage area of each feature (2) minus upstream inlets
+    grp = df_routes.groupby(['imini', 'cotrecho'], sort=False)
+    df_par = grp.agg(mini=('mini', 'first'),
+                     area=('area', 'first'),
+                     area_afl=('area_afl', 'sum'),
+                     minimon=('miniafl', list))
+    df_par['acum'] = df_par['area'] - df_par['area_afl']
+
+    # (3) scale by the local area of the mini
+    df_par['fracarea'] = df_par['acum']/df_par.groupby(level='imini')['acum'].transform('sum')
+
+    # list of all mini upstream of each mini
+    dict_minimonall = {}
+    for imini, minimon in df_par['minimon'].groupby(level='imini', sort=False):
+        dict_minimonall[imini] = list(set(itertools.chain.from_iterable(minimon)))
+
+
+    # Update dictionary with parameters (later mini overwrite shared cotrechos)
+    for (imini, c), row in zip(df_par.index, df_par.itertuples(index=False)):
+
+        # cotrecho ->int
+        codint = int(c)
+
+        # parameters
+        dict_bho_parameters_t2[codint] = {
+            'cotrecho': [codint],
+            'miniref': [row.mini],                   # mini of reference
+            'nuareamont': [row.area],                # drainage area
+            'fracarea': [row.fracarea],              # % of total local area (bho)
+            'minimon': row.minimon,                  # list of upstream neighbour catchments (mini) relative to bho
+            'minimonall': dict_minimonall[imini],    # list of all upstream neigh catchments of miniref
+            }
 
     return dict_bho_parameters_t2
 
 
 
 
+@funcs_instrument.timed()
 def validate_t123(df_tble_bho,
                   dict_bho_domain,
                   area_threshold_t12,
@@ -1092,6 +1076,66 @@ def validate_t123(df_tble_bho,
 
 
 
+def nearest_downstream_t1(df_tble_bho, dict_bho_mini_t1):
+    """
+    Nearest type 1 downstream of every BHO reach, in a single pass
+        values are propagated from outlets to headwaters by levels
+        (see funcs_topology.propagate_downstream)
+
+    Args:
+        df_tble_bho (pd.DataFrame) :: table of BHO drainage
+        dict_bho_mini_t1 (dict) :: {cotrecho:mini} of type 1
+
+    Returns:
+        df_jus_t1 (pd.DataFrame) :: indexed by cotrecho, with columns
+            't1_cotrecho' :: nearest type 1 downstream (-1 if not found)
+            't1_mini' :: mini of the type 1 (-1 if not found)
+            't1_prev' :: reach just upstream of the type 1 on the path
+            'hops' :: number of reaches downstream to the type 1 (or the end)
+            'end' :: 't1', 'coast' (no nutrjus) or 'dead_end' (nutrjus
+                     missing in the table)
+
+    Notes:
+        - the search starts at the downstream reach (a type 1 reach
+          looks for the next type 1 downstream)
+    """
+    topo = funcs_topology.topology_from_bho(df_tble_bho)
+    cot, jus, down = topo['cotrecho'], topo['nutrjus'], topo['down']
+    n = len(cot)
+    rows = np.arange(n)
+
+    # rows just upstream of a type 1
+    is_t1 = np.isin(cot, np.fromiter(dict_bho_mini_t1.keys(), dtype=np.int64))
+    take = np.zeros(n, dtype=bool)
+    take[down >= 0] = is_t1[down[down >= 0]]
+
+    found = funcs_topology.propagate_downstream(topo, down, take, fill=-1)
+    prev = funcs_topology.propagate_downstream(topo, rows, take, fill=-1)
+    root = funcs_topology.propagate_downstream(topo, rows, down < 0, fill=-1)
+
+    # hops from depth of the reaches (outlets at depth 0)
+    depth = topo['level_down']
+    ok = found >= 0
+    hops = np.where(ok, depth - depth[np.maximum(found, 0)], depth)
+
+    end = np.where(ok, 0, np.where(jus[root] <= 0, 1, 2))
+    t1_cotrecho = np.where(ok, cot[np.maximum(found, 0)], -1)
+    t1_mini = np.array([dict_bho_mini_t1[c] if c >= 0 else -1 for c in t1_cotrecho.tolist()],
+                       dtype=np.int64)
+    df_jus_t1 = pd.DataFrame({
+        't1_cotrecho': t1_cotrecho,
+        't1_mini': t1_mini,
+        't1_prev': np.where(ok, cot[np.maximum(prev, 0)], -1),
+        'hops': hops,
+        'end': pd.Categorical.from_codes(end, ['t1', 'coast', 'dead_end']),
+        }, index=pd.Index(cot, name='cotrecho'))
+
+    return df_jus_t1
+
+
+
+
+@funcs_instrument.timed()
 def define_parameters_t4(group_t4_candidates,
                          dict_parameters_t3,
                          df_tble_bho,
@@ -1108,14 +1152,24 @@ def define_parameters_t4(group_t4_candidates,
 
     TODO: DESCRIBE!!! -> "TWO SOLUTIONS"
 
+    Notes:
+        - method 4b uses .nearest_downstream_t1 (one pass over the BHO)
+          instead of a downstream walk for each candidate
+
     """
 
 
+    # nearest type 1 downstream of every reach (single pass)
+    df_jus_t1 = nearest_downstream_t1(df_tble_bho, dict_bho_mini_t1_post)
+
+    # lookups by cotrecho and mini
+    s_nuareamont = df_tble_bho.set_index('cotrecho')['nuareamont']
+    s_aream_km2 = df_tble_mini.set_index('mini', drop=False)['aream_km2']
+
     # Parameters for type 4!
     dict_parameters_t4 = defaultdict(dict)
     lost_t4 = []
-
-    conta_t4 = []
+    lost_end = []
 
     for cotrecho in group_t4_candidates:
 
@@ -1127,15 +1181,13 @@ def define_parameters_t4(group_t4_candidates,
         # --------------------------------------------------------------------
         t3_parameters = dict_parameters_t3.get(codint)
 
-        ##if t3_parameters:
         # recover some parameters
         #select_params = ['mini','aream_km2']
         select_params = ['mini','area_km2','aream_km2'] #UPDATED (2021/10): actualy uses area_km2
         params_sel = {k:v for k,v in t3_parameters.items() if k in select_params}
 
         # new parameters
-        ibho = df_tble_bho['cotrecho'] == codint
-        nuareamont = df_tble_bho.loc[ibho,'nuareamont'].values[0]
+        nuareamont = s_nuareamont.at[codint]
         params_new = {
                   'cotrecho': [codint],
                   'nuareamont': [round(nuareamont,6)],
@@ -1153,65 +1205,32 @@ def define_parameters_t4(group_t4_candidates,
 
 
         # --------------------------------------------------------------------
-        # method b: search a valid type 1 downstream
+        # method b: valid type 1 downstream
         # --------------------------------------------------------------------
-        params_b = {}
-        desce = True
-        codigo = cotrecho
-        while desce:
-            # current index
-            ibho = df_tble_bho['cotrecho'].isin([codigo])
-            # next downstream
-            codjus = df_tble_bho.loc[ibho,'nutrjus']
-            # initiate status
-            try:
-                status = len(codjus)
-            except:
-                status = 0
-
-            if status == 1:
-                # downstream walk
-                codigo = codjus.values[0]
-
-                # try to get for type 1 solution
-                mini_t1 = dict_bho_mini_t1_post.get(codigo,None)
-                if mini_t1:
-
-                    # stop walk
-                    desce = False
-
-                    # update parameters
-                    mini = mini_t1
-                    imini = df_tble_mini['mini'] == mini
-                    area_km2 = df_tble_mini.loc[imini,'area_km2'].values[0]
-                    aream_km2 = df_tble_mini.loc[imini,'aream_km2'].values[0]
-                    nuareamont = df_tble_bho.loc[ibho,'nuareamont'].values[0]
-                    params_b = {
-                        'cotrecho': [codint],
-                        't4_cotrecho': [int(codigo)],
-                        't4_mini': [mini_t1],
-                        't4_aream_km2': [aream_km2],
-                        't4_nuareamont': [round(nuareamont,6)],
-
-                        }
-                    dict_parameters_t4[codint].update(params_b)
-
-                    # show in screen
-                    #print(" cotrecho {} found a type 1 neighbour".format(cotrecho))
-            else:
-                #end-of-path
-
-                # show in screen
-                #print("cotrecho {} didnt find type 1 neighbour".format(cotrecho))
-                desce = False
-                lost_t4.append(cotrecho)
-
-        del params_b
+        jus = df_jus_t1.loc[codint]
+        if jus['end'] == 't1':
+            # note: nuareamont of the reach just upstream of the type 1
+            #       (as in the former downstream walk)
+            mini_t1 = int(jus['t1_mini'])
+            params_b = {
+                'cotrecho': [codint],
+                't4_cotrecho': [int(jus['t1_cotrecho'])],
+                't4_mini': [mini_t1],
+                't4_aream_km2': [s_aream_km2.at[mini_t1]],
+                't4_nuareamont': [round(s_nuareamont.at[int(jus['t1_prev'])],6)],
+                }
+            dict_parameters_t4[codint].update(params_b)
+        else:
+            #end-of-path (coast or dead end)
+            lost_t4.append(cotrecho)
+            lost_end.append(jus['end'])
         #-- end of method 4b
 
     nlost = len(lost_t4)
     ndone = len(group_t4_candidates) - nlost
     print(" - total of {} ({}) full (partial) type 4 features".format(ndone,nlost))
+    print(" - partial at coast {} and at dead end {}".format(lost_end.count('coast'),
+                                                            lost_end.count('dead_end')))
 
 
     # SOME CONSIDERATIONS FOR "LOST T4" DRAINAGE
@@ -1264,6 +1283,7 @@ def define_parameters_t4(group_t4_candidates,
 
 
 
+@funcs_instrument.timed()
 def make_dict_solver(group_t1_post, group_t2_post, group_t3_post, group_t4_post):
     """
 
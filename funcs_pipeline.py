@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+Pipeline of the MGB-BHO pre-processing with stage-level caching
+    replaces the intermediate files handed between
+    mgbbhods_0_prepro.py, mgbbhods_1_matlab.py and mgbbhods_2_main.py
+
+@author: Mino Sorribas
+
+@info:
+    - each stage declares its dependencies (other stages), parameters
+      and input files, e.g.
+        {'name':'t1_table', 'func':_stage_t1_table,
+         'deps':['t0'], 'params':['dmax',...], 'files':['file_mini'],
+         'code':[funcs_matlab.make_table_t1], 'cache':True}
+    - the key of a stage is a hash (sha256) of its name, source code
+      (stage function and the whole modules of 'code', with the project
+      modules they import, see .code_modules), values of parameters,
+      fingerprint of files (size and mtime) and keys of dependencies,
+      so a change in any helper of a stage invalidates its cache
+    - outputs are cached in '<path_cache>/<stage>_<key>.pickle', side files
+      (e.g. bho_midpts.gpkg) in the directory '<path_cache>/<stage>_<key>/'
+    - changing one parameter changes the keys of the stages that use it
+      and of everything downstream, the other stages are read from cache
+    - stages are resolved on demand: a cached stage does not load its deps
+
+@usage:
+    stages = make_stages_mgbbho()
+    results, status = run_pipeline(stages, files, params, path_cache='./cache_prepro/')
+
+"""
+
+import os
+import json
+import pickle
+import inspect
+
+import funcs_io
+import funcs_op
+import funcs_matlab
+import funcs_instrument
+import funcs_checkpoint
+
+
+KEY_LENGTH = 16
+
+# project modules left out of the keys (no effect on outputs)
+KEY_SKIP_MODULES = ('funcs_instrument', 'funcs_checkpoint')
+
+# stages saved by .dump_pipeline_dicts
+TARGETS_DICTS = ['t1', 't2', 't3', 'validate', 't4', 'solver']
+
+# columns of table type 1 (same of the table read by funcs_io.read_tble_t1)
+HEADER_TBLE_T1 = ['mini', 'bho_cotrecho', 'codigo_otto', 'bho_nuareamont',
+                  'mini_areamont', 'diffp_areamont', 'latitude', 'longitude',
+                  'flag_mini_in']
+
+
+
+
+#-----------------------------------------------------------------------------
+# RUNNER
+#-----------------------------------------------------------------------------
+def make_stage(name, func, deps=(), params=(), files=(), code=(), cache=True):
+    """
+    Declare a stage of the pipeline
+
+    Args:
+        name (str) :: name of the stage (and of its output)
+        func (function) :: called as func(**deps, **params, **files, path_stage=...)
+        deps (list) :: names of stages used as inputs
+        params (list) :: names of parameters used
+        files (list) :: names of input files used
+        code (list) :: functions (or modules) whose modules are part of
+                       the key, see .code_modules
+        cache (bool) :: False for outputs not worth to pickle (e.g. geometries)
+
+    Returns:
+        stage (dict)
+    """
+    return {'name': name, 'func': func, 'deps': list(deps), 'params': list(params),
+            'files': list(files), 'code': list(code), 'cache': cache}
+
+
+def file_fingerprint(filename):
+    """ Fingerprint of an input file (size and mtime), without reading it """
+    if not os.path.exists(filename):
+        raise FileNotFoundError("missing input file: {}".format(filename))
+    st = os.stat(filename)
+    return [os.path.abspath(filename), st.st_size, st.st_mtime_ns]
+
+
+def _source(func):
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return repr(func)
+
+
+def code_modules(code):
+    """
+    Project modules (funcs_*) of the code of a stage
+
+    Args:
+        code (list) :: functions or modules (see .make_stage)
+
+    Returns:
+        modules (list) :: modules of the code and the project modules they
+                          import (recursively, module-level imports only),
+                          sorted by name, without KEY_SKIP_MODULES
+    """
+    todo = [f if inspect.ismodule(f) else inspect.getmodule(f) for f in code]
+    found = {}
+    while todo:
+        m = todo.pop()
+        if m is None or m.__name__ in found:
+            continue
+        if not m.__name__.startswith('funcs_') or m.__name__ in KEY_SKIP_MODULES:
+            continue
+        found[m.__name__] = m
+        todo.extend(v for v in vars(m).values() if inspect.ismodule(v))
+    return [found[k] for k in sorted(found)]
+
+
+def stage_keys(stages, files, params):
+    """
+    Keys (content hash) of all stages
+
+    Args:
+        stages (list) :: see .make_stage (dependencies before dependents)
+        files (dict) :: {name: pathfile}
+        params (dict) :: {name: value}
+
+    Returns:
+        dict_keys (dict) :: {stage: key}
+    """
+    dict_keys = {}
+    for stage in stages:
+        for dep in stage['deps']:
+            if dep not in dict_keys:
+                raise ValueError("stage '{}' depends on '{}' (unknown or declared after)"
+                                 .format(stage['name'], dep))
+        content = {
+            'name': stage['name'],
+            'source': [_source(f) for f in [stage['func']] + code_modules(stage['code'])],
+            'params': {p: params[p] for p in stage['params']},
+            'files': {f: file_fingerprint(files[f]) for f in stage['files']},
+            'deps': {d: dict_keys[d] for d in stage['deps']},
+            }
+        dict_keys[stage['name']] = funcs_checkpoint.make_hash(content)[:KEY_LENGTH]
+    return dict_keys
+
+
+def run_pipeline(stages, files, params, path_cache='./cache_prepro/',
+                 targets = None,
+                 values = None,
+                 verbose = True):
+    """
+    Run the stages needed for the targets, reusing cached outputs
+
+    Args:
+        stages (list) :: see .make_stage (dependencies before dependents)
+        files (dict) :: {name: pathfile}
+        params (dict) :: {name: value}
+        path_cache (str) :: directory of cached outputs
+        targets (list) :: stages to run (None -> last stages, without dependents)
+        values (dict) :: outputs already in memory {stage: output}, used as
+                         they are (e.g. shared stages of funcs_sweep)
+        verbose (bool) :: print status of each stage
+
+    Returns:
+        results (dict) :: {stage: output} of targets and resolved stages
+        status (dict) :: {stage: 'memory', 'cached' or 'computed'} of resolved stages
+    """
+    os.makedirs(path_cache, exist_ok=True)
+    dict_stage = {s['name']: s for s in stages}
+    dict_keys = stage_keys(stages, files, params)
+    if targets is None:
+        used = {d for s in stages for d in s['deps']}
+        targets = [s['name'] for s in stages if s['name'] not in used]
+
+    values = dict(values or {})
+    status = {name: 'memory' for name in values}
+
+    def resolve(name):
+        if name in values:
+            return values[name]
+
+        stage = dict_stage[name]
+        key = dict_keys[name]
+        path_stage = os.path.join(path_cache, '{}_{}'.format(name, key))
+        filecache = path_stage + '.pickle'
+
+        if stage['cache'] and os.path.isfile(filecache):
+            with open(filecache, 'rb') as f:
+                values[name] = pickle.load(f)
+            status[name] = 'cached'
+        else:
+            kwargs = {d: resolve(d) for d in stage['deps']}
+            kwargs.update({p: params[p] for p in stage['params']})
+            kwargs.update({f: files[f] for f in stage['files']})
+            os.makedirs(path_stage, exist_ok=True)
+            if verbose:
+                print(" - stage {:<10} ({}) running...".format(name, key))
+            with funcs_instrument.span('stage_' + name):
+                values[name] = stage['func'](path_stage=path_stage, **kwargs)
+            if stage['cache']:
+                funcs_checkpoint.atomic_write(filecache,
+                                              lambda f: pickle.dump(values[name], f))
+            status[name] = 'computed'
+
+        if verbose and status[name] == 'cached':
+            print(" - stage {:<10} ({}) from cache".format(name, key))
+        return values[name]
+
+    for name in targets:
+        resolve(name)
+    results = values
+
+    # log of the last run
+    log = {name: {'key': dict_keys[name], 'status': status[name]} for name in status}
+    funcs_checkpoint.atomic_write(os.path.join(path_cache, 'last_run.json'),
+                                  lambda f: json.dump(log, f, indent=1), mode='w')
+
+    return results, status
+
+
+
+
+#-----------------------------------------------------------------------------
+# STAGES OF THE MGB-BHO PRE-PROCESSING
+#-----------------------------------------------------------------------------
+def _stage_bho(file_gdf_bho, path_stage):
+    return funcs_io.read_gdf_bho(file_gdf_bho)
+
+
+def _stage_mini(file_mini, path_stage):
+    return funcs_io.read_tble_mini(file_mini)
+
+
+def _stage_tble_bho(bho, path_stage):
+    return bho.drop('geometry', axis=1)
+
+
+def _stage_domain(bho, file_mgb_catchments_shp, path_stage):
+    import geopandas as gpd
+    gdf_mgb_catchments = gpd.read_file(file_mgb_catchments_shp)
+    file_bho_inter = os.path.join(path_stage, 'bho_midpts.gpkg')
+    dict_bho_domain = funcs_op.associate_bho_mini_domain(bho,
+                                                         gdf_mgb_catchments,
+                                                         pts_to_gpkg = file_bho_inter,
+                                                         to_pickle = False,
+                                                         )
+    return {'dict_bho_domain': dict_bho_domain, 'file_bho_inter': file_bho_inter}
+
+
+def _stage_t0(mini, tble_bho, domain, path_stage):
+    fileout = os.path.join(path_stage, 'table_t0.xlsx')
+    funcs_op.make_tble_t0(mini, tble_bho, domain['file_bho_inter'], fileout=fileout)
+    return fileout
+
+
+def _stage_t1_table(t0, file_mini, area_threshold_t1, area_limite_minijus, dmax, tble_tol,
+                    path_stage):
+    df_tble_mini, df_tble_bho = funcs_matlab.read_matlab_input(file_mini, t0)
+    df_tble_t1 = funcs_matlab.make_table_t1(df_tble_mini,
+                                            df_tble_bho,
+                                            area_threshold = area_threshold_t1,
+                                            area_limite_minijus = area_limite_minijus,
+                                            dmax = dmax,
+                                            tble_tol = tble_tol,
+                                            verbose = False)
+    df_tble_t1.to_excel(os.path.join(path_stage, 'table_t1_py.xlsx'), index=False)
+    return df_tble_t1
+
+
+def _stage_t1(t1_table, tble_tol, path_stage):
+    df_tble_t1 = funcs_io.prepare_tble_t1(t1_table[HEADER_TBLE_T1], tol_t1=True, tble_tol=tble_tol)
+    return {'df_tble_t1': df_tble_t1,
+            'dict_bho_mini_t1': funcs_op.associate_bho_mini_t1(df_tble_t1),
+            'dict_parameters_t1': funcs_op.define_parameters_t1(df_tble_t1)}
+
+
+def _stage_t3(domain, mini, tble_bho, path_stage):
+    dict_bho_mini_t3 = funcs_op.associate_bho_mini_t3(domain['dict_bho_domain'])
+    dict_parameters_t3 = funcs_op.define_parameters_t3(dict_bho_mini_t3, mini, tble_bho)
+    return {'dict_bho_mini_t3': dict_bho_mini_t3,
+            'dict_parameters_t3': dict_parameters_t3}
+
+
+def _stage_t2(t1, mini, tble_bho, path_stage):
+    df_tble_topo_t1 = funcs_op.merge_topologies_t1(t1['df_tble_t1'], mini, tble_bho)
+    dict_routes_t2, dict_mini_afl_t2 = funcs_op.screening_candidates_t2(df_tble_topo_t1,
+                                                                        mini, tble_bho)
+    dict_bho_mini_t2, dict_mini_afldum_t2 = funcs_op.associate_bho_mini_t2(dict_mini_afl_t2,
+                                                                          dict_routes_t2,
+                                                                          mini)
+    dict_parameters_t2 = funcs_op.define_parameters_t2(dict_bho_mini_t2,
+                                                       dict_mini_afl_t2,
+                                                       dict_routes_t2,
+                                                       t1['dict_bho_mini_t1'],
+                                                       tble_bho)
+    return {'dict_routes_t2': dict_routes_t2,
+            'dict_mini_afl_t2': dict_mini_afl_t2,
+            'dict_bho_mini_t2': dict_bho_mini_t2,
+            'dict_parameters_t2': dict_parameters_t2}
+
+
+def _stage_validate(tble_bho, domain, t1, t2, t3, area_threshold_t12, path_stage):
+    groups_t123, dicts_t123, group_t4_candidates = funcs_op.validate_t123(
+        tble_bho,
+        domain['dict_bho_domain'],
+        area_threshold_t12,
+        t1['dict_bho_mini_t1'],
+        t2['dict_bho_mini_t2'],
+        t3['dict_bho_mini_t3'],
+        )
+    return {'groups_t123': groups_t123,
+            'dicts_t123': dicts_t123,
+            'group_t4_candidates': group_t4_candidates}
+
+
+def _stage_t4(validate, t3, tble_bho, mini, path_stage):
+    dict_bho_mini_t1_post = validate['dicts_t123'][0]
+    group_t4_post, dict_parameters_t4, lost_t4 = funcs_op.define_parameters_t4(
+        validate['group_t4_candidates'],
+        t3['dict_parameters_t3'],
+        tble_bho,
+        dict_bho_mini_t1_post,
+        mini,
+        )
+    return {'group_t4_post': group_t4_post,
+            'dict_parameters_t4': dict_parameters_t4,
+            'lost_t4': lost_t4}
+
+
+def _stage_solver(validate, t4, path_stage):
+    group_t1_post, group_t2_post, group_t3_post = validate['groups_t123']
+    return funcs_op.make_dict_solver(group_t1_post, group_t2_post, group_t3_post,
+                                     t4['group_t4_post'])
+
+
+def make_stages_mgbbho():
+    """
+    Stages of the MGB-BHO pre-processing
+
+        bho -> tble_bho, domain
+        domain + mini + tble_bho -> t0 -> t1_table -> t1 -> t2
+        domain + mini + tble_bho -> t3
+        t1 + t2 + t3 -> validate -> t4 -> solver
+
+    Files:
+        file_gdf_bho, file_mgb_catchments_shp, file_mini
+
+    Parameters:
+        area_threshold_t1 (float) :: main river threshold of table type 1 (800.)
+        area_limite_minijus (float) :: area to check reaches in mini downstream
+        dmax (float) :: maximum search distance of table type 1
+        tble_tol (tuple) :: tolerance table of type 1 (see funcs_io.f_test_area)
+        area_threshold_t12 (float) :: threshold of main network in validation
+
+    Returns:
+        stages (list) :: see .make_stage
+    """
+    stages = [
+        make_stage('bho', _stage_bho, files=['file_gdf_bho'],
+                   code=[funcs_io.read_gdf_bho], cache=False),
+        make_stage('mini', _stage_mini, files=['file_mini'],
+                   code=[funcs_io.read_tble_mini]),
+        make_stage('tble_bho', _stage_tble_bho, deps=['bho']),
+        make_stage('domain', _stage_domain, deps=['bho'], files=['file_mgb_catchments_shp'],
+                   code=[funcs_op.associate_bho_mini_domain]),
+        make_stage('t0', _stage_t0, deps=['mini', 'tble_bho', 'domain'],
+                   code=[funcs_op.make_tble_t0]),
+        make_stage('t1_table', _stage_t1_table, deps=['t0'], files=['file_mini'],
+                   params=['area_threshold_t1', 'area_limite_minijus', 'dmax', 'tble_tol'],
+                   code=[funcs_matlab.read_matlab_input, funcs_matlab.make_table_t1,
+                         funcs_io.f_test_area]),
+        make_stage('t1', _stage_t1, deps=['t1_table'], params=['tble_tol'],
+                   code=[funcs_io.prepare_tble_t1, funcs_io.f_area_acceptable_t1,
+                         funcs_io.f_test_area, funcs_op.associate_bho_mini_t1,
+                         funcs_op.define_parameters_t1]),
+        make_stage('t3', _stage_t3, deps=['domain', 'mini', 'tble_bho'],
+                   code=[funcs_op.associate_bho_mini_t3, funcs_op.define_parameters_t3]),
+        make_stage('t2', _stage_t2, deps=['t1', 'mini', 'tble_bho'],
+                   code=[funcs_op.merge_topologies_t1, funcs_op.screening_candidates_t2,
+                         funcs_op.check_route_t2, funcs_op.associate_bho_mini_t2,
+                         funcs_op.define_parameters_t2]),
+        make_stage('validate', _stage_validate,
+                   deps=['tble_bho', 'domain', 't1', 't2', 't3'],
+                   params=['area_threshold_t12'],
+                   code=[funcs_op.validate_t123]),
+        make_stage('t4', _stage_t4, deps=['validate', 't3', 'tble_bho', 'mini'],
+                   code=[funcs_op.define_parameters_t4]),
+        make_stage('solver', _stage_solver, deps=['validate', 't4'],
+                   code=[funcs_op.make_dict_solver]),
+        ]
+    return stages
+
+
+def dump_pipeline_dicts(results, pathout='./'):
+    """
+    Save the main dictionaries of the pipeline (see funcs_io.dump_the_dicts)
+        results of .run_pipeline with targets=TARGETS_DICTS
+    """
+    dict_bho_mini_t1_post, dict_bho_mini_t2_post, dict_bho_mini_t3_post = \
+        results['validate']['dicts_t123']
+    return funcs_io.dump_the_dicts(
+        dict_bho_mini_t1_post,
+        dict_bho_mini_t2_post,
+        dict_bho_mini_t3_post,
+        results['t1']['dict_parameters_t1'],
+        results['t2']['dict_parameters_t2'],
+        results['t3']['dict_parameters_t3'],
+        results['t4']['dict_parameters_t4'],
+        results['solver'],
+        pathout = pathout,
+        )
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+Regions (sub-basins) of the BHO drainage for fast regional runs
+    resolves a region selector into the cotrechos to downscale and the
+    mini columns to read from the MGB binaries
+
+@author: Mino Sorribas
+
+@info:
+    - a region is a dict of one or more selectors (reaches of all of them):
+        {'cobacia': '8628'}            Otto Pfafstetter prefix (or list of prefixes)
+        {'outlet': 8628123}            cotrecho and everything upstream (or list)
+        {'bbox': (xmin, ymin, xmax, ymax)}   midpoint of the reach inside the box
+        {'polygon': geom}              midpoint inside a shapely polygon (or WKT)
+      e.g. {'outlet': 8628123, 'bbox': (...)} -> upstream reaches inside the box
+    - the region index keeps only cotrecho, nutrjus, cobacia, the midpoint
+      of reaches and the upstream index (funcs_topology.make_upstream_index),
+      cached in a .npz with the fingerprint of the BHO file, so the
+      geopackage is read once
+    - upstream of an outlet is an interval of the preorder of the upstream
+      index, O(size of the result), see .upstream_cotrechos
+    - mini stats of a region are read only at the columns of its operator
+      (see .region_mini_stats), no need of the .npy stats of the whole domain
+    - geometries of a region are read from the geopackage only inside the
+      box of its midpoints (see .read_gdf_cotrechos), outputs are named
+      with .region_suffix
+    - shapely is imported only for polygons
+
+@usage:
+    index = region_index_from_file(FILE_GDF_BHO, filecache='region_index_bho.npz')
+    list_to_downscale = select_cotrechos(index, {'cobacia': '8628'}, dict_bho_solver)
+    op = funcs_engine.make_downscaling_operator(dict_bho_solver, dict_type_params, list_to_downscale)
+    dict_stat_mini = region_mini_stats(op, dict_var_mmap, list_t, ['qmlt','q95'])
+    cotrechos, gdf_up = upstream_cotrechos(index, 8628123, file_gdf_bho=FILE_GDF_BHO)
+    gdf_region = read_gdf_cotrechos(index, list_to_downscale, FILE_GDF_BHO)
+
+"""
+
+import os
+import re
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import funcs_io
+import funcs_engine
+import funcs_gauges
+import funcs_pipeline
+import funcs_topology
+import funcs_instrument
+
+
+# selectors of a region (see .select_region)
+REGION_SELECTORS = ('cobacia', 'outlet', 'bbox', 'polygon')
+
+# arrays of the region index (see .make_region_index)
+REGION_ARRAYS = ('cotrecho', 'nutrjus', 'cobacia', 'x', 'y', 'preorder', 'tin', 'size')
+
+
+
+
+#-----------------------------------------------------------------------------
+# REGION INDEX
+#-----------------------------------------------------------------------------
+def make_region_index(cotrecho, nutrjus, cobacia, x=None, y=None):
+    """
+    Region index of BHO reaches
+
+    Args:
+        cotrecho (np.array) :: cotrecho of reaches
+        nutrjus (np.array) :: cotrecho downstream (<=0 or nan at outlets)
+        cobacia (np.array) :: Otto Pfafstetter code of reaches (str)
+        x, y (np.array) :: midpoint of reaches (None -> no bbox/polygon)
+
+    Returns:
+        index (dict) :: 'cotrecho', 'nutrjus' (-1 at outlets), 'cobacia'
+                        (bytes), 'x' and 'y' (nan if unknown), and the
+                        upstream index 'preorder', 'tin' and 'size'
+                        (see funcs_topology.make_upstream_index)
+    """
+    n = len(cotrecho)
+    index = {'cotrecho': np.asarray(cotrecho, dtype=np.int64),
+             'nutrjus': pd.Series(nutrjus).astype('Float64').fillna(-1).to_numpy(dtype=np.int64),
+             'cobacia': np.asarray(cobacia, dtype=str).astype(np.bytes_),
+             'x': np.full(n, np.nan) if x is None else np.asarray(x, dtype=np.float64),
+             'y': np.full(n, np.nan) if y is None else np.asarray(y, dtype=np.float64)}
+
+    down = funcs_topology.downstream_index(index['cotrecho'], index['nutrjus'])
+    index.update(funcs_topology.make_upstream_index(funcs_topology.make_topology(down)))
+    return index
+
+
+def region_index_from_bho(df_tble_bho):
+    """ Region index of a BHO table (midpoints if it is a GeoDataFrame) """
+    x = y = None
+    if 'geometry' in df_tble_bho:
+        mid = df_tble_bho.geometry.interpolate(0.5, normalized=True)
+        x, y = mid.x.to_numpy(), mid.y.to_numpy()
+    return make_region_index(df_tble_bho['cotrecho'].to_numpy(),
+                             df_tble_bho['nutrjus'],
+                             df_tble_bho['cobacia'].to_numpy(),
+                             x, y)
+
+
+def dump_region_index(index, filecache, key=''):
+    """ Save the region index in .npz """
+    with open(filecache, 'wb') as f:
+        np.savez(f, key=key, **{k: index[k] for k in REGION_ARRAYS})
+
+
+def read_region_index(filecache, key=None):
+    """
+    Read the region index from .npz
+
+    Args:
+        filecache (str) :: file of .dump_region_index
+        key (str) :: expected key (None -> not checked)
+
+    Returns:
+        index (dict) :: see .make_region_index (None if key does not match
+                        or the file misses arrays of the index)
+    """
+    with np.load(filecache) as f:
+        if key is not None and str(f['key']) != key:
+            return None
+        if any(k not in f for k in REGION_ARRAYS):
+            return None
+        return {k: f[k] for k in REGION_ARRAYS}
+
+
+def region_index_from_file(file_gdf_bho, filecache=None):
+    """
+    Region index of the BHO file (cached by the fingerprint of the file)
+
+    Args:
+        file_gdf_bho (str) :: geopackage of BHO drainage
+        filecache (str) :: optional .npz to keep the index between runs
+
+    Returns:
+        index (dict) :: see .make_region_index
+    """
+    key = json.dumps(funcs_pipeline.file_fingerprint(file_gdf_bho))
+
+    if filecache and os.path.isfile(filecache):
+        index = read_region_index(filecache, key)
+        if index is not None:
+            return index
+
+    index = region_index_from_bho(funcs_io.read_gdf_bho(file_gdf_bho))
+    if filecache:
+        dump_region_index(index, filecache, key)
+    return index
+
+
+
+
+#-----------------------------------------------------------------------------
+# SELECTORS
+#-----------------------------------------------------------------------------
+def _as_list(v):
+    return list(v) if isinstance(v, (list, tuple, set, np.ndarray)) else [v]
+
+
+def mask_cobacia(index, prefixes):
+    """ Reaches with cobacia starting by any of the prefixes """
+    mask = np.zeros(len(index['cotrecho']), dtype=bool)
+    for p in _as_list(prefixes):
+        mask |= np.char.startswith(index['cobacia'], str(p).encode())
+    return mask
+
+
+def outlet_rows(index, outlets):
+    """ Rows of the region index of outlet cotrechos """
+    outlets = np.asarray(_as_list(outlets), dtype=np.int64)
+    if 'rows_by_cotrecho' not in index:
+        index['rows_by_cotrecho'] = pd.Index(index['cotrecho'])
+    rows = index['rows_by_cotrecho'].get_indexer(outlets)
+    if (rows < 0).any():
+        raise ValueError("outlet {} is not in the region index".format(outlets[rows < 0][0]))
+    return rows
+
+
+def mask_upstream(index, outlets):
+    """ Reaches upstream of any of the outlets (outlets included) """
+    mask = np.zeros(len(index['cotrecho']), dtype=bool)
+    mask[funcs_topology.upstream_rows(index, outlet_rows(index, outlets))] = True
+    return mask
+
+
+def _check_xy(index):
+    if np.isnan(index['x']).all():
+        raise ValueError("region index without coordinates (see .region_index_from_bho)")
+
+
+def mask_bbox(index, bbox):
+    """ Reaches with midpoint inside the box (xmin, ymin, xmax, ymax) """
+    _check_xy(index)
+    xmin, ymin, xmax, ymax = bbox
+    x, y = index['x'], index['y']
+    return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+
+
+def mask_polygon(index, polygon):
+    """ Reaches with midpoint inside the polygon (shapely geometry or WKT) """
+    shapely = funcs_gauges._import_shapely()
+    _check_xy(index)
+    if isinstance(polygon, str):
+        polygon = shapely.from_wkt(polygon)
+
+    # box of the polygon first, then the exact test
+    mask = mask_bbox(index, shapely.bounds(polygon))
+    rows = np.flatnonzero(mask)
+    mask[rows] = shapely.contains_xy(polygon, index['x'][rows], index['y'][rows])
+    return mask
+
+
+def select_region(index, region):
+    """
+    Rows of the region index inside the region
+
+    Args:
+        index (dict) :: see .make_region_index
+        region (dict) :: selectors (see REGION_SELECTORS), all must hold
+
+    Returns:
+        rows (np.array) :: rows of the index (sorted)
+    """
+    unknown = set(region) - set(REGION_SELECTORS)
+    if not region or unknown:
+        raise ValueError("region needs selectors of {} (got {})".format(REGION_SELECTORS, list(region)))
+
+    masks = {'cobacia': mask_cobacia, 'outlet': mask_upstream,
+             'bbox': mask_bbox, 'polygon': mask_polygon}
+    mask = np.ones(len(index['cotrecho']), dtype=bool)
+    for k, v in region.items():
+        mask &= masks[k](index, v)
+    return np.flatnonzero(mask)
+
+
+def select_cotrechos(index, region, dict_bho_solver=None):
+    """
+    Cotrechos of the region (list_to_downscale of a regional run)
+
+    Args:
+        index (dict) :: see .make_region_index
+        region (dict) :: see .select_region
+        dict_bho_solver (dict) :: {cotrecho:solver}, keeps only the
+                                  cotrechos available to downscale
+
+    Returns:
+        list_to_downscale (list) :: cotrechos (sorted)
+    """
+    cotrechos = np.sort(index['cotrecho'][select_region(index, region)]).tolist()
+    if dict_bho_solver is not None:
+        cotrechos = [c for c in cotrechos if c in dict_bho_solver]
+    return cotrechos
+
+
+def region_suffix(region):
+    """
+    Short name of a region for output files
+
+    Returns:
+        suffix (str) :: e.g. 'cobacia8628', 'outlet8628123_bbox-52.0_-20.0_-50.0_-18.0'
+                        (polygons as 'polygon' and a hash of their WKT)
+    """
+    parts = []
+    for k, v in region.items():
+        if k == 'polygon':
+            wkt = v if isinstance(v, str) else v.wkt
+            parts.append(k + hashlib.sha1(wkt.encode()).hexdigest()[:8])
+        else:
+            parts.append(k + '_'.join(str(x) for x in _as_list(v)))
+    return re.sub(r'[^0-9A-Za-z_.-]', '', '_'.join(parts))
+
+
+def read_gdf_cotrechos(index, cotrechos, file_gdf_bho):
+    """
+    Reaches of the geopackage of a list of cotrechos (e.g. of a region)
+
+    Args:
+        index (dict) :: see .make_region_index
+        cotrechos (list) :: cotrechos to read
+        file_gdf_bho (str) :: geopackage of BHO drainage
+
+    Returns:
+        gdf (gpd.GeoDataFrame) :: reaches of the cotrechos (order of the
+                                  file), read only inside the box of their
+                                  midpoints
+    """
+    _check_xy(index)
+    cotrechos = np.asarray(cotrechos, dtype=np.int64)
+    rows = outlet_rows(index, cotrechos)
+    x, y = index['x'][rows], index['y'][rows]
+    bbox = (np.nanmin(x), np.nanmin(y), np.nanmax(x), np.nanmax(y))
+    gdf = funcs_io.read_gdf_bho(file_gdf_bho, bbox=bbox)
+    return gdf[gdf['cotrecho'].isin(cotrechos)].reset_index(drop=True)
+
+
+def upstream_cotrechos(index, outlets, file_gdf_bho=None):
+    """
+    All cotrechos upstream of outlet(s), outlets included
+
+    Args:
+        index (dict) :: see .make_region_index
+        outlets (int or list) :: cotrecho of the outlet(s)
+        file_gdf_bho (str) :: geopackage of BHO drainage, to also return
+                              the geometries of the upstream reaches
+
+    Returns:
+        cotrechos (np.array) :: upstream cotrechos (preorder from the outlet,
+                                i.e. each reach before its upstream reaches)
+        gdf_up (gpd.GeoDataFrame) :: upstream reaches of the geopackage (order
+                                     of the file), read only inside the box
+                                     of their midpoints (if file_gdf_bho is given)
+    """
+    rows = funcs_topology.upstream_rows(index, outlet_rows(index, outlets))
+    cotrechos = index['cotrecho'][rows]
+    if file_gdf_bho is None:
+        return cotrechos
+    return cotrechos, read_gdf_cotrechos(index, cotrechos, file_gdf_bho)
+
+
+
+
+#-----------------------------------------------------------------------------
+# MINI OF A REGION
+#-----------------------------------------------------------------------------
+def required_cols(op):
+    """ Mini columns (0-based) read by the operator {var: np.array} """
+    return {int(v): np.unique(op['col'][op['var'] == v]) for v in np.unique(op['var'])}
+
+
+@funcs_instrument.timed()
+def region_mini_stats(op, dict_var_mmap, list_t, list_stats, chunk_size=None):
+    """
+    Mini-level statistics only at the mini required by the operator
+
+    Args:
+        op (dict) :: see funcs_engine.make_downscaling_operator (region)
+        dict_var_mmap (dict) :: {var: memmap of binary (nt x nc)}
+        list_t (list) :: list of integer of selected timesteps
+        list_stats (list) :: statistics (keys of funcs_engine.dict_stats)
+        chunk_size (int) :: timesteps per chunk (None -> exact, single chunk)
+
+    Returns:
+        dict_stat_mini (dict) :: {stat: {var: values (nc,)}}, nan at mini
+                                 outside the region (see funcs_engine.downscale_stats)
+    """
+    dict_stat_mini = {st: {} for st in list_stats}
+    for var, cols in required_cols(op).items():
+        if var not in dict_var_mmap:
+            raise ValueError("binary of var {} is required by the region".format(var))
+        res = funcs_engine.make_mini_stats(dict_var_mmap[var], list_t, list_stats,
+                                           chunk_size, cols=cols)
+        for st in list_stats:
+            dict_stat_mini[st][var] = res[st]
+    return dict_stat_mini
@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP service of reference discharges (Q95, QMLT, ...) by cotrecho,
+    cobacia prefix (sub-basin), list of cotrechos or point (lat/lon)
+
+@author: Mino Sorribas
+
+@info:
+    - the store is a directory of .npy arrays made once from the results
+      (e.g. base_mgbbhods_<suffix>.gpkg) and opened with mmap at startup:
+        cotrecho.npy :: int64, sorted (rows of every other array)
+        values.npy   :: float64, rows x columns (see meta.json)
+        cobacia.npy  :: bytes, sorted, with cobacia_ix.npy (rows)
+        xy.npy       :: float64, rows x 2 (lon, lat of reach midpoints)
+        snap_index.npz :: lines of reaches (rows of the store), see
+                          funcs_gauges.dump_snap_index
+        meta.json    :: columns, number of rows and source
+    - cotrecho and cobacia are binary searches (np.searchsorted), a
+      cobacia prefix is a contiguous range of the sorted codes
+    - points are snapped to the nearest reach line (STRtree of
+      funcs_gauges, built at startup), distances in degrees; stores
+      without geometries fall back to the nearest midpoint (scipy cKDTree)
+    - the server is stdlib (http.server, threads, HTTP/1.1 keep-alive)
+      and answers JSON:
+        /info
+        /cotrecho/<cotrecho>
+        /cotrechos?ids=<c1>,<c2>,...
+        /cobacia/<prefix>?limit=<n>
+        /point?lat=<lat>&lon=<lon>&max_dist=<deg>
+    - .load_test replays queries with keep-alive connections and returns
+      the latencies (see .latency_summary and .latency_histogram)
+
+@usage:
+    make_service_store(gdf_results, './service_store/')
+    store = read_service_store('./service_store/')
+    server = make_server(store, 'localhost', 8050)
+    server.serve_forever()
+
+"""
+
+import os
+import json
+import time
+import threading
+import http.client
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import funcs_gauges
+import funcs_checkpoint
+
+
+# columns stored by default (besides the ones starting with 'D_')
+SERVICE_EXTRA_COLUMNS = ['nuareamont', 'solver']
+
+# maximum rows answered by a cobacia prefix (None -> all)
+SERVICE_LIMIT = 10000
+
+# edges of the latency histogram [ms]
+LATENCY_EDGES_MS = np.logspace(-2, 3, 26)
+
+# snap index of reach lines in the store (see .make_service_store)
+FILE_SNAP_INDEX = 'snap_index.npz'
+
+
+
+
+#-----------------------------------------------------------------------------
+# STORE
+#-----------------------------------------------------------------------------
+def make_service_store(df_results, pathout, columns=None, xy=None):
+    """
+    Make the store of the service from the table of results
+
+    Args:
+        df_results (pd.DataFrame) :: results by cotrecho, with 'cotrecho',
+                                     'cobacia' and geometry (or xy)
+        pathout (str) :: directory of the store
+        columns (list) :: columns of values (None -> 'D_*' and
+                          SERVICE_EXTRA_COLUMNS found in df_results)
+        xy (np.array) :: lon, lat of reaches (n x 2, rows of df_results),
+                         None -> midpoints of the geometry
+
+    Returns:
+        meta (dict) :: contents of meta.json
+
+    Notes:
+        - lines of the geometry (if any) are saved as the snap index of
+          points (FILE_SNAP_INDEX), in the order of rows of the store
+    """
+    if columns is None:
+        columns = [c for c in df_results.columns if str(c).startswith('D_')]
+        columns += [c for c in SERVICE_EXTRA_COLUMNS if c in df_results.columns]
+
+    if xy is None:
+        midpts = df_results.geometry.interpolate(0.5, normalized=True)
+        xy = np.column_stack((midpts.x.to_numpy(), midpts.y.to_numpy()))
+
+    # rows sorted by cotrecho
+    cotrecho = df_results['cotrecho'].to_numpy().astype(np.int64)
+    order = np.argsort(cotrecho, kind='stable')
+    cotrecho = cotrecho[order]
+    if len(cotrecho) and np.any(cotrecho[1:] == cotrecho[:-1]):
+        raise ValueError("duplicated cotrecho in results")
+
+    values = df_results[columns].to_numpy(dtype=np.float64)[order]
+    xy = np.asarray(xy, dtype=np.float64)[order]
+
+    # cobacia (text) sorted, with rows
+    cobacia = df_results['cobacia'].astype(str).to_numpy().astype('S')[order]
+    cobacia_ix = np.argsort(cobacia, kind='stable')
+
+    os.makedirs(pathout, exist_ok=True)
+    arrays = {'cotrecho': cotrecho, 'values': values, 'xy': xy,
+              'cobacia': cobacia[cobacia_ix], 'cobacia_ix': cobacia_ix.astype(np.int64)}
+    for name, a in arrays.items():
+        funcs_checkpoint.atomic_write(os.path.join(pathout, name + '.npy'),
+                                      lambda f, a=a: np.save(f, a))
+
+    # lines of reaches for the snap of points
+    has_lines = 'geometry' in df_results
+    if has_lines:
+        nuareamont = (df_results['nuareamont'].to_numpy(dtype=np.float64) if 'nuareamont' in df_results
+                      else np.full(len(cotrecho), np.nan))
+        index = funcs_gauges.make_snap_index(cotrecho, nuareamont[order],
+                                             np.asarray(df_results.geometry.values, dtype=object)[order])
+        funcs_gauges.dump_snap_index(index, os.path.join(pathout, FILE_SNAP_INDEX))
+
+    meta = {'columns': [str(c) for c in columns],
+            'n': int(len(cotrecho)),
+            'lines': has_lines,
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    funcs_checkpoint.atomic_write(os.path.join(pathout, 'meta.json'),
+                                  lambda f: json.dump(meta, f, indent=1), mode='w')
+    return meta
+
+
+def read_service_store(pathin, with_tree=True):
+    """
+    Open the store of the service (arrays as mmap)
+
+    Args:
+        pathin (str) :: directory of the store (see .make_service_store)
+        with_tree (bool) :: True to build the spatial index of points
+
+    Returns:
+        store (dict) :: arrays, 'meta', 'columns', 'cobacia_inv' (position
+                        of rows in cobacia), 'snap' (snap index of reach
+                        lines, see funcs_gauges.make_snap_index) or, for
+                        stores without lines, 'tree' (cKDTree of midpoints)
+    """
+    with open(os.path.join(pathin, 'meta.json')) as f:
+        meta = json.load(f)
+
+    store = {'meta': meta, 'columns': meta['columns'], 'snap': None, 'tree': None}
+    for name in ('cotrecho', 'values', 'xy', 'cobacia', 'cobacia_ix'):
+        store[name] = np.load(os.path.join(pathin, name + '.npy'), mmap_mode='r')
+
+    # position of each row in the sorted cobacia
+    inv = np.empty(meta['n'], dtype=np.int64)
+    inv[store['cobacia_ix']] = np.arange(meta['n'])
+    store['cobacia_inv'] = inv
+
+    filesnap = os.path.join(pathin, FILE_SNAP_INDEX)
+    if with_tree and os.path.isfile(filesnap):
+        store['snap'] = funcs_gauges.read_snap_index(filesnap)
+    elif with_tree:
+        from scipy.spatial import cKDTree
+        store['tree'] = cKDTree(np.asarray(store['xy']))
+    return store
+
+
+
+
+#-----------------------------------------------------------------------------
+# QUERIES
+#-----------------------------------------------------------------------------
+def _records(store, rows):
+    """ Records (list of dicts) of rows of the store, NaN as None """
+    rows = np.asarray(rows, dtype=np.int64)
+    values = np.asarray(store['values'][rows])
+    values = np.where(np.isfinite(values), values, None).tolist()
+    cot = store['cotrecho'][rows].tolist()
+    xy = np.asarray(store['xy'][rows]).tolist()
+    cob = store['cobacia'][store['cobacia_inv'][rows]]
+    columns = store['columns']
+    return [dict(cotrecho=c, cobacia=b.decode(), lon=p[0], lat=p[1], **dict(zip(columns, v)))
+            for c, b, p, v in zip(cot, cob, xy, values)]
+
+
+def find_rows(store, cotrechos):
+    """
+    Rows of cotrechos in the store (-1 if missing)
+
+    Args:
+        store (dict) :: see .read_service_store
+        cotrechos (list) :: cotrechos
+
+    Returns:
+        rows (np.array) :: int64
+    """
+    cot = store['cotrecho']
+    c = np.asarray(cotrechos, dtype=np.int64)
+    rows = np.searchsorted(cot, c)
+    rows = np.minimum(rows, len(cot) - 1)
+    return np.where(cot[rows] == c, rows, -1)
+
+
+def query_cotrecho(store, cotrecho):
+    """ Record of one cotrecho (None if missing) """
+    row = find_rows(store, [cotrecho])[0]
+    return _records(store, [row])[0] if row >= 0 else None
+
+
+def query_cotrechos(store, cotrechos):
+    """ Records of a list of cotrechos and the missing ones """
+    rows = find_rows(store, cotrechos)
+    ok = rows >= 0
+    missing = np.asarray(cotrechos, dtype=np.int64)[~ok].tolist()
+    return {'records': _records(store, rows[ok]), 'missing': missing}
+
+
+def query_cobacia(store, prefix, limit=SERVICE_LIMIT):
+    """
+    Records of the sub-basin of a cobacia prefix (in order of cobacia)
+
+    Args:
+        store (dict) :: see .read_service_store
+        prefix (str) :: Pfafstetter code prefix (e.g. '8628')
+        limit (int) :: maximum number of records (None -> all)
+
+    Returns:
+        res (dict) :: 'prefix', 'n' (total), 'truncated' and 'records'
+    """
+    key = str(prefix).encode()
+    cob = store['cobacia']
+    lo = int(np.searchsorted(cob, key, side='left'))
+    hi = int(np.searchsorted(cob, key + b'\xff', side='left'))
+    n = hi - lo
+    if limit is not None:
+        hi = min(hi, lo + int(limit))
+    rows = store['cobacia_ix'][lo:hi]
+    return {'prefix': str(prefix), 'n': n, 'truncated': hi - lo < n,
+            'records': _records(store, rows)}
+
+
+def query_point(store, lat, lon, max_dist=None):
+    """
+    Record of the reach nearest to a point (lines of reaches)
+
+    Args:
+        store (dict) :: see .read_service_store
+        lat, lon (float) :: point [degrees]
+        max_dist (float) :: maximum distance [degrees] (None -> any)
+
+    Returns:
+        rec (dict) :: record with 'dist_deg' (None if beyond max_dist)
+
+    Notes:
+        - distance to the line of the reach (STRtree of the snap index),
+          or to its midpoint for stores without lines
+    """
+    if store['snap'] is not None:
+        shapely = funcs_gauges._import_shapely()
+        ig, dist = store['snap']['tree'].query_nearest(shapely.points(lon, lat),
+                                                       max_distance=max_dist,
+                                                       return_distance=True)
+        if not len(ig):
+            return None
+        row, dist = ig[0], dist[0]
+    elif store['tree'] is not None:
+        dist, row = store['tree'].query([lon, lat],
+                                        distance_upper_bound=np.inf if max_dist is None else max_dist)
+        if not np.isfinite(dist):
+            return None
+    else:
+        raise ValueError("store without spatial index (see .read_service_store)")
+    rec = _records(store, [row])[0]
+    rec['dist_deg'] = float(dist)
+    return rec
+
+
+
+
+#-----------------------------------------------------------------------------
+# HTTP SERVER
+#-----------------------------------------------------------------------------
+def _int_list(text):
+    return [int(x) for x in text.split(',') if x.strip()]
+
+
+def handle_path(store, path):
+    """
+    Answer of a request path (see @info)
+
+    Returns:
+        status (int) :: HTTP status
+        body (dict) :: JSON answer
+    """
+    url = urlsplit(path)
+    parts = [p for p in url.path.split('/') if p]
+    args = {k: v[-1] for k, v in parse_qs(url.query).items()}
+    try:
+        if parts == ['info']:
+            spatial = 'lines' if store['snap'] is not None else 'midpoints' if store['tree'] is not None else None
+            return 200, dict(store['meta'], spatial_index=spatial)
+
+        if len(parts) == 2 and parts[0] == 'cotrecho':
+            rec = query_cotrecho(store, int(parts[1]))
+            if rec is None:
+                return 404, {'error': 'cotrecho {} not found'.format(parts[1])}
+            return 200, rec
+
+        if parts == ['cotrechos']:
+            return 200, query_cotrechos(store, _int_list(args.get('ids', '')))
+
+        if len(parts) == 2 and parts[0] == 'cobacia':
+            limit = int(args['limit']) if 'limit' in args else SERVICE_LIMIT
+            return 200, query_cobacia(store, parts[1], limit)
+
+        if parts == ['point']:
+            max_dist = float(args['max_dist']) if 'max_dist' in args else None
+            rec = query_point(store, float(args['lat']), float(args['lon']), max_dist)
+            if rec is None:
+                return 404, {'error': 'no reach within {} degrees'.format(max_dist)}
+            return 200, rec
+
+    except (KeyError, ValueError, OverflowError) as e:
+        return 400, {'error': 'bad request: {}'.format(e)}
+
+    return 404, {'error': 'unknown path {}'.format(url.path)}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """ GET requests answered from the store of the server (see .make_server) """
+
+    protocol_version = 'HTTP/1.1'   # keep-alive
+    wbufsize = -1                   # headers and body in a single send
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        status, body = handle_path(self.server.store, self.path)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # no console output for each request
+        pass
+
+
+def make_server(store, host='localhost', port=8050):
+    """
+    HTTP server of the store (threads, one per connection)
+
+    Returns:
+        server (ThreadingHTTPServer) :: use .serve_forever() and .shutdown()
+    """
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.store = store
+    return server
+
+
+def start_server_thread(store, host='localhost', port=8050):
+    """ Server running in a background thread (e.g. load test in the same process) """
+    server = make_server(store, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+
+
+#-----------------------------------------------------------------------------
+# LOAD TEST
+#-----------------------------------------------------------------------------
+def make_queries(store, n=10000, mix=None, seed=0):
+    """
+    Random request paths over the store
+
+    Args:
+        store (dict) :: see .read_service_store
+        n (int) :: number of requests
+        mix (dict) :: fraction of each kind {'cotrecho','cotrechos','cobacia','point'}
+        seed (int) :: random seed
+
+    Returns:
+        queries (list) :: [(kind, path)]
+    """
+    mix = mix or {'cotrecho': 0.5, 'cotrechos': 0.1, 'cobacia': 0.1, 'point': 0.3}
+    rng = np.random.default_rng(seed)
+    kinds = list(mix)
+    p = np.array([mix[k] for k in kinds], dtype=float)
+    picks = rng.choice(len(kinds), n, p=p/p.sum())
+
+    nrow = store['meta']['n']
+    cot = store['cotrecho']
+    xy = store['xy']
+    queries = []
+    for ik in picks:
+        kind = kinds[ik]
+        row = int(rng.integers(nrow))
+        if kind == 'cotrecho':
+            path = '/cotrecho/{}'.format(cot[row])
+        elif kind == 'cotrechos':
+            rows = rng.integers(nrow, size=10)
+            path = '/cotrechos?ids=' + ','.join(str(c) for c in cot[rows])
+        elif kind == 'cobacia':
+            # prefix of a random reach, a few levels above it
+            cob = query_cotrecho(store, int(cot[row]))['cobacia']
+            path = '/cobacia/{}?limit=100'.format(cob[:max(len(cob) - 3, 1)])
+        else:
+            lon, lat = xy[row] + rng.normal(0., 0.01, 2)
+            path = '/point?lat={:.5f}&lon={:.5f}'.format(lat, lon)
+        queries.append((kind, path))
+    return queries
+
+
+def load_test(queries, host='localhost', port=8050, nthreads=4):
+    """
+    Replay the queries against the server (keep-alive, one connection per thread)
+
+    Args:
+        queries (list) :: [(kind, path)] (see .make_queries)
+        host, port :: address of the server
+        nthreads (int) :: concurrent clients
+
+    Returns:
+        df_lat (pd.DataFrame) :: 'kind', 'status', 'latency_ms' of each request
+        wall (float) :: total time of the test [s]
+    """
+    latency = np.full(len(queries), np.nan)
+    status = np.zeros(len(queries), dtype=int)
+
+    def client(i0):
+        conn = http.client.HTTPConnection(host, port)
+        for i in range(i0, len(queries), nthreads):
+            t0 = time.perf_counter()
+            conn.request('GET', queries[i][1])
+            resp = conn.getresponse()
+            resp.read()
+            latency[i] = 1000.*(time.perf_counter() - t0)
+            status[i] = resp.status
+        conn.close()
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(nthreads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    df_lat = pd.DataFrame({'kind': [q[0] for q in queries], 'status': status,
+                           'latency_ms': latency})
+    return df_lat, wall
+
+
+def direct_latency(store, queries):
+    """ Latencies of the queries without HTTP (handle_path in the process) """
+    latency = np.empty(len(queries))
+    for i, (kind, path) in enumerate(queries):
+        t0 = time.perf_counter()
+        handle_path(store, path)
+        latency[i] = 1000.*(time.perf_counter() - t0)
+    return pd.DataFrame({'kind': [q[0] for q in queries], 'status': 200,
+                         'latency_ms': latency})
+
+
+def latency_summary(df_lat, wall=None):
+    """ Percentiles of latency [ms] by kind of query (and all) """
+    def _summary(lat):
+        p = np.percentile(lat, [50, 90, 99, 99.9]) if len(lat) else [np.nan]*4
+        return {'n': len(lat), 'mean_ms': lat.mean(), 'p50_ms': p[0], 'p90_ms': p[1],
+                'p99_ms': p[2], 'p999_ms': p[3], 'max_ms': lat.max()}
+
+    rows = {k: _summary(g['latency_ms'].to_numpy()) for k, g in df_lat.groupby('kind')}
+    rows['all'] = _summary(df_lat['latency_ms'].to_numpy())
+    df = pd.DataFrame.from_dict(rows, orient='index')
+    if wall:
+        df.loc['all', 'requests_per_s'] = len(df_lat)/wall
+    return df
+
+
+def latency_histogram(df_lat, edges=LATENCY_EDGES_MS):
+    """ Histogram of latency (log bins [ms]) by kind of query, with cumulative % """
+    df = pd.DataFrame({'lo_ms': edges[:-1], 'hi_ms': edges[1:]})
+    for kind, g in list(df_lat.groupby('kind')) + [('all', df_lat)]:
+        lat = np.clip(g['latency_ms'].to_numpy(), edges[0], edges[-1])
+        count = np.histogram(lat, edges)[0]
+        df[kind] = count
+        df[kind + '_cum%'] = 100.*np.cumsum(count)/max(count.sum(), 1)
+    return df
+
+
+def print_histogram(df_hist, kind='all', width=50):
+    """ Histogram of latency on screen """
+    count = df_hist[kind].to_numpy()
+    scale = width/max(count.max(), 1)
+    for lo, hi, c, cum in zip(df_hist['lo_ms'], df_hist['hi_ms'], count, df_hist[kind + '_cum%']):
+        if c:
+            print("  {:>9.3f}-{:<9.3f} ms {:>8d} {:>6.1f}% {}".format(lo, hi, c, cum,
+                                                                   '#'*int(round(c*scale))))
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Skill of the downscaled daily series at gauges (postos)
+    NSE, KGE, bias and errors of Q95/QMLT for all gauges at once
+
+@author: Mino Sorribas
+
+@info:
+    - observed series come from a directory (one file per posto, e.g.
+      '<posto>.csv' with date;discharge) or a single table (dates in
+      rows, postos in columns), see .read_observed
+    - the downscaled series of all gauged reaches are one batched call of
+      the engine (funcs_engine.downscale_timeseries_block over the
+      downscaling operator), optionally split in blocks of reaches
+      computed in threads
+    - metrics are vectorized over gauges (columns), using only the days
+      with both observed and downscaled values
+    - .version_summary makes one line by version of the model (medians
+      over gauges), kept in a CSV with .append_summary
+
+@usage:
+    df_obs = read_observed('./observed/')
+    sim, dates = downscale_gauges(op, dict_var_mmap, list_t, dstart)
+    df_skill = skill_table(df_obs, sim, dates, dict_posto_cotrecho, op)
+    append_summary('skill_versions.csv', version_summary(df_skill, '1979'))
+
+"""
+
+import os
+import glob
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import funcs_engine
+
+
+# minimum number of paired days of a gauge
+SKILL_MIN_DAYS = 365
+
+# columns of the table of skill (see .skill_table)
+HEADER_SKILL = ['posto', 'cotrecho', 'tipo', 'n_days', 'nse', 'kge', 'r', 'alpha', 'beta',
+                'bias_perc', 'qmlt_obs', 'qmlt_sim', 'q95_obs', 'q95_sim', 'q95_err_perc']
+
+
+
+
+#-----------------------------------------------------------------------------
+# OBSERVED SERIES
+#-----------------------------------------------------------------------------
+def _posto(name):
+    """ Posto from a file or column name (integer if numeric) """
+    name = str(name)
+    return int(name) if name.isdigit() else name
+
+
+def read_observed_dir(path, pattern='*.csv', sep=';', decimal='.'):
+    """
+    Observed series from a directory, one file by posto ('<posto>.csv')
+        with dates in the first column and discharge in the second
+
+    Returns:
+        df_obs (pd.DataFrame) :: daily discharge [m3/s] (dates x postos)
+    """
+    series = {}
+    for filename in sorted(glob.glob(os.path.join(path, pattern))):
+        posto = _posto(os.path.splitext(os.path.basename(filename))[0])
+        df = pd.read_csv(filename, sep=sep, decimal=decimal, index_col=0, parse_dates=True)
+        series[posto] = df.iloc[:, 0]
+    if not series:
+        raise FileNotFoundError("no observed series {} in {}".format(pattern, path))
+    return pd.DataFrame(series)
+
+
+def read_observed_table(filename, sep=';', decimal='.'):
+    """
+    Observed series from a single table (dates in rows, postos in columns)
+        .csv, .xlsx or .parquet
+
+    Returns:
+        df_obs (pd.DataFrame) :: daily discharge [m3/s] (dates x postos)
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ('.xlsx', '.xls'):
+        df = pd.read_excel(filename, index_col=0)
+    elif ext == '.parquet':
+        df = pd.read_parquet(filename)
+    else:
+        df = pd.read_csv(filename, sep=sep, decimal=decimal, index_col=0)
+    df.index = pd.to_datetime(df.index)
+    df.columns = [_posto(c) for c in df.columns]
+    return df
+
+
+def read_observed(path, **kwargs):
+    """ Observed series from a directory (see .read_observed_dir) or a table """
+    if os.path.isdir(path):
+        return read_observed_dir(path, **kwargs)
+    return read_observed_table(path, **kwargs)
+
+
+
+
+#-----------------------------------------------------------------------------
+# DOWNSCALED SERIES AT GAUGES
+#-----------------------------------------------------------------------------
+def downscale_gauges(op, dict_var_mmap, list_t, dstart, block_size=None, nthreads=1):
+    """
+    Downscaled daily series of all rows of the operator (gauged reaches)
+
+    Args:
+        op (dict) :: see funcs_engine.make_downscaling_operator (gauged cotrechos)
+        dict_var_mmap (dict) :: {var: memmap of binary (nt x nc)}
+        list_t (list) :: list of integer of selected timesteps
+        dstart (datetime) :: date of the first timestep of the binaries
+        block_size (int) :: rows by call (None -> all rows in one call)
+        nthreads (int) :: threads over blocks (numpy releases the GIL)
+
+    Returns:
+        sim (np.array) :: series (len(list_t) x rows of op)
+        dates (pd.DatetimeIndex) :: dates of list_t
+    """
+    n = len(op['cotrecho'])
+    dates = pd.to_datetime(dstart) + pd.to_timedelta(np.asarray(list_t), unit='D')
+    blocks = [np.arange(n)] if not block_size else \
+             [np.arange(i, min(i + block_size, n)) for i in range(0, n, block_size)]
+
+    run = lambda rows: funcs_engine.downscale_timeseries_block(op, rows, dict_var_mmap, list_t)
+    if nthreads > 1 and len(blocks) > 1:
+        with ThreadPoolExecutor(max_workers=nthreads) as ex:
+            parts = list(ex.map(run, blocks))
+    else:
+        parts = [run(rows) for rows in blocks]
+
+    sim = np.hstack(parts) if parts else np.zeros((len(list_t), 0))
+    return sim, dates
+
+
+
+
+#-----------------------------------------------------------------------------
+# METRICS (VECTORIZED OVER GAUGES)
+#-----------------------------------------------------------------------------
+def skill_metrics(obs, sim, min_days=SKILL_MIN_DAYS):
+    """
+    Metrics of the columns of sim against obs (paired days only)
+
+    Args:
+        obs, sim (np.array) :: series (days x gauges), NaN where missing
+        min_days (int) :: minimum paired days (fewer -> NaN metrics)
+
+    Returns:
+        metrics (dict) :: {metric: np.array (gauges,)} with 'n_days',
+                          'nse', 'kge', 'r', 'alpha', 'beta', 'bias_perc',
+                          'qmlt_obs', 'qmlt_sim', 'q95_obs', 'q95_sim',
+                          'q95_err_perc'
+
+    Notes:
+        - KGE of Gupta et al. (2009): 1 - sqrt((r-1)^2 + (alpha-1)^2 + (beta-1)^2)
+          alpha = std(sim)/std(obs), beta = mean(sim)/mean(obs)
+        - bias_perc is also the error of QMLT [%]
+    """
+    obs = np.asarray(obs, dtype=float)
+    sim = np.asarray(sim, dtype=float)
+    mask = np.isfinite(obs) & np.isfinite(sim)
+    n = mask.sum(axis=0)
+    o = np.where(mask, obs, np.nan)
+    s = np.where(mask, sim, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mo, ms = np.nanmean(o, axis=0), np.nanmean(s, axis=0)
+        do, ds = o - mo, s - ms
+        so = np.sqrt(np.nansum(do**2, axis=0)/n)
+        ss = np.sqrt(np.nansum(ds**2, axis=0)/n)
+
+        r = np.nansum(do*ds, axis=0)/n/(so*ss)
+        alpha = ss/so
+        beta = ms/mo
+        nse = 1. - np.nansum((s - o)**2, axis=0)/np.nansum(do**2, axis=0)
+        kge = 1. - np.sqrt((r - 1.)**2 + (alpha - 1.)**2 + (beta - 1.)**2)
+
+        q95_obs = np.nanquantile(o, 0.05, axis=0)
+        q95_sim = np.nanquantile(s, 0.05, axis=0)
+
+        metrics = {'n_days': n, 'nse': nse, 'kge': kge, 'r': r, 'alpha': alpha,
+                   'beta': beta, 'bias_perc': 100.*(beta - 1.),
+                   'qmlt_obs': mo, 'qmlt_sim': ms, 'q95_obs': q95_obs, 'q95_sim': q95_sim,
+                   'q95_err_perc': 100.*(q95_sim/q95_obs - 1.)}
+
+    few = n < max(min_days, 2)
+    for k, v in metrics.items():
+        if k != 'n_days':
+            v[few] = np.nan
+    return metrics
+
+
+def skill_table(df_obs, sim, dates, dict_posto_cotrecho, op, min_days=SKILL_MIN_DAYS):
+    """
+    Table of skill of all gauges with observed series and downscaled reach
+
+    Args:
+        df_obs (pd.DataFrame) :: observed series (dates x postos)
+        sim (np.array) :: downscaled series (dates x rows of op), see .downscale_gauges
+        dates (pd.DatetimeIndex) :: dates of sim
+        dict_posto_cotrecho (dict) :: {posto: cotrecho}
+        op (dict) :: operator of sim (see funcs_engine.make_downscaling_operator)
+        min_days (int) :: minimum paired days
+
+    Returns:
+        df_skill (pd.DataFrame) :: columns HEADER_SKILL, one row by posto
+    """
+    dict_cotrecho_row = dict(zip(op['cotrecho'].tolist(), range(len(op['cotrecho']))))
+    postos = [p for p in df_obs.columns
+              if dict_cotrecho_row.get(dict_posto_cotrecho.get(p)) is not None]
+    rows = np.array([dict_cotrecho_row[dict_posto_cotrecho[p]] for p in postos], dtype=np.int64)
+
+    obs = df_obs[postos].reindex(dates).to_numpy(dtype=float)
+    metrics = skill_metrics(obs, sim[:, rows], min_days)
+
+    df_skill = pd.DataFrame({'posto': postos,
+                             'cotrecho': op['cotrecho'][rows],
+                             'tipo': op['tipo'][rows],
+                             **metrics})
+    return df_skill[HEADER_SKILL]
+
+
+
+
+#-----------------------------------------------------------------------------
+# SUMMARY BY VERSION
+#-----------------------------------------------------------------------------
+def version_summary(df_skill, version, **extra):
+    """
+    One line of summary of a version of the model (medians over gauges)
+
+    Args:
+        df_skill (pd.DataFrame) :: see .skill_table
+        version (str) :: label of the version (e.g. run, commit)
+        extra :: other columns of the line (e.g. commit='ab12cd3')
+
+    Returns:
+        df_line (pd.DataFrame) :: one row
+    """
+    ok = df_skill.dropna(subset=['nse'])
+    line = {'version': version,
+            'n_gauges': len(df_skill),
+            'n_valid': len(ok),
+            'nse_median': ok['nse'].median(),
+            'kge_median': ok['kge'].median(),
+            'kge_pos_perc': 100.*(ok['kge'] > 0.).mean() if len(ok) else np.nan,
+            'abs_bias_median': ok['bias_perc'].abs().median(),
+            'abs_q95_err_median': ok['q95_err_perc'].abs().median()}
+    for tipo, g in ok.groupby('tipo'):
+        line['kge_median_t{}'.format(tipo)] = g['kge'].median()
+    line.update(extra)
+    return pd.DataFrame([line])
+
+
+def append_summary(filename, df_line, sep=';'):
+    """ Append the summary of a version to a CSV (history of versions) """
+    if os.path.isfile(filename):
+        df = pd.concat([pd.read_csv(filename, sep=sep), df_line], ignore_index=True)
+    else:
+        df = df_line
+    df.to_csv(filename, sep=sep, index=False)
+    return df
@@ -9,6 +9,7 @@ TODO: check type 4 !
 """
 
 
+import os
 import numpy as np
 import pandas as pd
 from datetime import datetime,timedelta
@@ -17,50 +18,46 @@ import itertools
 #-----------------------------------------------------------------------------
 # DEFAULT FILES FOR MGB
 #-----------------------------------------------------------------------------
-def mgbsa_default(version = '1979'):
-    """ Default settings for MGB-SA """
-
-    # number of intervals and start date MGB-SA (1990->)
-    if version == '1990':
-        nc = 33749
-        nt = 7305
-        dstart = datetime(1990,1,1)
-        file_qtudo = 'QTUDO_1990.MGB'
-        file_qcel  = 'QITUDO_1990.MGB'
-
-    # ###
-    # number of intervals and start date MGB-SA (1979->)
-    if version == '1979':
-        nc = 33749
-        nt = 13149
-        dstart = datetime(1979,1,1)
-        file_qtudo = 'QTUDO_1979.MGB'
-        file_qcel  = 'QITUDO_1979.MGB'
-
-   # number of intervals and start date MGB-SA ENKF (1979->) MEMBRO 25
-    if version == 'enkf_1979':
-        nc = 33749
-        nt = 13149
-        dstart = datetime(1979,1,1)
-        file_qtudo = 'QTUDO25.MGB'
-        file_qcel  = 'QITUDO25.MGB'
-
-   # number of intervals and start date MGB-SA ENKF (1979->) MEMBRO 48
-    if version == 'enkf_1979_m48':
-        nc = 33749
-        nt = 13149
-        dstart = datetime(1979,1,1)
-        file_qtudo = 'QTUDO48.MGB'
-        file_qcel  = 'QITUDO48.MGB'
-
-   # number of intervals and start date MGB-SA ENKF (1979->) MEMBRO 2
-    if version == 'enkf_1979_m02':
-        nc = 33749
-        nt = 13149
-        dstart = datetime(1979,1,1)
-        file_qtudo = 'QTUDO02.MGB'
-        file_qcel  = 'QITUDO02.MGB'
+# legacy settings of MGB-SA runs (nt, nc, dstart, file_qtudo, file_qcel)
+# new runs should be described by sidecars (see funcs_datasets)
+dict_mgbsa_versions = {
+    # MGB-SA (1990->)
+    '1990': (7305, 33749, datetime(1990,1,1), 'QTUDO_1990.MGB', 'QITUDO_1990.MGB'),
+    # MGB-SA (1979->)
+    '1979': (13149, 33749, datetime(1979,1,1), 'QTUDO_1979.MGB', 'QITUDO_1979.MGB'),
+    # MGB-SA ENKF (1979->) MEMBRO 25, 48 and 2
+    'enkf_1979': (13149, 33749, datetime(1979,1,1), 'QTUDO25.MGB', 'QITUDO25.MGB'),
+    'enkf_1979_m48': (13149, 33749, datetime(1979,1,1), 'QTUDO48.MGB', 'QITUDO48.MGB'),
+    'enkf_1979_m02': (13149, 33749, datetime(1979,1,1), 'QTUDO02.MGB', 'QITUDO02.MGB'),
+    }
+
+
+def mgbsa_default(version = '1979', path_input = None):
+    """ Default settings for MGB-SA
 
+    Args:
+        version (str) :: name of the run
+        path_input (str) :: directory with sidecars of runs (funcs_datasets)
+                            the sidecar '<version>.mgbrun.json' has priority
+                            over the legacy settings (dict_mgbsa_versions)
+
+    Returns:
+        (nt, nc, dstart, file_qtudo, file_qcel)
+
+    Notes:
+        - raises ValueError if the sidecar misses qtudo or qcel, or is not daily
+    """
+    if path_input is not None:
+        import funcs_datasets
+        registry = funcs_datasets.discover_datasets(path_input)
+        if version in registry:
+            return funcs_datasets.dataset_default(registry[version])
+
+    if version not in dict_mgbsa_versions:
+        raise KeyError("unknown MGB-SA version '{}' (add a sidecar, see funcs_datasets)"
+                       .format(version))
+
+    nt, nc, dstart, file_qtudo, file_qcel = dict_mgbsa_versions[version]
     return (nt, nc, dstart, file_qtudo, file_qcel)
 
 
@@ -125,28 +122,53 @@ def make_dict_bho_ixc(the_dicts):
 #-----------------------------------------------------------------------------
 # FUNCTIONS TO PROCESS MGB BINARY
 #-----------------------------------------------------------------------------
-def dump_mgb_binary_to_npy(filebin, fileout, nt, nc):
-    """ Read binary file (MGB format) and dump content to .npy """
-    # read from file
-    #'<f4' indicates little-endian (<) float(f) 4 byte (4)
-    dados = np.fromfile(filebin,'<f4').reshape(nt,nc)
+def read_npy_as_mmap(filenpy):
+    """ Read .npy binary file and make memory-map array"""
+    if not os.path.isfile(filenpy):
+        raise FileNotFoundError("missing .npy file: {}".format(filenpy))
 
-    # dump fo hard disk
-    np.save(fileout,dados)
-    return None
+    # make memory-map from file (doest not consume memory!)
+    try:
+        dados_mmap = np.load(filenpy,mmap_mode='r')
+    except ValueError as e:
+        raise ValueError("invalid .npy file {} ({})".format(filenpy, e))
 
+    return dados_mmap
 
 
 
-def read_npy_as_mmap(filenpy):
-    """ Read .npy binary file and make memory-map array"""
-    #ms:2021/10/05 -> bad trick to ignore reading
-    try:
-        # make memory-map from file (doest not consume memory!)
-        dados_mmap = np.load(filenpy,mmap_mode='r')
-    except:
-        dados_mmap = None
 
+def read_mgb_as_mmap(filebin, nc, nt=None):
+    """ Memory-map a raw binary file (MGB format) in place, without .npy
+
+    Args:
+        filebin (str) :: path of binary file (e.g. QTUDO.MGB)
+                         headerless little-endian float32 (nt x nc)
+        nc (int) :: number of catchments (mini)
+        nt (int) :: expected number of intervals (e.g. from .mgbsa_default)
+                    None -> derived from the file size
+
+    Returns:
+        dados_mmap (np.memmap) :: read-only memory map (nt x nc)
+    """
+    if not os.path.isfile(filebin):
+        raise FileNotFoundError("missing MGB binary: {}".format(filebin))
+
+    # number of intervals from the file size
+    #'<f4' indicates little-endian (<) float(f) 4 byte (4)
+    nbytes = os.path.getsize(filebin)
+    nrow = 4*nc
+    if nbytes == 0 or nbytes % nrow != 0:
+        raise ValueError("size of {} ({} bytes) is not a multiple of nc={} float32"
+                         .format(filebin, nbytes, nc))
+    nt_file = nbytes // nrow
+
+    if nt is not None and nt_file != nt:
+        raise ValueError("{} has {} intervals, expected nt={} (check version)"
+                         .format(filebin, nt_file, nt))
+
+    # make memory-map from file (doest not consume memory!)
+    dados_mmap = np.memmap(filebin, dtype='<f4', mode='r', shape=(nt_file,nc))
     return dados_mmap
 
 
@@ -211,22 +233,9 @@ def read_mgbsa_qtudo(ithot=365, version='1979'):
     path_main = '../'
     path_input = path_main + 'input/'
 
-    # number of catchments
-    nc = 33749
-
-    # SELECT VERSION
-    # number of intervals and start date MGB-SA (1990->)
-    if version == '1990':
-        nt = 7305
-        dstart = datetime(1990,1,1)
-        file_qtudo = path_input + 'QTUDO_1990.MGB'
-
-    # number of intervals and start date MGB-SA (1979->)
-    if version == '1979':
-        nt = 13149
-        dstart = datetime(1979,1,1)
-        file_qtudo = path_input + 'QTUDO_1979.MGB'
-
+    # settings of version
+    nt, nc, dstart, file_qtudo, _ = mgbsa_default(version, path_input)
+    file_qtudo = path_input + file_qtudo
 
     # read binary file as dataframe
     df_qtudo = read_mgb_binary_as_dataframe(file_qtudo, nt, nc, dstart)
@@ -249,21 +258,9 @@ def read_mgbsa_qcel(ithot=365, version='1979'):
     path_main = '../'
     path_input = path_main + 'input/'
 
-    # number of catchments
-    nc = 33749
-
-    # SELECT VERSION
-    # number of intervals and start date MGB-SA (1990->)
-    if version == '1990':
-        nt = 7305
-        dstart = datetime(1990,1,1)
-        file_qcel = path_input + 'QITUDO_1990.MGB' #QCEL
-
-    # number of intervals and start date MGB-SA (1979->)
-    if version == '1979':
-        nt = 13149
-        dstart = datetime(1979,1,1)
-        file_qcel = path_input + 'QITUDO_1979.MGB'
+    # settings of version
+    nt, nc, dstart, _, file_qcel = mgbsa_default(version, path_input)
+    file_qcel = path_input + file_qcel #QCEL
 
     # read binary file as dataframe
     df_qcel = read_mgb_binary_as_dataframe(file_qcel, nt, nc, dstart)
@@ -497,4 +494,40 @@ def f_downscaling_t4(cotrecho, dict_parameters_t4, df_flow, inp_qesp=False):
 
 
 
+#-----------------------------------------------------------------------------
+# DOWNSCALING OF A COTRECHO (LOOP OF mgbbhods_solver_base.py)
+#-----------------------------------------------------------------------------
+def downscale_cotrecho(cotrecho, func, d_params, dados_mmap, list_t, list_c, dstart):
+    """
+    Downscale Q95 and mean discharge of a cotrecho
+        i) via time-series: downscaled series, then statistics
+        ii) via stats: statistics of mini, then downscaled
+
+    Args:
+        cotrecho (int) :: target cotrecho
+        func (function) :: downscaling function (e.g. .f_downscaling_t1)
+        d_params (dict) :: parameters of the type {cotrecho:{params}}
+        dados_mmap (np.memmap) :: memory map of binary (nt x nc)
+        list_t (list) :: list of integer of selected timesteps
+        list_c (list) :: required mini (see .make_dict_bho_ixc)
+        dstart (datetime) :: first date in dados_mmap
+
+    Returns:
+        q95, qmlt, q95_ts, qmlt_ts (float) :: statistics [m3/s]
+    """
+    # get time series from memmap of binary
+    df_flow = mmap_to_dataframe(dados_mmap, list_t, list_c, dstart)
+
+    # method i - downscale via time-series
+    df_qts = pd.DataFrame(func(cotrecho, d_params, df_flow), index = df_flow.index)
+    q95_ts = df_qts.quantile(0.05).values[0]
+    qmlt_ts = df_qts.mean().values[0]
+
+    # method ii - downscale via stats (q95,qmlt)
+    df_q95  = pd.DataFrame(df_flow.quantile(0.05)).transpose()
+    df_qmlt = pd.DataFrame(df_flow.mean()).transpose()
+
+    q95 = func(cotrecho, d_params, df_q95)
+    qmlt = func(cotrecho, d_params, df_qmlt)
 
+    return q95, qmlt, q95_ts, qmlt_ts
@@ -10,8 +10,23 @@ import pandas as pd
 from datetime import datetime,timedelta
 import itertools
 
-def dump_mgb_binary_to_stats_npy(filebin, fileout, nt, nc, itini):
-    """ Read binary file (MGB format) and dump content to .npy """
+import funcs_engine
+import funcs_solver
+
+def dump_mgb_binary_to_stats_npy(filebin, fileout, nt, nc, itini, chunk_size=None):
+    """ Read binary file (MGB format) and dump content to .npy
+    
+        chunk_size (int) :: timesteps per chunk, e.g. 5*365 (None -> all at once)
+                            chunks bound memory for long/sub-daily runs
+                            (q95 from a log-histogram, see funcs_engine)
+    """
+    if chunk_size:
+        dados = funcs_solver.read_mgb_as_mmap(filebin, nc, nt)
+        st = funcs_engine.make_mini_stats(dados, range(itini,nt), ['qmlt','q95'], chunk_size)
+        dados_stats = np.vstack((st['qmlt'], st['q95']))
+        np.save(fileout,dados_stats)
+        return None
+
     # read from file
     #'<f4' indicates little-endian (<) float(f) 4 byte (4)
     dados = np.fromfile(filebin,'<f4').reshape(nt,nc)
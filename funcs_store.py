@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Functions for chunked and compressed storage of MGB binaries (Zarr)
+    with random access by mini and time
+
+@author: Mino Sorribas
+
+@info:
+    - raw MGB binaries are uncompressed float32 (nt x nc), ~1.8 GB each
+    - the container is a Zarr array chunked as (days x minis), default
+      365 x 512, compressed with blosc/zstd (bitshuffle)
+    - the reader returns an object indexed as the np.memmap of binaries
+      (slices, integers and np.ix_ selections), so the solver functions
+      (e.g. funcs_solver.mmap_to_dataframe) work without changes
+    - zarr is an optional dependency, imported only when needed
+
+"""
+
+import os
+
+import numpy as np
+
+import funcs_solver
+
+
+# default chunks (days x minis) and compression
+ZARR_CHUNKS = (365, 512)
+ZARR_CLEVEL = 5
+
+
+
+
+#-----------------------------------------------------------------------------
+# ZARR DEPENDENCY
+#-----------------------------------------------------------------------------
+def _import_zarr():
+    """ Import zarr (optional dependency) """
+    try:
+        import zarr
+    except ImportError:
+        raise ImportError("zarr is required for the chunked storage "
+                          "(conda install -c conda-forge zarr)")
+    return zarr
+
+
+def _zarr_major(zarr):
+    """ Major version of zarr (v2 and v3 have different compressor args) """
+    return int(zarr.__version__.split('.')[0])
+
+
+
+
+#-----------------------------------------------------------------------------
+# CONVERTER
+#-----------------------------------------------------------------------------
+def dump_mgb_to_zarr(filebin, fileout, nc, nt=None,
+                     chunks = ZARR_CHUNKS,
+                     clevel = ZARR_CLEVEL,
+                     rows_per_write = None):
+    """
+    Convert a raw MGB binary to a chunked and compressed Zarr container
+
+    Args:
+        filebin (str) :: path of binary file (e.g. QTUDO.MGB)
+        fileout (str) :: path of the container (e.g. QTUDO.zarr)
+        nc (int) :: number of catchments (mini)
+        nt (int) :: expected number of intervals (None -> from file size)
+        chunks (tuple) :: chunk shape (days x minis)
+        clevel (int) :: zstd compression level
+        rows_per_write (int) :: rows read from the binary at each write
+                                (default= 10 chunks of time)
+
+    Returns:
+        None
+    """
+    zarr = _import_zarr()
+
+    # source (memory-mapped in place)
+    dados_mmap = funcs_solver.read_mgb_as_mmap(filebin, nc, nt)
+    nt = dados_mmap.shape[0]
+
+    # container
+    kwargs = dict(shape=(nt, nc), chunks=chunks, dtype='<f4')
+    if _zarr_major(zarr) >= 3:
+        from zarr.codecs import BloscCodec
+        codec = BloscCodec(cname='zstd', clevel=clevel, shuffle='bitshuffle')
+        z = zarr.create_array(fileout, compressors=codec, overwrite=True, **kwargs)
+    else:
+        from numcodecs import Blosc
+        codec = Blosc(cname='zstd', clevel=clevel, shuffle=Blosc.BITSHUFFLE)
+        z = zarr.open_array(fileout, mode='w', compressor=codec, **kwargs)
+
+    # write by blocks of whole chunks of time (bounded memory)
+    rows_per_write = rows_per_write or 10*chunks[0]
+    for i in range(0, nt, rows_per_write):
+        j = min(i + rows_per_write, nt)
+        z[i:j, :] = np.asarray(dados_mmap[i:j, :])
+
+    z.attrs['nt'] = int(nt)
+    z.attrs['nc'] = int(nc)
+    z.attrs['source'] = os.path.basename(filebin)
+    return None
+
+
+
+
+#-----------------------------------------------------------------------------
+# READER (SAME INTERFACE OF THE MEMMAP PATH)
+#-----------------------------------------------------------------------------
+def _as_index(k):
+    """ Flatten np.ix_ components and turn contiguous ranges into slices """
+    if isinstance(k, (slice, int, np.integer)):
+        return k
+    k = np.asarray(k).ravel()
+    if k.dtype == bool:
+        k = np.flatnonzero(k)
+    if len(k) > 0 and np.all(np.diff(k) == 1):
+        return slice(int(k[0]), int(k[-1]) + 1)
+    return k
+
+
+class ZarrMmap:
+    """
+    Read-only view of a Zarr container indexed as np.memmap (nt x nc)
+
+        z = ZarrMmap(zarr_array)
+        z[i0:i1, :]             -> rows (time) i0..i1-1
+        z[np.ix_(list_t, cols)] -> outer selection (time x cols)
+
+    Only the chunks that hold the selected minis and times are decompressed.
+    """
+
+    def __init__(self, zarray):
+        self.zarray = zarray
+        self.shape = tuple(zarray.shape)
+        self.dtype = np.dtype(zarray.dtype)
+        self.ndim = len(self.shape)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = tuple(_as_index(k) for k in key)
+
+        # basic selection (only slices and integers)
+        if all(isinstance(k, (slice, int, np.integer)) for k in key):
+            return self.zarray[key]
+
+        # outer selection (same result of np.ix_ over a np.memmap)
+        return self.zarray.oindex[key]
+
+    def __array__(self, dtype=None, copy=None):
+        a = self.zarray[...]
+        return a if dtype is None else a.astype(dtype)
+
+
+def read_zarr_as_mmap(filezarr, nc=None, nt=None):
+    """
+    Open a Zarr container of MGB binary with the interface of np.memmap
+
+    Args:
+        filezarr (str) :: path of the container (e.g. QTUDO.zarr)
+        nc, nt (int) :: expected shape (None -> not checked)
+
+    Returns:
+        dados_mmap (ZarrMmap) :: see .ZarrMmap
+    """
+    if not os.path.exists(filezarr):
+        raise FileNotFoundError("missing zarr container: {}".format(filezarr))
+
+    zarr = _import_zarr()
+    z = zarr.open_array(filezarr, mode='r')
+
+    if nc is not None and z.shape[1] != nc:
+        raise ValueError("{} has {} mini, expected nc={}".format(filezarr, z.shape[1], nc))
+    if nt is not None and z.shape[0] != nt:
+        raise ValueError("{} has {} intervals, expected nt={} (check version)"
+                         .format(filezarr, z.shape[0], nt))
+
+    return ZarrMmap(z)
+
+
+def zarr_path(filebin):
+    """ Path of the container for a MGB binary (QTUDO.MGB -> QTUDO.zarr) """
+    return os.path.splitext(filebin)[0] + '.zarr'
+
+
+def open_mgb(filebin, nc, nt=None, fmt='mgb'):
+    """
+    Open a MGB binary as memory map, raw or from the Zarr container
+
+    Args:
+        filebin (str) :: path of binary file (e.g. QTUDO.MGB)
+        nc, nt (int) :: shape of the binary (nt=None -> from file)
+        fmt (str) :: 'mgb' (raw, see funcs_solver.read_mgb_as_mmap)
+                     'zarr' (container at .zarr_path(filebin))
+
+    Returns:
+        dados_mmap (np.memmap or ZarrMmap)
+    """
+    if fmt == 'zarr':
+        return read_zarr_as_mmap(zarr_path(filebin), nc, nt)
+    if fmt == 'mgb':
+        return funcs_solver.read_mgb_as_mmap(filebin, nc, nt)
+    raise ValueError("unknown format '{}' (use 'mgb' or 'zarr')".format(fmt))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweep of the MGB-BHO pre-processing
+    (area_threshold_t12, dmax, tolerance table of type 1...)
+
+@author: Mino Sorribas
+
+@info:
+    - shared stages (domain, t0, t3...) do not depend on the swept
+      parameters: they are resolved once and handed to the workers
+    - each configuration runs the remaining stages of funcs_pipeline
+      in a pool of processes, with the same cache of the pipeline
+    - configurations sharing an intermediate (e.g. same dmax and
+      different area_threshold_t12) compute it only once, see .run_sweep
+    - reported for each configuration: number of reaches of type 1/2/3/4,
+      lost_t4 and differences of Q95 against the reference configuration
+    - Q95 of cotrechos is evaluated as in the solver
+      (funcs_engine.downscale_stats, exact time-domain path for type 2),
+      each worker opens its own memory maps of the binaries
+
+"""
+
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import funcs_store
+import funcs_engine
+import funcs_pipeline
+
+
+# stages that do not depend on the parameters of the sweep
+SHARED_STAGES = ['mini', 'tble_bho', 'domain', 't0', 't3']
+
+# stages run (in order) for each configuration, see .run_sweep
+SWEEP_PHASES = ['t2', 'solver']
+
+# values shared with the workers (set by ._init_worker)
+_WORKER = {}
+
+
+
+
+#-----------------------------------------------------------------------------
+# CONFIGURATIONS
+#-----------------------------------------------------------------------------
+def make_configs(grid):
+    """
+    Configurations of the sweep from a grid of parameters
+
+    Args:
+        grid (dict) :: {parameter: [values]}
+                       e.g. {'area_threshold_t12':[800.,1000.], 'dmax':[0.5]}
+
+    Returns:
+        configs (list) :: [{parameter: value},...] (cartesian product)
+    """
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def config_label(config):
+    """ Short label of a configuration (e.g. 'area_threshold_t12=800.0|dmax=0.5') """
+    return '|'.join('{}={}'.format(k, v) for k, v in config.items())
+
+
+def check_shared(stages, files, params, configs, shared=SHARED_STAGES):
+    """
+    Check that the shared stages are the same for every configuration
+
+    Returns:
+        None (raises ValueError)
+    """
+    keys_base = funcs_pipeline.stage_keys(stages, files, params)
+    for config in configs:
+        keys = funcs_pipeline.stage_keys(stages, files, {**params, **config})
+        for name in shared:
+            if keys[name] != keys_base[name]:
+                raise ValueError("stage '{}' depends on the sweep ({}), remove it from shared"
+                                 .format(name, config_label(config)))
+    return None
+
+
+
+
+#-----------------------------------------------------------------------------
+# SUMMARY OF A CONFIGURATION
+#-----------------------------------------------------------------------------
+def summarize_results(results, dict_var_q95=None, dict_var_mmap=None, list_t=None,
+                      chunk_size=None):
+    """
+    Summary of a run of the pipeline
+
+    Args:
+        results (dict) :: see funcs_pipeline.run_pipeline (up to 'solver')
+        dict_var_q95 (dict) :: Q95 of mini {var: (nc,)} (None -> no Q95)
+        dict_var_mmap (dict) :: {var: memmap of binary (nt x nc)}
+        list_t (list) :: list of integer of selected timesteps
+        chunk_size (int) :: timesteps per chunk of the time-domain path
+                            (None -> exact, as mgbbhods_solver_new.py)
+
+    Returns:
+        summary (dict) :: counts of each type and lost_t4
+        q95 (pd.Series) :: Q95 indexed by cotrecho (None without dict_var_q95)
+
+    Notes:
+        - Q95 of cotrechos is evaluated as in the solver
+          (funcs_engine.downscale_stats with exact=True): scaled Q95 of mini
+          for single mini, time-domain path of the binaries for type 2
+    """
+    dict_bho_solver = results['solver']
+    tipos = np.array(list(dict_bho_solver.values()))
+
+    summary = {'n_t{}'.format(t): int((tipos == t).sum()) for t in (1, 2, 3, 4)}
+    summary['lost_t4'] = len(results['t4']['lost_t4'])
+
+    q95 = None
+    if dict_var_q95 is not None:
+        dict_type_params = {1: results['t1']['dict_parameters_t1'],
+                            2: results['t2']['dict_parameters_t2'],
+                            3: results['t3']['dict_parameters_t3'],
+                            4: results['t4']['dict_parameters_t4']}
+        list_to_downscale = sorted(dict_bho_solver.keys())
+        op = funcs_engine.make_downscaling_operator(dict_bho_solver,
+                                                    dict_type_params,
+                                                    list_to_downscale)
+        if dict_var_mmap is None:
+            raise ValueError("Q95 of type 2 needs the binaries (dict_var_mmap)")
+        res = funcs_engine.downscale_stats(op, ['q95'],
+                                           dict_stat_mini = {'q95': dict_var_q95},
+                                           dict_var_mmap = dict_var_mmap,
+                                           list_t = list_t,
+                                           exact = True,
+                                           chunk_size = chunk_size)
+        q95 = pd.Series(res['q95'], index=op['cotrecho'])
+
+    return summary, q95
+
+
+def compare_q95(q95, q95_ref, tipo=None, tipo_ref=None):
+    """
+    Differences of Q95 against the reference configuration
+
+    Args:
+        q95, q95_ref (pd.Series) :: Q95 indexed by cotrecho
+        tipo, tipo_ref (dict) :: {cotrecho:solver} (None -> not counted)
+
+    Returns:
+        diffs (dict) :: number of common cotrechos, of cotrechos with another
+                        type, mean/p95/max of absolute relative difference (%)
+    """
+    common = q95.index.intersection(q95_ref.index)
+    q, qref = q95.loc[common].values, q95_ref.loc[common].values
+
+    valid = np.abs(qref) > 0.
+    rel = 100.*np.abs(q[valid]/qref[valid] - 1.)
+
+    diffs = {'n_common': len(common),
+             'n_only': len(q95.index.difference(q95_ref.index)),
+             'dq95_mean_%': float(np.mean(rel)) if rel.size else np.nan,
+             'dq95_p95_%': float(np.percentile(rel, 95)) if rel.size else np.nan,
+             'dq95_max_%': float(np.max(rel)) if rel.size else np.nan}
+
+    if tipo is not None and tipo_ref is not None:
+        diffs['n_type_changed'] = int(sum(tipo[c] != tipo_ref[c] for c in common))
+
+    return diffs
+
+
+
+
+#-----------------------------------------------------------------------------
+# SWEEP (POOL OF PROCESSES)
+#-----------------------------------------------------------------------------
+def open_binaries(binaries):
+    """ Memory maps {var: memmap} of the binaries of the sweep (None -> None) """
+    if binaries is None:
+        return None
+    return {var: funcs_store.open_mgb(filebin, binaries['nc'], binaries['nt'],
+                                      binaries.get('fmt', 'mgb'))
+            for var, filebin in binaries['files'].items()}
+
+
+def _init_worker(stages, files, params, path_cache, shared_values, dict_var_q95, binaries):
+    _WORKER.update(stages=stages, files=files, params=params, path_cache=path_cache,
+                   shared_values=shared_values, dict_var_q95=dict_var_q95,
+                   binaries=binaries, dict_var_mmap=open_binaries(binaries))
+
+
+def _run_config(config, target, summarize):
+    w = _WORKER
+    targets = funcs_pipeline.TARGETS_DICTS if summarize else [target]
+    results, status = funcs_pipeline.run_pipeline(w['stages'], w['files'],
+                                                  {**w['params'], **config},
+                                                  w['path_cache'],
+                                                  targets = targets,
+                                                  values = w['shared_values'],
+                                                  verbose = False)
+    if not summarize:
+        return None
+    b = w['binaries'] or {}
+    summary, q95 = summarize_results(results, w['dict_var_q95'], w['dict_var_mmap'],
+                                     b.get('list_t'), b.get('chunk_size'))
+    return summary, q95, results['solver']
+
+
+def run_sweep(stages, files, params, configs, path_cache='./cache_prepro/',
+              dict_var_q95 = None,
+              binaries = None,
+              nproc = None,
+              shared = SHARED_STAGES,
+              phases = SWEEP_PHASES):
+    """
+    Evaluate many configurations of the pre-processing
+
+    Args:
+        stages (list) :: see funcs_pipeline.make_stages_mgbbho
+        files (dict) :: {name: pathfile}
+        params (dict) :: base parameters (reference configuration)
+        configs (list) :: see .make_configs (parameters replaced in params)
+        path_cache (str) :: directory of cached stages
+        dict_var_q95 (dict) :: Q95 of mini {var: (nc,)} (None -> no Q95)
+        binaries (dict) :: binaries for the Q95 of type 2, opened by each
+                           worker: 'files' {var: filebin}, 'nc', 'nt', 'fmt',
+                           'list_t' and 'chunk_size' (see .summarize_results)
+        nproc (int) :: number of processes (None -> os.cpu_count())
+        shared (list) :: stages resolved once and shared with workers
+        phases (list) :: stages run before the summary; in each phase only
+                         one configuration per distinct key is run
+
+    Returns:
+        df_sweep (pd.DataFrame) :: one row per configuration (first row is
+                                   the reference params)
+        dict_q95 (dict) :: {label: pd.Series of Q95} (empty without Q95)
+    """
+    check_shared(stages, files, params, configs, shared)
+    if dict_var_q95 is not None and binaries is None:
+        raise ValueError("Q95 of the sweep needs the binaries (see .summarize_results)")
+
+    # shared stages (once)
+    print(" - shared stages... ")
+    shared_values, _ = funcs_pipeline.run_pipeline(stages, files, params, path_cache,
+                                                   targets=shared)
+    shared_values = {k: v for k, v in shared_values.items() if k in shared}
+
+    all_configs = [{}] + list(configs)
+    labels = ['reference'] + [config_label(c) for c in configs]
+
+    initargs = (stages, files, params, path_cache, shared_values, dict_var_q95, binaries)
+    with ProcessPoolExecutor(max_workers=nproc or os.cpu_count(),
+                             initializer=_init_worker, initargs=initargs) as pool:
+
+        # phases: one run per distinct key (others read it from cache)
+        for target in phases:
+            distinct = {}
+            for config in all_configs:
+                keys = funcs_pipeline.stage_keys(stages, files, {**params, **config})
+                distinct.setdefault(keys[target], config)
+            print(" - stage {}: {} distinct of {} configurations"
+                  .format(target, len(distinct), len(all_configs)))
+            list(pool.map(_run_config, distinct.values(),
+                          itertools.repeat(target), itertools.repeat(False)))
+
+        # summary of all configurations (from cache)
+        outputs = list(pool.map(_run_config, all_configs,
+                                itertools.repeat(None), itertools.repeat(True)))
+
+    # table of results
+    rows = []
+    dict_q95 = {}
+    _, q95_ref, tipo_ref = outputs[0]
+    for label, config, (summary, q95, tipo) in zip(labels, all_configs, outputs):
+        row = {'config': label, **{**params, **config}, **summary}
+        if q95 is not None:
+            row.update(compare_q95(q95, q95_ref, tipo, tipo_ref))
+            dict_q95[label] = q95
+        rows.append(row)
+
+    df_sweep = pd.DataFrame(rows)
+    if 'tble_tol' in df_sweep:
+        df_sweep['tble_tol'] = df_sweep['tble_tol'].astype(str)
+    return df_sweep, dict_q95
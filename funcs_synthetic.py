@@ -0,0 +1,584 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic MGB + BHO datasets for benchmarks and local tests
+
+@author: Mino Sorribas
+
+@info:
+    - BHO-like drainage: random dendritic network (binary confluences),
+      grown from coastal outlets, with the columns of funcs_io.read_gdf_bho
+      (cotrecho, nutrjus, cobacia in Otto Pfafstetter codes, nuareacont,
+      nuareamont, dedominial, nustrahler...) and straight line geometries
+    - MGB-like catchments (mini): the network is cut at large confluences
+      and when the local area reaches a threshold, numbered from
+      headwaters to outlets (minijus > mini), with headers of mini.xlsx
+    - polygons of mini: Voronoi cells of the midpoints of BHO reaches
+      dissolved by mini (midpoints fall inside the polygon of their mini)
+    - binaries QTUDO/QITUDO (nt x nc, float32): seasonal specific runoff
+      with persistent noise by sub-basin, local runoff scaled by the area
+      of the mini and discharge accumulated along the mini topology
+    - geopandas/shapely are only needed for geometries and polygons
+    - reproducible by seed
+
+@usage:
+    files = make_synthetic_dataset('../synthetic/', n_reaches=100000, nt=3650)
+
+"""
+
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import funcs_topology
+import funcs_datasets
+
+
+SYNTH_CRS = 'EPSG:4674'
+KM_PER_DEG = 111.
+
+# headers of mini.xlsx (MGB-AS), see funcs_io.read_tble_mini
+MINI_HEADERS = ['Mini', 'Xcen', 'Ycen', 'Sub', 'Area_(km2)', 'AreaM_(km2)',
+                'Ltr_(km)', 'MiniJus', 'Ordem', 'Hdr']
+
+
+
+
+#-----------------------------------------------------------------------------
+# DENDRITIC NETWORK
+#-----------------------------------------------------------------------------
+def make_tree(n_reaches, seed=0, n_outlets=4, p_outlet=0.002, p_tip=0.7):
+    """
+    Random dendritic network (each reach receives at most two reaches)
+
+    Args:
+        n_reaches (int) :: number of reaches
+        seed (int) :: random seed
+        n_outlets (int) :: first reaches as outlets (main basins)
+        p_outlet (float) :: probability of a new (coastal) outlet
+        p_tip (float) :: probability of growing from a headwater
+                         (long rivers), else from any open confluence
+
+    Returns:
+        down (np.array) :: row of the downstream reach (-1 at outlets),
+                           rows are ordered from outlets (down[i] < i)
+    """
+    rng = np.random.default_rng(seed)
+    down = np.full(n_reaches, -1, dtype=np.int64)
+    nchild = [0]*n_reaches
+
+    # sets with O(1) random choice and removal (list + position)
+    tips, pos_tip = [], [-1]*n_reaches
+    opened, pos_open = [], [-1]*n_reaches
+
+    def _remove(lst, pos, i):
+        k = pos[i]
+        last = lst[-1]
+        lst[k] = last
+        pos[last] = k
+        lst.pop()
+        pos[i] = -1
+
+    u_outlet = rng.random(n_reaches).tolist()
+    u_tip = rng.random(n_reaches).tolist()
+    u_pick = rng.random(n_reaches).tolist()
+
+    for i in range(n_reaches):
+        if i >= n_outlets and opened and u_outlet[i] >= p_outlet:
+            if tips and u_tip[i] < p_tip:
+                parent = tips[int(u_pick[i]*len(tips))]
+            else:
+                parent = opened[int(u_pick[i]*len(opened))]
+            down[i] = parent
+            nchild[parent] += 1
+            if pos_tip[parent] >= 0:
+                _remove(tips, pos_tip, parent)
+            if nchild[parent] == 2:
+                _remove(opened, pos_open, parent)
+
+        pos_tip[i] = len(tips)
+        tips.append(i)
+        pos_open[i] = len(opened)
+        opened.append(i)
+
+    return down
+
+
+def _children(down):
+    children = [[] for _ in range(len(down))]
+    for i, d in enumerate(down.tolist()):
+        if d >= 0:
+            children[d].append(i)
+    return children
+
+
+def otto_codes(down, area, coast_order=None, max_digits=15):
+    """
+    Otto Pfafstetter codes of the reaches
+
+        - in each basin, the main stem follows the largest upstream area
+        - the 4 largest tributaries along the stem are 2, 4, 6, 8 (from
+          downstream) and the interbasins of the stem are 1, 3, 5, 7, 9
+        - outlets are tributaries of the coastline (in coast_order)
+        - codes are refined until single reaches or max_digits
+
+    Args:
+        down (np.array) :: row of the downstream reach (-1 at outlets)
+        area (np.array) :: upstream drainage area (nuareamont)
+        coast_order (np.array) :: position of outlets along the coast
+        max_digits (int) :: maximum length of the codes
+
+    Returns:
+        codes (list) :: cobacia of each reach (str)
+    """
+    down = np.asarray(down)
+    area = np.asarray(area, dtype=float).tolist()
+    children = _children(down)
+    codes = [None]*len(down)
+
+    outlets = np.flatnonzero(down < 0)
+    if coast_order is not None:
+        outlets = outlets[np.argsort(np.asarray(coast_order)[outlets], kind='stable')]
+
+    def _subtree(root):
+        rows, stack = [], [root]
+        while stack:
+            r = stack.pop()
+            rows.append(r)
+            stack.extend(children[r])
+        return rows
+
+    def _fill(stem, tribs, prefix):
+        for r in stem:
+            codes[r] = prefix
+        for _, root in tribs:
+            for r in _subtree(root):
+                codes[r] = prefix
+
+    def _basin(root, prefix):
+        # main stem (largest upstream area)
+        stem = [root]
+        while children[stem[-1]]:
+            stem.append(max(children[stem[-1]], key=lambda c: area[c]))
+        tribs = [(k, c) for k, s in enumerate(stem[:-1]) for c in children[s] if c != stem[k+1]]
+        return stem, tribs
+
+    # tasks: (stem, tribs, prefix) ; tribs are (position in stem, root)
+    tasks = [([], [(k, int(o)) for k, o in enumerate(outlets)], '')]
+    while tasks:
+        stem, tribs, prefix = tasks.pop()
+
+        if len(prefix) >= max_digits:
+            _fill(stem, tribs, prefix)
+            continue
+
+        # chain without tributaries: up to 5 interbasins
+        if not tribs:
+            if len(stem) == 1:
+                codes[stem[0]] = prefix or '1'
+                continue
+            for d, seg in zip('13579', np.array_split(np.array(stem), min(5, len(stem)))):
+                tasks.append((seg.tolist(), [], prefix + d))
+            continue
+
+        # 4 largest tributaries, from downstream
+        top = sorted(sorted(tribs, key=lambda t: -area[t[1]])[:4])
+        for d, (_, root) in zip('2468', top):
+            stem_t, tribs_t = _basin(root, prefix + d)
+            tasks.append((stem_t, tribs_t, prefix + d))
+
+        # interbasins (stem segments and smaller tributaries)
+        itop = set(root for _, root in top)
+        bounds = [-1] + [k for k, _ in top] + [len(stem) - 1 if stem else max(k for k, _ in tribs)]
+        for j, d in enumerate('13579'[:len(top) + 1]):
+            k0, k1 = bounds[j] + 1, bounds[j+1] + 1 if j < len(top) else None
+            seg = stem[k0:k1] if stem else []
+            seg_tribs = [(k - k0, r) for k, r in tribs
+                         if r not in itop and k >= k0 and (k1 is None or k < k1)]
+            if seg or seg_tribs:
+                tasks.append((seg, seg_tribs, prefix + d))
+
+    return codes
+
+
+def strahler(topo):
+    """ Strahler order of reaches (from headwaters) """
+    down = topo['down'].tolist()
+    n = len(down)
+    order = [0]*n
+    maxo = [0]*n
+    nmax = [0]*n
+    for r in topo['order'].tolist():
+        o = 1 if maxo[r] == 0 else (maxo[r] + 1 if nmax[r] >= 2 else maxo[r])
+        order[r] = o
+        p = down[r]
+        if p >= 0:
+            if o > maxo[p]:
+                maxo[p], nmax[p] = o, 1
+            elif o == maxo[p]:
+                nmax[p] += 1
+    return np.array(order, dtype=np.int64)
+
+
+def make_bho_table(n_reaches, seed=0, area_mean=7., width_deg=20., **kwargs_tree):
+    """
+    Synthetic BHO drainage table (columns of funcs_io.read_gdf_bho)
+
+    Args:
+        n_reaches (int) :: number of reaches
+        seed (int) :: random seed
+        area_mean (float) :: mean contributing area of reaches [km2]
+        width_deg (float) :: length of the coastline [degrees]
+        kwargs_tree :: see .make_tree
+
+    Returns:
+        df_tble_bho (pd.DataFrame) :: table of BHO drainage, plus the
+                                      nodes of lines 'x0','y0' (downstream)
+                                      and 'x1','y1' (upstream)
+    """
+    rng = np.random.default_rng(seed + 1)
+    down = make_tree(n_reaches, seed, **kwargs_tree)
+    topo = funcs_topology.make_topology(down)
+
+    # areas [km2] and lengths [km]
+    sigma = 0.8
+    nuareacont = rng.lognormal(np.log(area_mean) - 0.5*sigma**2, sigma, n_reaches)
+    nuareamont = funcs_topology.accumulate_upstream(topo, nuareacont)
+    nucomptrec = 1.3*np.sqrt(nuareacont)*rng.lognormal(0., 0.3, n_reaches)
+
+    # geometry: outlets on the coast (y=0), rivers grow inland
+    theta = np.zeros(n_reaches)
+    x0, y0 = np.zeros(n_reaches), np.zeros(n_reaches)
+    x1, y1 = np.zeros(n_reaches), np.zeros(n_reaches)
+    dist = np.zeros(n_reaches)
+    for k, rows in enumerate(topo['levels_down']):
+        if k == 0:
+            x0[rows] = rng.uniform(0., width_deg, len(rows))
+            theta[rows] = 0.5*np.pi + rng.normal(0., 0.3, len(rows))
+        else:
+            p = down[rows]
+            x0[rows], y0[rows] = x1[p], y1[p]
+            theta[rows] = theta[p] + rng.normal(0., 0.5, len(rows))
+            dist[rows] = dist[p] + nucomptrec[p]
+        x1[rows] = x0[rows] + nucomptrec[rows]/KM_PER_DEG*np.cos(theta[rows])
+        y1[rows] = y0[rows] + nucomptrec[rows]/KM_PER_DEG*np.sin(theta[rows])
+
+    # codes
+    cobacia = otto_codes(down, nuareamont, coast_order=x0)
+    cocursodag = [c[:max(i for i, s in enumerate(c) if int(s) % 2 == 0) + 1]
+                  if any(int(s) % 2 == 0 for s in c) else c[:1] for c in cobacia]
+    cocdadesag = [cocursodag[d] if d >= 0 else '' for d in down.tolist()]
+    nuordemcda = [max(1, sum(int(s) % 2 == 0 for s in c)) for c in cocursodag]
+
+    dedominial = np.where(nuareamont > 5000., 'Federal', 'Estadual').astype(object)
+    dedominial[down < 0] = 'Linha de Costa'
+
+    # cotrecho (random unique codes) and nutrjus
+    cotrecho = rng.permutation(n_reaches).astype(np.int64) + 1
+    nutrjus = pd.array(np.where(down >= 0, cotrecho[np.maximum(down, 0)], 0), dtype=pd.Int32Dtype())
+    nutrjus[down < 0] = pd.NA
+
+    df_tble_bho = pd.DataFrame({
+        'cotrecho': cotrecho,
+        'cobacia': cobacia,
+        'nucomptrec': np.round(nucomptrec, 4),
+        'nuareacont': np.round(nuareacont, 4),
+        'nuareamont': np.round(nuareamont, 4),
+        'nutrjus': nutrjus,
+        'dedominial': dedominial,
+        'nustrahler': pd.array(strahler(topo), dtype=pd.Int32Dtype()),
+        'nuordemcda': pd.array(nuordemcda, dtype=pd.Int32Dtype()),
+        'cocursodag': cocursodag,
+        'cocdadesag': cocdadesag,
+        'nudistbact': np.round(dist, 4),
+        'nunivotto': [len(c) for c in cobacia],
+        'x0': x0, 'y0': y0, 'x1': x1, 'y1': y1,
+        })
+
+    # table order is arbitrary in BHO
+    df_tble_bho = df_tble_bho.iloc[rng.permutation(n_reaches)].reset_index(drop=True)
+    return df_tble_bho
+
+
+def make_bho_geometry(df_tble_bho, crs=SYNTH_CRS):
+    """ GeoDataFrame of BHO drainage (lines from upstream to downstream node) """
+    import geopandas as gpd
+    from shapely.geometry import LineString
+
+    geometry = [LineString([(a, b), (c, d)]) for a, b, c, d in
+                zip(df_tble_bho['x1'], df_tble_bho['y1'], df_tble_bho['x0'], df_tble_bho['y0'])]
+    cols = [c for c in df_tble_bho.columns if c not in ('x0', 'y0', 'x1', 'y1')]
+    return gpd.GeoDataFrame(df_tble_bho[cols], geometry=geometry, crs=crs)
+
+
+
+
+#-----------------------------------------------------------------------------
+# MGB CATCHMENTS (MINI)
+#-----------------------------------------------------------------------------
+def make_minis(df_tble_bho, reaches_per_mini=60, area_error=0.05, seed=0):
+    """
+    Synthetic MGB catchments over the BHO-like network
+
+        outlets of mini are
+        - basin outlets with area >= area_min/2 (smaller coastal basins
+          stay out of the MGB domain)
+        - branches with area >= area_min at confluences of two such branches
+        - reaches where the local area of the mini reaches area_min
+        area_min = area_mean x reaches_per_mini
+
+    Args:
+        df_tble_bho (pd.DataFrame) :: see .make_bho_table
+        reaches_per_mini (int) :: typical number of reaches of a mini
+        area_error (float) :: relative error of AreaM of MGB against BHO
+        seed (int) :: random seed
+
+    Returns:
+        dict_bho_mini (dict) :: {cotrecho:mini} of reaches in the domain
+        df_mini (pd.DataFrame) :: table with the headers of mini.xlsx
+    """
+    rng = np.random.default_rng(seed + 2)
+    topo = funcs_topology.topology_from_bho(df_tble_bho)
+    down = topo['down']
+    n = len(down)
+    areacont = df_tble_bho['nuareacont'].to_numpy(dtype=float)
+    areamont = df_tble_bho['nuareamont'].to_numpy(dtype=float)
+    area_min = areacont.mean()*reaches_per_mini
+
+    # branches entering a confluence of two large branches
+    big = areamont >= area_min
+    nbig = np.bincount(down[big & (down >= 0)], minlength=n)
+    confl = big & (down >= 0) & (nbig[np.maximum(down, 0)] >= 2)
+
+    # local area since the last outlet (from headwaters)
+    downl = down.tolist()
+    accl, confl_l, big_l = areacont.tolist(), confl.tolist(), big.tolist()
+    outl = [False]*n
+    for r in topo['order'].tolist():
+        d = downl[r]
+        if d < 0:
+            outl[r] = areamont[r] >= 0.5*area_min
+        elif confl_l[r] or (big_l[r] and accl[r] >= area_min):
+            outl[r] = True
+        if d >= 0 and not outl[r]:
+            accl[d] += accl[r]
+    is_out = np.array(outl)
+
+    # mini of each reach: nearest outlet downstream (inclusive)
+    rows_out = np.flatnonzero(is_out)
+    rows_out = rows_out[np.argsort(topo['level_up'][rows_out], kind='stable')]
+    mini_of_out = np.zeros(n, dtype=np.int64)
+    mini_of_out[rows_out] = np.arange(1, len(rows_out) + 1)   # headwaters first
+    mini = funcs_topology.propagate_downstream(topo, mini_of_out, is_out, fill=-1)
+
+    nc = len(rows_out)
+    dom = mini > 0
+    dict_bho_mini = dict(zip(topo['cotrecho'][dom].tolist(), mini[dom].tolist()))
+
+    # mini topology
+    d_out = down[rows_out]
+    minijus = np.where(d_out >= 0, mini[np.maximum(d_out, 0)], -1)
+    minijus[minijus <= 0] = -1
+    mtopo = funcs_topology.make_topology(np.where(minijus > 0, minijus - 1, -1))
+    sub_root = funcs_topology.propagate_downstream(mtopo, np.arange(nc), mtopo['down'] < 0)
+    _, sub = np.unique(sub_root, return_inverse=True)
+
+    # areas and centroids
+    icol = mini[dom] - 1
+    area_km2 = np.bincount(icol, weights=areacont[dom], minlength=nc)
+    xm = 0.5*(df_tble_bho['x0'].to_numpy() + df_tble_bho['x1'].to_numpy())[dom]
+    ym = 0.5*(df_tble_bho['y0'].to_numpy() + df_tble_bho['y1'].to_numpy())[dom]
+    cnt = np.bincount(icol, minlength=nc)
+    xcen = np.bincount(icol, weights=xm, minlength=nc)/cnt
+    ycen = np.bincount(icol, weights=ym, minlength=nc)/cnt
+    ltr = np.bincount(icol, weights=df_tble_bho['nucomptrec'].to_numpy()[dom], minlength=nc)
+
+    aream = areamont[rows_out]*(1. + np.clip(rng.normal(0., area_error, nc), -0.3, 0.3))
+
+    df_mini = pd.DataFrame({
+        'Mini': np.arange(1, nc + 1),
+        'Xcen': np.round(xcen, 6),
+        'Ycen': np.round(ycen, 6),
+        'Sub': sub + 1,
+        'Area_(km2)': np.round(area_km2, 4),
+        'AreaM_(km2)': np.round(aream, 4),
+        'Ltr_(km)': np.round(ltr, 4),
+        'MiniJus': minijus,
+        'Ordem': strahler(mtopo),
+        'Hdr': 0,
+        }, columns=MINI_HEADERS)
+
+    return dict_bho_mini, df_mini
+
+
+def make_mini_polygons(df_tble_bho, dict_bho_mini, crs=SYNTH_CRS):
+    """
+    Polygons of mini from Voronoi cells of midpoints of BHO reaches
+
+    Returns:
+        gdf_mgb_catchments (gpd.GeoDataFrame) :: polygons with column 'Mini'
+    """
+    import geopandas as gpd
+    from shapely.geometry import MultiPoint
+    from shapely.ops import voronoi_diagram
+
+    xm = 0.5*(df_tble_bho['x0'].to_numpy() + df_tble_bho['x1'].to_numpy())
+    ym = 0.5*(df_tble_bho['y0'].to_numpy() + df_tble_bho['y1'].to_numpy())
+    mini = df_tble_bho['cotrecho'].map(dict_bho_mini).fillna(0).astype(int).to_numpy()
+
+    points = MultiPoint(list(zip(xm, ym)))
+    envelope = points.envelope.buffer(0.1)
+    cells = voronoi_diagram(points, envelope=envelope)
+    gdf_cells = gpd.GeoDataFrame(geometry=list(cells.geoms), crs=crs)
+    gdf_cells = gdf_cells.clip(envelope)
+
+    # cell of each midpoint
+    gdf_pts = gpd.GeoDataFrame({'Mini': mini}, geometry=gpd.points_from_xy(xm, ym), crs=crs)
+    join = gpd.sjoin(gdf_pts, gdf_cells, how='inner', predicate='within')
+    join = join[~join.index.duplicated()]
+    gdf_cells['Mini'] = 0
+    gdf_cells.loc[join['index_right'].to_numpy(), 'Mini'] = join['Mini'].to_numpy()
+
+    gdf_mgb_catchments = gdf_cells[gdf_cells['Mini'] > 0].dissolve(by='Mini').reset_index()
+    return gdf_mgb_catchments[['Mini', 'geometry']]
+
+
+
+
+#-----------------------------------------------------------------------------
+# MGB BINARIES
+#-----------------------------------------------------------------------------
+def make_binaries(df_mini, file_qtudo, file_qcel, nt, seed=0,
+                  q_spec = 0.02,
+                  amplitude = 0.8,
+                  rho = 0.9,
+                  sigma = 0.5,
+                  chunk_size = 365):
+    """
+    Synthetic QTUDO and QITUDO binaries (nt x nc, float32)
+
+        specific runoff = q_spec*exp(amplitude*sin(season + phase) + noise)
+        - phase of the season changes with latitude of the mini
+        - noise is AR(1) (rho, sigma) by sub-basin
+        local runoff (QITUDO) = specific runoff x Area_(km2)
+        discharge (QTUDO) = local runoff accumulated along MiniJus
+
+    Args:
+        df_mini (pd.DataFrame) :: see .make_minis
+        file_qtudo, file_qcel (str) :: output binaries
+        nt (int) :: number of days
+        seed (int) :: random seed
+        q_spec (float) :: mean specific runoff [m3/s.km2]
+        amplitude, rho, sigma (float) :: seasonality and noise
+        chunk_size (int) :: days generated at each write
+
+    Returns:
+        None
+    """
+    rng = np.random.default_rng(seed + 3)
+    nc = len(df_mini)
+    area = df_mini['Area_(km2)'].to_numpy(dtype=float)
+    ycen = df_mini['Ycen'].to_numpy(dtype=float)
+    _, sub = np.unique(df_mini['Sub'].to_numpy(), return_inverse=True)
+    nsub = sub.max() + 1
+
+    minijus = df_mini['MiniJus'].to_numpy()
+    topo = funcs_topology.make_topology(np.where(minijus > 0, minijus - 1, -1))
+
+    yspan = max(np.ptp(ycen), 1e-6)
+    phase = np.pi*(ycen - ycen.min())/yspan
+    base = q_spec*rng.lognormal(0., 0.3, nsub)[sub]
+
+    noise = rng.normal(0., sigma, nsub)
+    with open(file_qtudo, 'wb') as fq, open(file_qcel, 'wb') as fc:
+        for i in range(0, nt, chunk_size):
+            days = np.arange(i, min(i + chunk_size, nt))
+            e = np.empty((len(days), nsub))
+            for k in range(len(days)):
+                noise = rho*noise + np.sqrt(1. - rho**2)*rng.normal(0., sigma, nsub)
+                e[k] = noise
+            season = amplitude*np.sin(2.*np.pi*days[:, None]/365.25 + phase[None, :])
+            qspec = base[None, :]*np.exp(season + e[:, sub] - 0.5*sigma**2)
+
+            qcel = qspec*area[None, :]
+            qtudo = funcs_topology.accumulate_upstream(topo, qcel.T).T
+
+            qtudo.astype('<f4').tofile(fq)
+            qcel.astype('<f4').tofile(fc)
+    return None
+
+
+
+
+#-----------------------------------------------------------------------------
+# DATASET
+#-----------------------------------------------------------------------------
+def dataset_files(path, name='synthetic'):
+    """
+    Files of a synthetic dataset
+
+    Returns:
+        files (dict) :: paths of 'file_gdf_bho', 'file_mini',
+                        'file_mgb_catchments_shp', 'file_tble_bho' (.pickle,
+                        without geometry), 'file_qtudo', 'file_qcel',
+                        'dict_bho_domain' (.pickle) and 'file_sidecar'
+    """
+    return {
+        'file_gdf_bho': os.path.join(path, 'geoft_bho_{}.gpkg'.format(name)),
+        'file_mini': os.path.join(path, 'mini.xlsx'),
+        'file_mgb_catchments_shp': os.path.join(path, 'mgb_catchments_{}.shp'.format(name)),
+        'file_tble_bho': os.path.join(path, 'tble_bho_{}.pickle'.format(name)),
+        'file_qtudo': os.path.join(path, 'QTUDO_{}.MGB'.format(name)),
+        'file_qcel': os.path.join(path, 'QITUDO_{}.MGB'.format(name)),
+        'dict_bho_domain': os.path.join(path, 'dict_bho_domain_{}.pickle'.format(name)),
+        'file_sidecar': funcs_datasets.sidecar_path(path, name),
+        }
+
+
+def make_synthetic_dataset(path, n_reaches=10000, nt=3650, seed=0,
+                           name = 'synthetic',
+                           reaches_per_mini = 60,
+                           dstart = datetime(1979, 1, 1),
+                           with_geometry = True):
+    """
+    Write a synthetic dataset with every input of the pipeline and solvers
+
+    Args:
+        path (str) :: output directory
+        n_reaches (int) :: number of BHO reaches
+        nt (int) :: number of days of the binaries
+        seed (int) :: random seed
+        name (str) :: name of the MGB run (sidecar '<name>.mgbrun.json')
+        reaches_per_mini (int) :: typical number of reaches of a mini
+        dstart (datetime) :: first date of the binaries
+        with_geometry (bool) :: False to skip gpkg/shp (no geopandas)
+
+    Returns:
+        files (dict) :: see .dataset_files
+    """
+    os.makedirs(path, exist_ok=True)
+    files = dataset_files(path, name)
+
+    print(" - network of {} reaches...".format(n_reaches))
+    df_tble_bho = make_bho_table(n_reaches, seed)
+
+    print(" - mini...")
+    dict_bho_mini, df_mini = make_minis(df_tble_bho, reaches_per_mini, seed=seed)
+    df_mini.to_excel(files['file_mini'], index=False)
+    pd.to_pickle(dict_bho_mini, files['dict_bho_domain'])
+    pd.to_pickle(df_tble_bho, files['file_tble_bho'])
+
+    if with_geometry:
+        print(" - geometries and polygons...")
+        gdf_tble_bho = make_bho_geometry(df_tble_bho)
+        gdf_tble_bho.to_file(files['file_gdf_bho'], driver='GPKG')
+        gdf_mgb_catchments = make_mini_polygons(df_tble_bho, dict_bho_mini)
+        gdf_mgb_catchments.to_file(files['file_mgb_catchments_shp'])
+
+    print(" - binaries {} days x {} mini...".format(nt, len(df_mini)))
+    make_binaries(df_mini, files['file_qtudo'], files['file_qcel'], nt, seed)
+    funcs_datasets.write_sidecar(path, name, nt, len(df_mini), dstart,
+                                 {'qtudo': os.path.basename(files['file_qtudo']),
+                                  'qcel': os.path.basename(files['file_qcel'])})
+    return files
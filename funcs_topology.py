@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+Topology of the BHO drainage (nutrjus) for vectorized network sweeps
+
+@author: Mino Sorribas
+
+@info:
+    - reaches are rows (0-based), 'down' is the row of the downstream
+      reach (-1 at outlets, i.e. nutrjus missing or outside the table)
+    - levels from headwaters: 0 at headwaters, 1 + max(upstream) elsewhere
+      (all upstream reaches of a row are in lower levels)
+    - levels from outlets: 0 at outlets, 1 + level of the downstream reach
+      (the downstream reach of a row is in the previous level)
+    - sweeps run one vectorized step per level (np.add.at or np.where),
+      instead of one python step per reach
+    - upstream closures are intervals of the preorder of a depth-first
+      search from the outlets (see .make_upstream_index), so all reaches
+      upstream of a row come in O(size of the result)
+    - the topology of a table is cached in memory (and optionally in a
+      .npz file) by a hash of cotrecho and nutrjus
+
+@usage:
+    topo = topology_from_bho(df_tble_bho)
+    nuareamont = accumulate_upstream(topo, nuareacont)
+    mini_jus = propagate_downstream(topo, x, take)
+    rows_up = upstream_rows(topo, row)
+
+"""
+
+import os
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+# topologies already computed {hash: topo}
+_TOPO_CACHE = {}
+
+
+
+
+#-----------------------------------------------------------------------------
+# LEVELS
+#-----------------------------------------------------------------------------
+def downstream_index(cotrecho, nutrjus):
+    """
+    Row of the downstream reach
+
+    Args:
+        cotrecho (np.array) :: code of reaches (n,)
+        nutrjus (np.array) :: code of the downstream reach (n,), <=0 or nan at outlets
+
+    Returns:
+        down (np.array) :: row of the downstream reach (-1 at outlets)
+    """
+    cot = np.asarray(cotrecho, dtype=np.int64)
+    jus = pd.Series(nutrjus).astype('Float64').fillna(-1).to_numpy(dtype=np.int64)
+    down = pd.Index(cot).get_indexer(jus)
+    down[jus <= 0] = -1
+    return down
+
+
+def levels_from_headwaters(down):
+    """ Topological levels, longest path from headwaters (Kahn, by levels) """
+    n = len(down)
+    indeg = np.bincount(down[down >= 0], minlength=n)
+    level = np.full(n, -1, dtype=np.int64)
+    frontier = np.flatnonzero(indeg == 0)
+    lev = 0
+    while frontier.size:
+        level[frontier] = lev
+        d = down[frontier]
+        d = d[d >= 0]
+        np.subtract.at(indeg, d, 1)
+        d = np.unique(d)
+        frontier = d[indeg[d] == 0]
+        lev += 1
+    if (level < 0).any():
+        raise ValueError("loop in the network (e.g. row {})".format(np.flatnonzero(level < 0)[0]))
+    return level
+
+
+def upstream_csr(down):
+    """
+    Upstream rows of each row (compressed sparse rows)
+
+    Returns:
+        start (np.array) :: (n+1,) upstream rows of r are ups[start[r]:start[r+1]]
+        ups (np.array) :: upstream rows, sorted by the downstream row
+    """
+    n = len(down)
+    has_down = down >= 0
+    ups = np.flatnonzero(has_down)
+    ups = ups[np.argsort(down[ups], kind='stable')]
+    count = np.bincount(down[has_down], minlength=n)
+    start = np.concatenate([[0], np.cumsum(count)])
+    return start, ups
+
+
+def levels_from_outlets(down):
+    """ Depth from outlets (number of reaches downstream to the outlet) """
+    n = len(down)
+    level = np.full(n, -1, dtype=np.int64)
+
+    start, ups = upstream_csr(down)
+    count = np.diff(start)
+
+    frontier = np.flatnonzero(down < 0)
+    lev = 0
+    while frontier.size:
+        level[frontier] = lev
+        cnt = count[frontier]
+        offset = np.repeat(start[frontier] - np.cumsum(cnt) + cnt, cnt)
+        frontier = ups[offset + np.arange(cnt.sum())]
+        lev += 1
+    if (level < 0).any():
+        raise ValueError("loop in the network (e.g. row {})".format(np.flatnonzero(level < 0)[0]))
+    return level
+
+
+def split_levels(level):
+    """ Rows of each level [(rows of level 0), (rows of level 1), ...] """
+    order = np.argsort(level, kind='stable')
+    bounds = np.searchsorted(level[order], np.arange(level.max(initial=-1) + 2))
+    return [order[bounds[i]:bounds[i+1]] for i in range(len(bounds) - 1)]
+
+
+
+
+#-----------------------------------------------------------------------------
+# TOPOLOGY
+#-----------------------------------------------------------------------------
+def make_topology(down):
+    """
+    Topological ordering and levels of a network
+
+    Args:
+        down (np.array) :: row of the downstream reach (-1 at outlets)
+
+    Returns:
+        topo (dict) :: 'down', 'level_up' and 'level_down' (n,), rows of each
+                       level in 'levels_up' and 'levels_down' (lists) and
+                       'order' (rows from headwaters to outlets)
+    """
+    down = np.asarray(down, dtype=np.int64)
+    level_up = levels_from_headwaters(down)
+    level_down = levels_from_outlets(down)
+    topo = {
+        'down': down,
+        'level_up': level_up,
+        'level_down': level_down,
+        'levels_up': split_levels(level_up),
+        'levels_down': split_levels(level_down),
+        }
+    topo['order'] = np.concatenate(topo['levels_up']) if topo['levels_up'] else down[:0]
+    return topo
+
+
+def _topology_hash(cot, jus):
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(cot).tobytes())
+    h.update(np.ascontiguousarray(jus).tobytes())
+    return h.hexdigest()
+
+
+def topology_from_bho(df_tble_bho, filecache=None):
+    """
+    Topology of the BHO table (cached)
+
+    Args:
+        df_tble_bho (pd.DataFrame) :: table of BHO drainage (cotrecho, nutrjus)
+        filecache (str) :: optional .npz to keep the levels between runs
+
+    Returns:
+        topo (dict) :: see .make_topology, plus 'cotrecho' and 'nutrjus'
+                       (-1 at missing nutrjus) in the order of the table
+    """
+    cot = df_tble_bho['cotrecho'].to_numpy(dtype=np.int64)
+    jus = df_tble_bho['nutrjus'].astype('Float64').fillna(-1).to_numpy(dtype=np.int64)
+    key = _topology_hash(cot, jus)
+
+    if key in _TOPO_CACHE:
+        return _TOPO_CACHE[key]
+
+    topo = None
+    if filecache and os.path.isfile(filecache):
+        with np.load(filecache) as f:
+            if str(f['key']) == key:
+                down = f['down']
+                level_up, level_down = f['level_up'], f['level_down']
+                topo = {'down': down, 'level_up': level_up, 'level_down': level_down,
+                        'levels_up': split_levels(level_up),
+                        'levels_down': split_levels(level_down)}
+                topo['order'] = np.concatenate(topo['levels_up']) if len(down) else down
+
+    if topo is None:
+        topo = make_topology(downstream_index(cot, jus))
+        if filecache:
+            np.savez(filecache, key=key, down=topo['down'],
+                     level_up=topo['level_up'], level_down=topo['level_down'])
+
+    topo['cotrecho'] = cot
+    topo['nutrjus'] = jus
+    _TOPO_CACHE[key] = topo
+    return topo
+
+
+
+
+#-----------------------------------------------------------------------------
+# SWEEPS
+#-----------------------------------------------------------------------------
+def accumulate_upstream(topo, x):
+    """
+    Sum of values over all upstream reaches (including the reach)
+        y[r] = x[r] + sum(y[u] for u with down[u] == r)
+
+    Args:
+        topo (dict) :: see .make_topology
+        x (np.array) :: values of reaches (n,) or (n x k), e.g. (reach x time)
+
+    Returns:
+        y (np.array) :: accumulated values (same shape of x)
+    """
+    y = np.array(x, dtype=float)
+    down = topo['down']
+    for rows in topo['levels_up']:
+        dn = down[rows]
+        m = dn >= 0
+        if m.any():
+            np.add.at(y, dn[m], y[rows[m]])
+    return y
+
+
+def propagate_downstream(topo, x, take, fill=-1):
+    """
+    Values carried from downstream to upstream reaches
+        y[r] = x[r] if take[r] else y[down[r]]  (fill at outlets)
+
+    Args:
+        topo (dict) :: see .make_topology
+        x (np.array) :: values of reaches (n,)
+        take (np.array) :: bool (n,), rows that keep their own value
+        fill :: value of rows without any take downstream
+
+    Returns:
+        y (np.array) :: propagated values (n,)
+
+    Notes:
+        e.g. nearest type 1 strictly downstream of each reach:
+            take = is_t1[down] (rows just upstream of a type 1), x = down
+    """
+    x = np.asarray(x)
+    take = np.asarray(take, dtype=bool)
+    down = topo['down']
+    y = np.full(len(down), fill, dtype=np.result_type(x, np.asarray(fill)))
+    for rows in topo['levels_down']:
+        dn = down[rows]
+        inherit = np.where(dn >= 0, y[np.maximum(dn, 0)], fill)
+        y[rows] = np.where(take[rows], x[rows], inherit)
+    return y
+
+
+
+
+#-----------------------------------------------------------------------------
+# UPSTREAM CLOSURE
+#-----------------------------------------------------------------------------
+def make_upstream_index(topo):
+    """
+    Preorder of a depth-first search from the outlets, where the reaches
+    upstream of a row (row included) are a contiguous interval
+        upstream(r) = preorder[tin[r]:tin[r] + size[r]]
+
+    Args:
+        topo (dict) :: see .make_topology
+
+    Returns:
+        upidx (dict) :: 'preorder' (rows in preorder), 'tin' (position of
+                        each row in the preorder) and 'size' (number of
+                        reaches upstream, row included)
+
+    Notes:
+        - built by levels from outlets: the first upstream reach starts
+          right after its downstream reach, the next ones after the
+          intervals of their siblings
+    """
+    down = topo['down']
+    n = len(down)
+    size = accumulate_upstream(topo, np.ones(n)).astype(np.int64)
+    tin = np.zeros(n, dtype=np.int64)
+
+    for rows in topo['levels_down']:
+        dn = down[rows]
+        isort = np.lexsort((rows, dn))
+        r, d = rows[isort], dn[isort]
+
+        # offset inside siblings (outlets are the siblings of level 0)
+        excl = np.cumsum(size[r]) - size[r]
+        first = np.r_[True, d[1:] != d[:-1]]
+        base = np.repeat(excl[first], np.diff(np.r_[np.flatnonzero(first), len(r)]))
+        tin[r] = np.where(d >= 0, tin[np.maximum(d, 0)] + 1, 0) + excl - base
+
+    preorder = np.empty(n, dtype=np.int64)
+    preorder[tin] = np.arange(n)
+    return {'preorder': preorder, 'tin': tin, 'size': size}
+
+
+def upstream_rows(upidx, rows):
+    """
+    Rows upstream of rows (rows included)
+
+    Args:
+        upidx (dict) :: see .make_upstream_index (or a topology with
+                        'upstream', see .upstream_index)
+        rows (int or np.array) :: row(s) of the outlets
+
+    Returns:
+        rows_up (np.array) :: upstream rows, in preorder (unique)
+    """
+    if 'preorder' not in upidx:
+        upidx = upstream_index(upidx)
+    tin, size = upidx['tin'], upidx['size']
+    rows = np.atleast_1d(rows)
+    if not len(rows):
+        return np.zeros(0, dtype=np.int64)
+
+    # nested outlets: keep only the outer intervals
+    a = np.sort(tin[rows])
+    b = a + size[upidx['preorder'][a]]
+    keep = np.r_[True, b[1:] > np.maximum.accumulate(b)[:-1]]
+    a, b = a[keep], b[keep]
+    if len(a) == 1:
+        return upidx['preorder'][a[0]:b[0]]
+    return np.concatenate([upidx['preorder'][i:j] for i, j in zip(a, b)])
+
+
+def upstream_index(topo):
+    """ Upstream index of a topology (computed once, kept in topo['upstream']) """
+    if 'upstream' not in topo:
+        topo['upstream'] = make_upstream_index(topo)
+    return topo['upstream']
@@ -28,6 +28,7 @@ import geopandas as gpd
 # downscaling functions
 import funcs_io
 import funcs_op
+import funcs_instrument
 
 # ignore warnings
 warnings.filterwarnings('ignore')
@@ -37,6 +38,8 @@ print("--------------------------------------------------------------------")
 print(" Initial Step of the MGB-BHO Downscaling - Get Domain Intersection  ")
 print("--------------------------------------------------------------------")
 
+funcs_instrument.start_profile('0_prepro')
+
 
 #-----------------------------------------------------------------------------
 # INPUT PATHS AND FILES
@@ -109,3 +112,4 @@ print(" Make intersection table (adjusted for table 1 processing)... ")
 df_bho_inter = funcs_op.make_tble_t0(df_tble_mini, df_tble_bho, FILE_BHO_INTER)
 
 print(" Done... ")
+funcs_instrument.dump_profile('profile_0_prepro')
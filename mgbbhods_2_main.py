@@ -40,6 +40,7 @@ import geopandas as gpd
 import funcs_utils
 import funcs_io
 import funcs_op
+import funcs_instrument
 
 
 
@@ -55,6 +56,8 @@ print("---------------------------------------------------")
 
 # timer
 start = time.time()
+funcs_instrument.start_profile('2_main')
+funcs_instrument.set_progress(interval = 2., quiet = False)  # progress of loops (quiet -> no messages)
 
 
 '''
@@ -337,5 +340,6 @@ if flag_plot & flag_drop_geom:
 
 end = time.time()
 print("\n Done in {} seconds".format(round(end-start,2)))
+funcs_instrument.dump_profile('profile_2_main')
 
 
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the MGB-BHO Downscaling over synthetic datasets (see funcs_bench)
+
+Save:
+ - bench_<commit>_<date>.json :: time and memory of each stage, size and nt
+ - bench_scaling.xlsx :: wall time by size and scaling exponent of stages
+
+Compare with a previous run (e.g. before a change) with FILE_REF
+
+@author: Mino Sorribas
+
+"""
+
+import os
+os.environ['USE_PYGEOS'] = '0'
+# standard python
+import time
+import warnings
+
+# downscaling functions
+import funcs_bench
+
+# ignore warnings
+warnings.filterwarnings('ignore')
+
+
+#-----------------------------------------------------------------------------
+# SETTINGS
+#-----------------------------------------------------------------------------
+PATH_DATA = '../bench_data/'       # synthetic datasets (generated once)
+PATH_OUT = './'
+
+sizes = funcs_bench.BENCH_SIZES      # reaches, e.g. [10000, 100000, 500000]
+list_nt = [365, 5*365]               # days of the binaries
+stages = funcs_bench.BENCH_STAGES    # stages to record
+n_solver = 2000                      # sample of cotrechos of the solver loop
+trace_memory = True                  # tracemalloc (slower python loops)
+
+# previous run to compare (None -> no comparison)
+FILE_REF = None
+#FILE_REF = 'bench_ab12cd3_20240101_120000.json'
+
+
+
+print("---------------------------------------------------")
+print(" Benchmarks of the MGB-BHO Downscaling             ")
+print("---------------------------------------------------")
+
+start = time.time()
+
+bench = funcs_bench.run_benchmarks(PATH_DATA,
+                                   sizes = sizes,
+                                   list_nt = list_nt,
+                                   stages = stages,
+                                   n_solver = n_solver,
+                                   trace_memory = trace_memory)
+
+fileout = funcs_bench.bench_filename(bench, PATH_OUT)
+funcs_bench.dump_bench(bench, fileout)
+print(" Saved {}".format(fileout))
+
+df_scaling = funcs_bench.scaling_table(bench)
+print(df_scaling.to_string())
+df_scaling.to_excel(os.path.join(PATH_OUT, 'bench_scaling.xlsx'))
+
+if FILE_REF:
+    df_cmp = funcs_bench.compare_bench(bench, funcs_bench.read_bench(FILE_REF))
+    print(df_cmp.to_string(index=False))
+    print(" {} regressions of {}".format(df_cmp['regression'].sum(), len(df_cmp)))
+
+
+end = time.time()
+print("\n Done in {} seconds".format(round(end-start,2)))
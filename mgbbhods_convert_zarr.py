@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Convert MGB binaries (QTUDO/QITUDO) to chunked compressed containers (Zarr)
+
+Save in PATH_INPUT:
+ - <QTUDO>.zarr  :: discharge (nt x nc), chunks of days x minis
+ - <QITUDO>.zarr :: local runoff (nt x nc), chunks of days x minis
+
+The solver scripts read them with fmt_binary = 'zarr'
+
+@author: Mino Sorribas
+
+"""
+
+# standard python
+import os
+import time
+
+# downscaling
+import funcs_solver
+import funcs_store
+import funcs_instrument
+
+
+print("---------------------------------------------------")
+print(" Convert MGB binaries to Zarr                      ")
+print("---------------------------------------------------")
+
+start=time.time()
+funcs_instrument.start_profile('convert_zarr')
+
+
+#-----------------------------------------------------------------------------
+# Main path and mgb-sa setup
+#-----------------------------------------------------------------------------
+PATH_MAIN = '../'
+PATH_INPUT = PATH_MAIN + 'input/'
+
+list_versions = ['1979']
+#list_versions = ['1979', '1990', 'enkf_1979', 'enkf_1979_m48', 'enkf_1979_m02']
+
+# chunks (days x minis) and zstd level
+chunks = (365, 512)
+clevel = 5
+
+
+#-----------------------------------------------------------------------------
+# Convert binaries
+#-----------------------------------------------------------------------------
+for version in list_versions:
+    nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version, PATH_INPUT)
+
+    for file_mgb in (file_qtudo, file_qcel):
+        filebin = PATH_INPUT + file_mgb
+        if not os.path.isfile(filebin):
+            print(" - missing {} (skip)".format(filebin))
+            continue
+
+        fileout = funcs_store.zarr_path(filebin)
+        funcs_store.dump_mgb_to_zarr(filebin, fileout, nc, nt, chunks, clevel)
+
+        # compression ratio
+        size_bin = os.path.getsize(filebin)
+        size_zarr = sum(os.path.getsize(os.path.join(r, f))
+                        for r, _, fs in os.walk(fileout) for f in fs)
+        print(" - {} -> {} ({:.1f}x)".format(file_mgb, os.path.basename(fileout),
+                                             size_bin/max(size_zarr, 1)))
+
+
+finish=time.time()
+print(" Elapsed time {:.1f} s".format(finish-start))
+funcs_instrument.dump_profile('profile_convert_zarr')
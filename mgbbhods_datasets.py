@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of MGB runs in the input directory
+
+ - writes sidecars '<name>.mgbrun.json' for the legacy MGB-SA versions
+   (funcs_solver.dict_mgbsa_versions) whose binaries are available
+ - lists and validates every run found in PATH_INPUT
+
+New runs (scenarios, ensemble members...) only need a sidecar,
+see funcs_datasets, and are selected by name in the solver scripts
+    version = '<name>'
+
+@author: Mino Sorribas
+
+"""
+
+# standard python
+import os
+import time
+
+# downscaling
+import funcs_solver
+import funcs_datasets
+import funcs_instrument
+
+
+print("---------------------------------------------------")
+print(" Registry of MGB runs                              ")
+print("---------------------------------------------------")
+
+start=time.time()
+funcs_instrument.start_profile('datasets')
+
+
+#-----------------------------------------------------------------------------
+# Main path
+#-----------------------------------------------------------------------------
+PATH_MAIN = '../'
+PATH_INPUT = PATH_MAIN + 'input/'
+
+# store checksum of binaries in new sidecars (slow for large binaries)
+flag_checksum = False
+
+# check stored checksums while validating
+flag_check_checksum = False
+
+
+#-----------------------------------------------------------------------------
+# Sidecars for legacy versions
+#-----------------------------------------------------------------------------
+for version, settings in funcs_solver.dict_mgbsa_versions.items():
+    nt, nc, dstart, file_qtudo, file_qcel = settings
+
+    if os.path.isfile(funcs_datasets.sidecar_path(PATH_INPUT, version)):
+        continue
+
+    files = {'qtudo': file_qtudo, 'qcel': file_qcel}
+    files = {k: v for k, v in files.items() if os.path.isfile(PATH_INPUT + v)}
+    if not files:
+        continue
+
+    # ensemble member from name of the run
+    member = None
+    if version.startswith('enkf'):
+        member = int(''.join(filter(str.isdigit, file_qtudo)))
+
+    funcs_datasets.write_sidecar(PATH_INPUT, version, nt, nc, dstart, files,
+                                 member=member, checksum=flag_checksum)
+    print(" - new sidecar {}".format(version))
+
+
+#-----------------------------------------------------------------------------
+# List and validate runs
+#-----------------------------------------------------------------------------
+registry = funcs_datasets.discover_datasets(PATH_INPUT)
+
+for name, meta in registry.items():
+    try:
+        funcs_datasets.validate_dataset(meta, check_checksum=flag_check_checksum)
+        status = 'ok'
+    except (FileNotFoundError, ValueError) as e:
+        status = str(e)
+    print(" {:<16} nt={:<6} nc={:<6} {} member={} vars={} -> {}".format(
+        name, meta['nt'], meta['nc'], meta['dstart'].date(), meta['member'],
+        ','.join(meta['variables']), status))
+
+
+finish=time.time()
+print(" Elapsed time {:.1f} s".format(finish-start))
+funcs_instrument.dump_profile('profile_datasets')
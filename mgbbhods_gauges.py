@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Gauges (postos) snapped to BHO reaches (see funcs_gauges)
+
+Save:
+ - dict_posto_cotrecho.pickle :: {posto: cotrecho} (e.g. mgbbhods_solver_timeseries.py)
+ - dict_cotrecho_posto.pickle :: {cotrecho: [postos]} (e.g. version_00_gauges.py)
+ - gauges_snap.xlsx :: ranked candidate reaches of each gauge
+ - snap_index_bho.npz :: snap index of the BHO (reused while the BHO file is unchanged)
+
+@author: Mino Sorribas
+
+"""
+
+import os
+os.environ['USE_PYGEOS'] = '0'
+# standard python
+import time
+import pickle
+
+# dataframes
+import pandas as pd
+
+# downscaling functions
+import funcs_gauges
+import funcs_instrument
+
+
+
+#-----------------------------------------------------------------------------
+# SETTINGS
+#-----------------------------------------------------------------------------
+PATH_MAIN = '../'
+PATH_INPUT = PATH_MAIN + 'input/'
+
+FILE_GDF_BHO = PATH_INPUT + 'geoft_bho_2017_5k_trecho_drenagem.gpkg'
+FILE_SNAP_INDEX = './snap_index_bho.npz'
+
+# gauges table and its columns (posto, lon, lat and drainage area [km2])
+FILE_GAUGES = PATH_INPUT + 'postos_fluviometricos.xlsx'
+dict_gauges_cols = {'Codigo': 'posto', 'Longitude': 'lon', 'Latitude': 'lat',
+                    'AreaDrenagem': 'area'}
+
+max_dist = funcs_gauges.SNAP_MAX_DIST     # search distance [degrees]
+k = funcs_gauges.SNAP_K                   # candidates kept by gauge
+area_tol = funcs_gauges.SNAP_AREA_TOL     # maximum difference of area [%]
+
+
+
+print("---------------------------------------------------")
+print(" Gauges snapped to BHO reaches                     ")
+print("---------------------------------------------------")
+
+start = time.time()
+funcs_instrument.start_profile('gauges')
+
+df_gauges = pd.read_excel(FILE_GAUGES)
+df_gauges = df_gauges.rename(columns=dict_gauges_cols)[list(dict_gauges_cols.values())]
+print(" {} gauges".format(len(df_gauges)))
+
+with funcs_instrument.span('snap_index'):
+    index = funcs_gauges.snap_index_from_file(FILE_GDF_BHO, filecache=FILE_SNAP_INDEX)
+
+with funcs_instrument.span('snap_points', items=len(df_gauges)):
+    df_snap = funcs_gauges.snap_points(index, df_gauges, max_dist=max_dist, k=k)
+
+dict_posto_cotrecho, dict_cotrecho_posto = funcs_gauges.gauge_mapping(df_snap, area_tol,
+                                                                      max_dist)
+print(" {} of {} gauges mapped".format(len(dict_posto_cotrecho), len(df_gauges)))
+
+df_snap.to_excel('gauges_snap.xlsx', index=False)
+with open('dict_posto_cotrecho.pickle', 'wb') as f:
+    pickle.dump(dict_posto_cotrecho, f)
+with open('dict_cotrecho_posto.pickle', 'wb') as f:
+    pickle.dump(dict_cotrecho_posto, f)
+
+
+end = time.time()
+print("\n Done in {} seconds".format(round(end-start,2)))
+funcs_instrument.dump_profile('profile_gauges')
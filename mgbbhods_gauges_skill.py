@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Skill of the MGB-BHO Downscaling at gauges (see funcs_skill)
+
+  - downscaled daily series of all gauged reaches in one batched call
+  - NSE, KGE, bias and errors of Q95/QMLT against observed discharge
+
+Save:
+ - skill_gauges_<version>.xlsx :: metrics of each gauge
+ - skill_versions.csv :: one line by run (medians over gauges), to track
+                         versions of the model
+
+Requires dict_posto_cotrecho.pickle (see mgbbhods_gauges.py)
+
+@author: Mino Sorribas
+
+"""
+
+import os
+os.environ['USE_PYGEOS'] = '0'
+# standard python
+import time
+import pickle
+
+# downscaling
+import funcs_io
+import funcs_solver
+import funcs_store
+import funcs_engine
+import funcs_skill
+import funcs_bench
+import funcs_instrument
+
+
+
+#-----------------------------------------------------------------------------
+# SETTINGS
+#-----------------------------------------------------------------------------
+PATH_MAIN = '../'
+PATH_INPUT = PATH_MAIN + 'input/'
+
+# observed daily discharge: directory with '<posto>.csv' or a single table
+PATH_OBSERVED = PATH_INPUT + 'observed/'
+
+FILE_POSTO_COTRECHO = 'dict_posto_cotrecho.pickle'
+FILE_VERSIONS = 'skill_versions.csv'
+
+version = '1979'
+ihotstart = 365             # hotstart
+fmt_binary = 'mgb'          # 'mgb' (raw) or 'zarr'
+min_days = funcs_skill.SKILL_MIN_DAYS
+
+block_size = None           # reaches by call of the engine (None -> all at once)
+nthreads = 1                # threads over blocks
+
+
+
+print("---------------------------------------------------")
+print(" Skill of the MGB-BHO Downscaling at gauges        ")
+print("---------------------------------------------------")
+
+start = time.time()
+funcs_instrument.start_profile('gauges_skill')
+
+
+#-----------------------------------------------------------------------------
+# Inputs
+#-----------------------------------------------------------------------------
+nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version, PATH_INPUT)
+list_t = list(range(nt))[ihotstart:]
+
+dict_var_mmap = {
+    funcs_engine.VAR_QTUDO: funcs_store.open_mgb(PATH_INPUT + file_qtudo, nc, nt, fmt_binary),
+    funcs_engine.VAR_QCEL: funcs_store.open_mgb(PATH_INPUT + file_qcel, nc, nt, fmt_binary),
+    }
+
+the_dicts = funcs_io.read_the_dicts()
+dict_bho_solver = the_dicts['dict_bho_solver']
+dict_type_params = {1: the_dicts['dict_parameters_t1'],
+                    2: the_dicts['dict_parameters_t2'],
+                    3: the_dicts['dict_parameters_t3'],
+                    4: the_dicts['dict_parameters_t4']}
+
+with open(FILE_POSTO_COTRECHO, 'rb') as f:
+    dict_posto_cotrecho = pickle.load(f)
+
+df_obs = funcs_skill.read_observed(PATH_OBSERVED)
+print(" {} observed series, {} gauges mapped".format(df_obs.shape[1], len(dict_posto_cotrecho)))
+
+
+#-----------------------------------------------------------------------------
+# Downscaled series of gauged reaches and metrics
+#-----------------------------------------------------------------------------
+list_gauged = sorted({dict_posto_cotrecho[p] for p in df_obs.columns if p in dict_posto_cotrecho})
+op = funcs_engine.make_downscaling_operator(dict_bho_solver, dict_type_params, list_gauged)
+
+with funcs_instrument.span('downscale_gauges', items=len(op['cotrecho'])):
+    sim, dates = funcs_skill.downscale_gauges(op, dict_var_mmap, list_t, dstart,
+                                              block_size = block_size,
+                                              nthreads = nthreads)
+
+with funcs_instrument.span('skill_table'):
+    df_skill = funcs_skill.skill_table(df_obs, sim, dates, dict_posto_cotrecho, op, min_days)
+
+df_skill.to_excel('skill_gauges_{}.xlsx'.format(version), index=False)
+
+commit, dirty = funcs_bench.git_commit()
+df_line = funcs_skill.version_summary(df_skill, version, commit=commit, dirty=dirty)
+print(df_line.T.to_string(header=False))
+funcs_skill.append_summary(FILE_VERSIONS, df_line)
+
+
+end = time.time()
+print("\n Done in {} seconds".format(round(end-start,2)))
+funcs_instrument.dump_profile('profile_gauges_skill')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-processing of the MGB-BHO Downscaling as a cached pipeline
+    same steps of mgbbhods_0_prepro.py, mgbbhods_1_matlab.py
+    and mgbbhods_2_main.py, without intermediate files in ./
+
+Stages are cached in PATH_CACHE (see funcs_pipeline), so changing one
+parameter only recomputes the stages that depend on it, e.g.
+    area_threshold_t12 -> validate, t4, solver
+    dmax               -> t1_table, t1, t2, validate, t4, solver
+
+Save the dictionaries of funcs_io.dump_the_dicts
+
+@author: Mino Sorribas
+
+"""
+
+# standard python
+import time
+import warnings
+
+# downscaling functions
+import funcs_pipeline
+import funcs_instrument
+
+# ignore warnings
+warnings.filterwarnings('ignore')
+
+
+print("---------------------------------------------------")
+print(" Pipeline Pre-processing for the MGB-BHO Downscaling ")
+print("---------------------------------------------------")
+
+start = time.time()
+funcs_instrument.start_profile('pipeline')
+funcs_instrument.set_progress(interval = 2., quiet = False)  # progress of loops (quiet -> no messages)
+
+
+#-----------------------------------------------------------------------------
+# INPUT PATHS AND FILES
+#-----------------------------------------------------------------------------
+PATH_MAIN = '../'
+PATH_INPUT = PATH_MAIN + 'input/'
+PATH_CACHE = './cache_prepro/'
+
+files = {
+    # table mgb topology
+    'file_mini': PATH_INPUT + 'mini.xlsx',
+    # geopackage BHO drainage
+    'file_gdf_bho': PATH_INPUT + 'geoft_bho_2017_5k_trecho_drenagem.gpkg',
+    # shapefile MGB
+    'file_mgb_catchments_shp': PATH_INPUT + 'mgb_sa_unit_catchments_sirgas2000.shp',
+    }
+
+
+#-----------------------------------------------------------------------------
+# PARAMETERS
+#-----------------------------------------------------------------------------
+params = {
+    # area threshold of main river in table type 1 (matlab step)
+    'area_threshold_t1': 800.,
+    # area to check reaches in mini downstream (matlab step)
+    'area_limite_minijus': 10000.,
+    # maximum search distance (matlab step)
+    'dmax': 0.5,
+    # tolerance table of type 1 (None -> funcs_io.TBLE_AREA_TOL_T1)
+    'tble_tol': None,
+    # area threshold for targeting bho drainage as type 1 and 2
+    'area_threshold_t12': 1000.,
+    }
+
+
+#-----------------------------------------------------------------------------
+# RUN PIPELINE
+#-----------------------------------------------------------------------------
+stages = funcs_pipeline.make_stages_mgbbho()
+results, status = funcs_pipeline.run_pipeline(stages, files, params, PATH_CACHE,
+                                              targets = funcs_pipeline.TARGETS_DICTS)
+
+print(" Type 4 lost: {}".format(len(results['t4']['lost_t4'])))
+
+
+#-----------------------------------------------------------------------------
+# SAVE PARAMETERS
+#-----------------------------------------------------------------------------
+print(" Dumping dictionaries to disk... ")
+_ = funcs_pipeline.dump_pipeline_dicts(results)
+
+
+end = time.time()
+print("\n Done in {} seconds".format(round(end-start,2)))
+funcs_instrument.dump_profile('profile_pipeline')
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP service of reference discharges (see funcs_service)
+
+  - the store (.npy arrays) is made once from the results of a solver
+    (e.g. base_mgbbhods_flows_1979_accum.gpkg), then opened with mmap
+  - JSON answers by cotrecho, list of cotrechos, cobacia prefix or point
+
+    http://localhost:8050/cotrecho/<cotrecho>
+    http://localhost:8050/cotrechos?ids=<c1>,<c2>,...
+    http://localhost:8050/cobacia/<prefix>?limit=<n>
+    http://localhost:8050/point?lat=<lat>&lon=<lon>&max_dist=<deg>
+
+Load test with mgbbhods_service_loadtest.py
+
+@author: Mino Sorribas
+
+"""
+
+import os
+os.environ['USE_PYGEOS'] = '0'
+# standard python
+import time
+
+# dataframes and spatial
+import geopandas as gpd
+
+# downscaling
+import funcs_service
+import funcs_instrument
+
+
+
+#-----------------------------------------------------------------------------
+# SETTINGS
+#-----------------------------------------------------------------------------
+FILE_RESULTS = './base_mgbbhods_flows_1979_accum.gpkg'   # results with geometry
+PATH_STORE = './service_store/'
+rebuild = False                # True to remake the store from FILE_RESULTS
+
+HOST = 'localhost'
+PORT = 8050
+
+
+
+print("---------------------------------------------------")
+print(" MGB-BHO Downscaling - Query Service               ")
+print("---------------------------------------------------")
+
+start = time.time()
+funcs_instrument.start_profile('service')
+
+if rebuild or not os.path.isfile(os.path.join(PATH_STORE, 'meta.json')):
+    print(" Making store from {}... ".format(FILE_RESULTS))
+    gdf_results = gpd.read_file(FILE_RESULTS)
+    meta = funcs_service.make_service_store(gdf_results, PATH_STORE)
+    del gdf_results
+    print(" - {} reaches, columns {}".format(meta['n'], meta['columns']))
+
+store = funcs_service.read_service_store(PATH_STORE)
+print(" Store loaded in {:.1f} s ({} reaches)".format(time.time()-start, store['meta']['n']))
+
+server = funcs_service.make_server(store, HOST, PORT)
+print(" Serving at http://{}:{}/ (Ctrl+C to stop)".format(HOST, PORT))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
+    print(" Stopped.")
+    funcs_instrument.dump_profile('profile_service')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Load test of the query service (see funcs_service, mgbbhods_service.py)
+
+Save:
+ - service_latency.xlsx :: summary (percentiles by kind of query) and
+                           histograms of latency, via HTTP and in process
+
+With START_LOCAL the server runs in a thread of this process (client and
+server share the GIL, so latencies are higher than with a separate server)
+
+@author: Mino Sorribas
+
+"""
+
+import os
+os.environ['USE_PYGEOS'] = '0'
+# standard python
+import time
+
+# dataframes
+import pandas as pd
+
+# downscaling
+import funcs_service
+import funcs_instrument
+
+
+
+#-----------------------------------------------------------------------------
+# SETTINGS
+#-----------------------------------------------------------------------------
+PATH_STORE = './service_store/'
+HOST = 'localhost'
+PORT = 8050
+START_LOCAL = True             # False -> server already running (mgbbhods_service.py)
+
+n_queries = 20000
+nthreads = 4                   # concurrent clients
+mix = {'cotrecho': 0.5, 'cotrechos': 0.1, 'cobacia': 0.1, 'point': 0.3}
+
+FILE_OUT = 'service_latency.xlsx'
+
+
+
+print("---------------------------------------------------")
+print(" Load test of the query service                    ")
+print("---------------------------------------------------")
+
+start = time.time()
+funcs_instrument.start_profile('service_loadtest')
+
+store = funcs_service.read_service_store(PATH_STORE)
+queries = funcs_service.make_queries(store, n_queries, mix)
+
+# queries in process (no HTTP)
+with funcs_instrument.span('direct', items=n_queries):
+    df_direct = funcs_service.direct_latency(store, queries)
+
+# queries via HTTP
+server = funcs_service.start_server_thread(store, HOST, PORT) if START_LOCAL else None
+with funcs_instrument.span('http', items=n_queries):
+    df_http, wall = funcs_service.load_test(queries, HOST, PORT, nthreads)
+if server is not None:
+    server.shutdown()
+    server.server_close()
+
+nfail = (df_http['status'] != 200).sum()
+print(" {} requests in {:.1f} s, {} not 200".format(len(df_http), wall, nfail))
+
+df_sum_http = funcs_service.latency_summary(df_http, wall)
+df_sum_direct = funcs_service.latency_summary(df_direct)
+df_hist_http = funcs_service.latency_histogram(df_http)
+df_hist_direct = funcs_service.latency_histogram(df_direct)
+
+print("\n Latency via HTTP [ms]")
+print(df_sum_http.round(3).to_string())
+funcs_service.print_histogram(df_hist_http)
+print("\n Latency in process [ms]")
+print(df_sum_direct.round(3).to_string())
+funcs_service.print_histogram(df_hist_direct)
+
+with pd.ExcelWriter(FILE_OUT) as writer:
+    df_sum_http.to_excel(writer, sheet_name='summary_http')
+    df_sum_direct.to_excel(writer, sheet_name='summary_direct')
+    df_hist_http.to_excel(writer, sheet_name='hist_http', index=False)
+    df_hist_direct.to_excel(writer, sheet_name='hist_direct', index=False)
+
+
+end = time.time()
+print("\n Done in {} seconds".format(round(end-start,2)))
+funcs_instrument.dump_profile('profile_service_loadtest')
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Downscaling of MGB results into BHO drainage by network accumulation
+    (solver type 5, see funcs_engine.make_network)
+
+  - local runoff (QITUDO) of each mini is distributed to its reaches by nuareacont
+  - flow is accumulated downstream along the BHO topology (nutrjus)
+  - the balance is closed at type 1 reaches with the discharge of MGB (QTUDO)
+
+Flows along headwater chains are mass-consistent with their tributaries,
+unlike types 3 and 4 (single mini scaled by nuareamont)
+
+@author: Mino Sorribas
+
+"""
+
+import os
+os.environ['USE_PYGEOS'] = '0'
+# standard python
+import time
+
+# numpy, dataframes and spatial
+import numpy as np
+import geopandas as gpd
+
+# downscaling
+import funcs_io
+import funcs_solver
+import funcs_gpkg
+import funcs_store
+import funcs_engine
+import funcs_instrument
+
+
+
+
+print("---------------------------------------------------")
+print(" Running MGB-BHO Downscaling (network accumulation) ")
+print("---------------------------------------------------")
+
+start=time.time()
+funcs_instrument.start_profile('solver_accum')
+
+
+
+#-----------------------------------------------------------------------------
+# Main path and general input files
+#-----------------------------------------------------------------------------
+PATH_MAIN = '../'
+PATH_INPUT = PATH_MAIN + 'input/'
+
+FILE_GDF_BHO = PATH_INPUT + 'geoft_bho_2017_5k_trecho_drenagem.gpkg'
+
+
+
+#-----------------------------------------------------------------------------
+# Get mgb-sa setup
+#-----------------------------------------------------------------------------
+version = '1979'
+nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version, PATH_INPUT)
+
+# list of time intervals
+ihotstart = 365             #hotstart
+list_t = list(range(nt))[ihotstart:]
+
+# format of MGB binaries: 'mgb' (raw) or 'zarr' (see mgbbhods_convert_zarr.py)
+fmt_binary = 'mgb'
+
+# chunks of time and blocks of reaches (memory ~ chunk_size x col_block)
+# (chunk_size None -> whole record at once, exact quantiles)
+chunk_size = 365
+col_block = 20000
+
+
+
+#-----------------------------------------------------------------------------
+# Read the Downscaling dicts and BHO
+#-----------------------------------------------------------------------------
+the_dicts = funcs_io.read_the_dicts()
+dict_bho_solver = the_dicts['dict_bho_solver']
+dict_bho_mini_t1 = the_dicts['dict_bho_mini_t1_post']
+dict_bho_mini_t2 = the_dicts['dict_bho_mini_t2_post']
+dict_bho_mini_t3 = the_dicts['dict_bho_mini_t3_post']
+
+# mini of every reach in the domain (type 4 keeps the mini of background)
+dict_bho_mini = {k: v['mini'][0] for k, v in the_dicts['dict_parameters_t4'].items() if 'mini' in v}
+dict_bho_mini.update(dict_bho_mini_t3)
+dict_bho_mini.update(dict_bho_mini_t2)
+dict_bho_mini.update(dict_bho_mini_t1)
+
+gdf_tble_bho = gpd.read_file(FILE_GDF_BHO)
+
+
+
+#-----------------------------------------------------------------------------
+# Network accumulation
+#-----------------------------------------------------------------------------
+print(" Building network... ")
+net = funcs_engine.make_network(gdf_tble_bho, dict_bho_mini, dict_bho_mini_t1)
+print(" - {} reaches, {} levels".format(len(net['cotrecho']), net['level'].max() + 1))
+
+mmap_qtudo = funcs_store.open_mgb(PATH_INPUT + file_qtudo, nc, nt, fmt_binary)
+mmap_qcel = funcs_store.open_mgb(PATH_INPUT + file_qcel, nc, nt, fmt_binary)
+
+print(" Accumulating local runoff... ")
+results = funcs_engine.network_stats(net, mmap_qcel, mmap_qtudo, list_t, ['qmlt','q95'],
+                                     chunk_size = chunk_size,
+                                     col_block = col_block)
+
+# dicts for results (m3/s)
+cotrechos = net['cotrecho'].tolist()
+D_Q95 = dict(zip(cotrechos, np.round(results['q95'],6)))
+D_QMLT = dict(zip(cotrechos, np.round(results['qmlt'],6)))
+
+#specific discharge (m3/s.km2)
+D_Q95e = dict(zip(cotrechos, np.round(results['q95']/net['nuareamont'],12)))
+D_QMLTe = dict(zip(cotrechos, np.round(results['qmlt']/net['nuareamont'],12)))
+
+# balance at type 1: accumulated minus MGB discharge (mean, m3/s)
+ok = np.isfinite(results['resid_mlt'])
+D_RESID_T1 = dict(zip(net['cotrecho'][ok].tolist(), np.round(results['resid_mlt'][ok],6)))
+
+# solver tags: values of every reach of the network but type 1 (MGB
+# discharge, direct transfer) come from the accumulation
+set_accum = set(cotrechos)
+dict_bho_solver_accum = {k: (funcs_engine.TIPO_ACCUM if (k in set_accum and v != 1) else v)
+                         for k, v in dict_bho_solver.items()}
+
+
+
+#--------------------------------------------------------------------------
+# Export downscaled values and solver as gpkg
+#--------------------------------------------------------------------------
+label = ('D_Q95','D_QMLT','D_Q95e','D_QMLTe','resid_t1',
+         'mini_t1','mini_t2','mini_t3','solver')
+kvs = (D_Q95,D_QMLT,D_Q95e,D_QMLTe,D_RESID_T1,
+       dict_bho_mini_t1,dict_bho_mini_t2,dict_bho_mini_t3,dict_bho_solver_accum)
+D = dict(zip(label,kvs))
+
+G = funcs_gpkg.f_dicts_to_bho_gpkg(gdf_tble_bho, D, suffix='flows_{}_accum'.format(version))
+
+del gdf_tble_bho
+
+
+finish=time.time()
+print(" Elapsed time {:.1f} s".format(finish-start))
+funcs_instrument.dump_profile('profile_solver_accum')
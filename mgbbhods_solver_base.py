@@ -21,13 +21,16 @@ from datetime import datetime,timedelta
 # plotting, numpy, dataframes and spatial
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 import geopandas as gpd
 
 # downscaling
 import funcs_io
 import funcs_solver
 import funcs_gpkg
+import funcs_store
+import funcs_pipeline
+import funcs_checkpoint
+import funcs_instrument
 
 
 
@@ -37,6 +40,8 @@ print(" Running MGB-BHO Downscaling                       ")
 print("---------------------------------------------------")
 
 start=time.time()
+funcs_instrument.start_profile('solver_base')
+funcs_instrument.set_progress(interval = 2., quiet = False)  # progress of loops (quiet -> no messages)
 
 
 
@@ -59,10 +64,7 @@ FILE_GDF_BHO = PATH_INPUT + 'geoft_bho_2017_5k_trecho_drenagem.gpkg'
 # Get mgb-sa setup
 #-----------------------------------------------------------------------------
 version = '1979'
-nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version)
-
-file_qtudo_npy = file_qtudo.strip('.MGB') + '.npy'
-file_qcel_npy = file_qcel.strip('.MGB') + '.npy'
+nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version, PATH_INPUT)
 
 
 # list of time intervals
@@ -76,19 +78,12 @@ flags_export_ts = [-9999] # disable timeseries to xlsx
 
 
 #-----------------------------------------------------------------------------
-# Dump binaries to numpy
+# Memory-map MGB binaries (raw .MGB in place or chunked .zarr)
 #-----------------------------------------------------------------------------
-flag_build_npy = False
-if flag_build_npy:
-    # build qtudo .npy
-    filebin = PATH_INPUT + file_qtudo
-    fileout = file_qtudo_npy
-    _ = funcs_solver.dump_mgb_binary_to_npy(filebin, fileout, nt, nc)
-
-    # build qcel .npy
-    filebin = PATH_INPUT + file_qcel
-    fileout = file_qcel_npy
-    _ = funcs_solver.dump_mgb_binary_to_npy(filebin, fileout, nt, nc)
+# format of MGB binaries: 'mgb' (raw) or 'zarr' (see mgbbhods_convert_zarr.py)
+fmt_binary = 'mgb'
+mmap_qtudo = funcs_store.open_mgb(PATH_INPUT + file_qtudo, nc, nt, fmt_binary)
+mmap_qcel = funcs_store.open_mgb(PATH_INPUT + file_qcel, nc, nt, fmt_binary)
 
 
 
@@ -158,10 +153,10 @@ dict_tipo_fsolver = {
 
 # pre-mapping arrays
 dict_tipo_mmapfile={
-    1: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
-    2: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
-    3: funcs_solver.read_npy_as_mmap(file_qcel_npy),
-    4: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
+    1: mmap_qtudo,
+    2: mmap_qtudo,
+    3: mmap_qcel,
+    4: mmap_qtudo,
     }
 
 
@@ -182,112 +177,118 @@ if 'list_to_downscale' not in locals():
 # Main loop block for downscaling
 #--------------------------------------------------------------------------
 
-# dicts for results
-D_Q95 = {}
-D_QMLT = {}
-D_Q95_ts = {}
-D_QMLT_ts = {}
-
-
-D_Q95e = {}
-D_QMLTe = {}
-D_Q95e_ts = {}
-D_QMLTe_ts = {}
+# labels of results (dicts of {cotrecho: value})
+labels_results = ('D_Q95','D_QMLT','D_Q95_ts','D_QMLT_ts',
+                  'D_Q95e','D_QMLTe','D_Q95e_ts','D_QMLTe_ts')
 
+# checkpoint of blocks of cotrechos (re-run with --resume skips finished blocks)
+# (inputs: dicts of the pre-processing and identity of binaries)
+config_run = {'script':'solver_base', 'version':version, 'ihotstart':ihotstart,
+              'dicts':funcs_checkpoint.data_hash((dict_bho_solver, dict_type_params)),
+              'binaries':[funcs_pipeline.file_fingerprint(PATH_INPUT + file_qtudo),
+                          funcs_pipeline.file_fingerprint(PATH_INPUT + file_qcel)],
+              'fmt_binary':fmt_binary}
+ckpt = funcs_checkpoint.init_checkpoint('./checkpoint_solver_base/',
+                                        config_run,
+                                        list_to_downscale,
+                                        block_size = 2000,
+                                        resume = funcs_checkpoint.resume_from_argv())
 
 
 # loop downscaling of cotrechos
-conta=0
-hconta = 100./len(list_to_downscale)
+frame = funcs_instrument.begin('solver_loop')
+prog = funcs_instrument.new_progress(len(list_to_downscale), 'downscaling',
+                                     count = len(ckpt['done'])*ckpt['block_size'])
 ttipo=1 #auxiliary
-for c in list_to_downscale:
-
-    # get type of solver
-    tipo = dict_bho_solver.get(c)     #1,2,3 or 4
+for iblock, list_block in funcs_checkpoint.pending_blocks(ckpt):
 
-    #DEBUG:TESTING RESULTS
-    #if tipo!=ttipo:
-    #    continue
+    # dicts for results (block)
+    D_Q95 = {}
+    D_QMLT = {}
+    D_Q95_ts = {}
+    D_QMLT_ts = {}
 
-    # counter
-    conta = conta+1
-    print(" - downscaling {} - {}% ".format(conta,round(conta*hconta,2)))
+    D_Q95e = {}
+    D_QMLTe = {}
+    D_Q95e_ts = {}
+    D_QMLTe_ts = {}
 
+    for c in list_block:
 
-    # get parameters
-    d_params = dict_type_params.get(tipo) ##.get(c)
+        # get type of solver
+        tipo = dict_bho_solver.get(c)     #1,2,3 or 4
 
-    # get downscaling function
-    func = dict_tipo_fsolver.get(tipo)
+        #DEBUG:TESTING RESULTS
+        #if tipo!=ttipo:
+        #    continue
 
-    # data mmap (pre-mapped)
-    mmapfile = dict_tipo_mmapfile.get(tipo)
+        # counter
+        funcs_instrument.update_progress(prog)
 
-    # required mini
-    list_c = dict_bho_ixc.get(c)
 
+        # get parameters
+        d_params = dict_type_params.get(tipo) ##.get(c)
 
-    # calculate stats and downscale
-    # get time series from memmap of binary
-    df_flow = funcs_solver.mmap_to_dataframe(mmapfile, list_t, list_c, dstart)
+        # get downscaling function
+        func = dict_tipo_fsolver.get(tipo)
 
-    # method i - downscale via time-series
-    df_qts = pd.DataFrame(func(c,d_params,df_flow),index = df_flow.index) #ts downscale!
-    q95_ts = df_qts.quantile(0.05).values[0] # calculate stats from ts
-    qmlt_ts = df_qts.mean().values[0]        # calculate stats from ts
+        # data mmap (pre-mapped)
+        mmapfile = dict_tipo_mmapfile.get(tipo)
 
-    #export time-series
-    #if tipo in flags_export_ts:
-    #    file_ts = "./timeseries/mgbbhods_cotrecho_{}.xlsx".format(c)
-    #    print(" - saving {} to xlsx".format(c) )
-    #    df_qts.to_excel(file_ts)
+        # required mini
+        list_c = dict_bho_ixc.get(c)
 
 
-    # method ii - downscale via stats (q95,qmlt)
-    df_q95  = pd.DataFrame(df_flow.quantile(0.05)).transpose()
-    df_qmlt = pd.DataFrame(df_flow.mean()).transpose()
+        # calculate stats and downscale (via time-series and via stats)
+        q95, qmlt, q95_ts, qmlt_ts = funcs_solver.downscale_cotrecho(c, func, d_params,
+                                                                     mmapfile, list_t,
+                                                                     list_c, dstart)
 
-    q95 = func(c, d_params, df_q95)    # downscale stats
-    qmlt = func(c, d_params, df_qmlt)  # downscale stats
 
+        # store results (m3/s)
+        D_Q95[c] = round(q95,6)
+        D_QMLT[c] = round(qmlt,6)
 
-    # annual aggregation from time series
-    df_annual_q95 = df_qts.groupby(df_qts.index.year).quantile(0.05)
-    df_annual_qmlt = df_qts.groupby(df_qts.index.year).mean()
+        D_Q95_ts[c] = round(q95_ts,6)
+        D_QMLT_ts[c] = round(qmlt_ts,6)
 
 
-    # store results (m3/s)
-    D_Q95[c] = round(q95,6)
-    D_QMLT[c] = round(qmlt,6)
 
-    D_Q95_ts[c] = round(q95_ts,6)
-    D_QMLT_ts[c] = round(qmlt_ts,6)
+        #if tipo == 3:
+        #    print(df_qts)
+        #    break
 
 
+        #specific discharge (m3/s.km2)
+        nuareamont = d_params.get(c).get('nuareamont')
+        if isinstance(nuareamont,list):
+            nuareamont = nuareamont[0]
+        D_Q95e[c] = round(q95/nuareamont,12)
+        D_QMLTe[c] = round(qmlt/nuareamont,12)
 
-    #if tipo == 3:
-    #    print(df_qts)
-    #    break
+        D_Q95e_ts[c] = round(q95_ts/nuareamont,12)
+        D_QMLTe_ts[c] = round(qmlt_ts/nuareamont,12)
 
 
-    #specific discharge (m3/s.km2)
-    nuareamont = d_params.get(c).get('nuareamont')
-    if isinstance(nuareamont,list):
-        nuareamont = nuareamont[0]
-    D_Q95e[c] = round(q95/nuareamont,12)
-    D_QMLTe[c] = round(qmlt/nuareamont,12)
+        '''
+        if tipo==ttipo:
+            print(ttipo)
+            print(df_q95.values,q95,type(q95))
+            print(df_qmlt.values,qmlt,type(qmlt))
+            ttipo=ttipo+1
+        '''
 
-    D_Q95e_ts[c] = round(q95_ts/nuareamont,12)
-    D_QMLTe_ts[c] = round(qmlt_ts/nuareamont,12)
+    # save block
+    kvs = (D_Q95,D_QMLT,D_Q95_ts,D_QMLT_ts,D_Q95e,D_QMLTe,D_Q95e_ts,D_QMLTe_ts)
+    funcs_checkpoint.save_block(ckpt, iblock, dict(zip(labels_results,kvs)))
 
+funcs_instrument.close_progress(prog)
+funcs_instrument.end(frame)
 
-    '''
-    if tipo==ttipo:
-        print(ttipo)
-        print(df_q95.values,q95,type(q95))
-        print(df_qmlt.values,qmlt,type(qmlt))
-        ttipo=ttipo+1
-    '''
+# merge results of all blocks
+merged = funcs_checkpoint.merge_blocks(ckpt, expect_all=True)
+D_Q95, D_QMLT, D_Q95_ts, D_QMLT_ts, D_Q95e, D_QMLTe, D_Q95e_ts, D_QMLTe_ts = \
+    [merged.get(label, {}) for label in labels_results]
 
 
 #--------------------------------------------------------------------------
@@ -389,6 +390,8 @@ finish=time.time()
 #TODO: salvar em dataframe ao inves de dicionarios?!
 # ou uma lista com stats em dicionario unico
 
+funcs_instrument.dump_profile('profile_solver_base')
+
 
 
 
@@ -28,6 +28,8 @@ import geopandas as gpd
 import funcs_io
 import funcs_solver
 import funcs_gpkg
+import funcs_store
+import funcs_instrument
 
 
 
@@ -37,6 +39,8 @@ print(" Running MGB-BHO Downscaling                       ")
 print("---------------------------------------------------")
 
 start=time.time()
+funcs_instrument.start_profile('solver_base_enkf')
+funcs_instrument.set_progress(interval = 2., quiet = False)  # progress of loops (quiet -> no messages)
 
 suffix = 'flows_1979'
 suffix = 'flows_enkf_rev'
@@ -71,10 +75,7 @@ version = '1979'
 version = 'enkf_1979'
 version = 'enkf_1979_m48'
 version = 'enkf_1979_m02'
-nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version)
-
-file_qtudo_npy = file_qtudo.strip('.MGB') + '.npy'
-file_qcel_npy = file_qcel.strip('.MGB') + '.npy'
+nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version, PATH_INPUT)
 
 
 # list of time intervals
@@ -89,20 +90,14 @@ flags_export_ts = [-9999] # disable timeseries to xlsx
 
 
 #-----------------------------------------------------------------------------
-# Dump binaries to numpy
+# Memory-map MGB binaries (raw .MGB in place or chunked .zarr)
 #-----------------------------------------------------------------------------
-flag_build_npy = True
-if flag_build_npy:
-    # build qtudo .npy
-    filebin = PATH_INPUT + file_qtudo
-    fileout = file_qtudo_npy
-    _ = funcs_solver.dump_mgb_binary_to_npy(filebin, fileout, nt, nc)
-
-    if not ignore_t3:
-        # build qcel .npy
-        filebin = PATH_INPUT + file_qcel
-        fileout = file_qcel_npy
-        _ = funcs_solver.dump_mgb_binary_to_npy(filebin, fileout, nt, nc)
+# format of MGB binaries: 'mgb' (raw) or 'zarr' (see mgbbhods_convert_zarr.py)
+fmt_binary = 'mgb'
+mmap_qtudo = funcs_store.open_mgb(PATH_INPUT + file_qtudo, nc, nt, fmt_binary)
+mmap_qcel = None
+if not ignore_t3:
+    mmap_qcel = funcs_store.open_mgb(PATH_INPUT + file_qcel, nc, nt, fmt_binary)
 
 
 
@@ -172,10 +167,10 @@ dict_tipo_fsolver = {
 
 # pre-mapping arrays
 dict_tipo_mmapfile={
-    1: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
-    2: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
-    3: funcs_solver.read_npy_as_mmap(file_qcel_npy),
-    4: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
+    1: mmap_qtudo,
+    2: mmap_qtudo,
+    3: mmap_qcel,
+    4: mmap_qtudo,
     }
 
 
@@ -211,8 +206,8 @@ D_QMLTe_ts = {}
 
 
 # loop downscaling of cotrechos
-conta=0
-hconta = 100./len(list_to_downscale)
+frame = funcs_instrument.begin('solver_loop')
+prog = funcs_instrument.new_progress(len(list_to_downscale), 'downscaling')
 ttipo=1 #auxiliary
 for c in list_to_downscale:
 
@@ -226,8 +221,7 @@ for c in list_to_downscale:
         continue
 
     # counter
-    conta = conta+1
-    print(" - downscaling {} - {}% ".format(conta,round(conta*hconta,2)))
+    funcs_instrument.update_progress(prog)
 
 
     # get parameters
@@ -306,6 +300,10 @@ for c in list_to_downscale:
     '''
 
 
+funcs_instrument.close_progress(prog)
+funcs_instrument.end(frame)
+
+
 #--------------------------------------------------------------------------
 # Export downscaled values to pickle
 #--------------------------------------------------------------------------
@@ -405,6 +403,8 @@ finish=time.time()
 #TODO: salvar em dataframe ao inves de dicionarios?!
 # ou uma lista com stats em dicionario unico
 
+funcs_instrument.dump_profile('profile_solver_base_enkf')
+
 
 
 
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 """
 Main script to runs the downscaling of MGB results into BHO drainage
-Calculates QmaxTR=2
+Calculates QmaxTR (annual maxima, vectorized gumbel at funcs_extremes)
+  annual extremes, Q95 and QMLT of types 1, 3 and 4 are scaled from
+  mini-level extremes and stats, and only type 2 (and non-positive
+  factors) requires the downscaled time series
 
 @author: Mino Sorribas
 
@@ -25,6 +28,10 @@ import geopandas as gpd
 import funcs_io
 import funcs_solver
 import funcs_gpkg
+import funcs_store
+import funcs_extremes
+import funcs_engine
+import funcs_instrument
 
 
 
@@ -34,6 +41,8 @@ print(" Running MGB-BHO Downscaling                       ")
 print("---------------------------------------------------")
 
 start=time.time()
+funcs_instrument.start_profile('solver_base_gumbel')
+funcs_instrument.set_progress(interval = 2., quiet = False)  # progress of loops (quiet -> no messages)
 
 suffix = 'flows_1979'
 suffix = 'flows_enkf_rev'
@@ -69,10 +78,7 @@ version = '1979'
 #version = 'enkf_1979'
 #version = 'enkf_1979_m48'
 #version = 'enkf_1979_m02'
-nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version)
-
-file_qtudo_npy = file_qtudo.strip('.MGB') + '.npy'
-file_qcel_npy = file_qcel.strip('.MGB') + '.npy'
+nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version, PATH_INPUT)
 
 
 # list of time intervals
@@ -85,22 +91,23 @@ list_t = list_t[ihotstart:]
 flags_export_ts = [-9999] # disable timeseries to xlsx
 #flags_export_ts = [1,2] # select drainage types 1 and 2 to timeseries xlsx
 
+# return periods (years) and method for annual maximum discharge
+list_tr = [2., 5., 10.]
+method_extremes = 'gumbel'      # 'gumbel', 'gumbel_lmom' or 'gev_lmom'
+
+# return periods (years) for annual minimum discharge
+list_tr_min = [10.]
+
 
 #-----------------------------------------------------------------------------
-# Dump binaries to numpy
+# Memory-map MGB binaries (raw .MGB in place or chunked .zarr)
 #-----------------------------------------------------------------------------
-flag_build_npy = True
-if flag_build_npy:
-    # build qtudo .npy
-    filebin = PATH_INPUT + file_qtudo
-    fileout = file_qtudo_npy
-    _ = funcs_solver.dump_mgb_binary_to_npy(filebin, fileout, nt, nc)
-
-    if not ignore_t3:
-        # build qcel .npy
-        filebin = PATH_INPUT + file_qcel
-        fileout = file_qcel_npy
-        _ = funcs_solver.dump_mgb_binary_to_npy(filebin, fileout, nt, nc)
+# format of MGB binaries: 'mgb' (raw) or 'zarr' (see mgbbhods_convert_zarr.py)
+fmt_binary = 'mgb'
+mmap_qtudo = funcs_store.open_mgb(PATH_INPUT + file_qtudo, nc, nt, fmt_binary)
+mmap_qcel = None
+if not ignore_t3:
+    mmap_qcel = funcs_store.open_mgb(PATH_INPUT + file_qcel, nc, nt, fmt_binary)
 
 
 
@@ -170,10 +177,10 @@ dict_tipo_fsolver = {
 
 # pre-mapping arrays
 dict_tipo_mmapfile={
-    1: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
-    2: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
-    3: funcs_solver.read_npy_as_mmap(file_qcel_npy),
-    4: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
+    1: mmap_qtudo,
+    2: mmap_qtudo,
+    3: mmap_qcel,
+    4: mmap_qtudo,
     }
 
 
@@ -207,29 +214,86 @@ D_Q95e_ts = {}
 D_QMLTe_ts = {}
 
 
-D_QMAX_TR2 = {}
-D_QMAX_TR2_lb = {}
-D_QMAX_TR2_ub = {}
+#--------------------------------------------------------------------------
+# Annual extremes for types 1, 3 and 4 from mini-level annual extremes
+#--------------------------------------------------------------------------
+# mini-level annual maxima/minima (single streaming pass over each binary)
+dict_var_amax = {}
+dict_var_amin = {}
+dict_var_mmapfile = {
+    funcs_engine.VAR_QTUDO: dict_tipo_mmapfile.get(1),
+    funcs_engine.VAR_QCEL: dict_tipo_mmapfile.get(3),
+    }
+for var, mmapfile in dict_var_mmapfile.items():
+    if mmapfile is None:
+        continue
+    years, amax_mini, amin_mini = funcs_engine.make_mini_annual_extremes(mmapfile, list_t, dstart)
+    dict_var_amax[var] = amax_mini
+    dict_var_amin[var] = amin_mini
 
+# scaling of types 1, 3 and 4 (type 2 falls back to time series)
+list_extremes = [c for c in list_to_downscale if not (ignore_t3 and dict_bho_solver.get(c)==3)]
+scaling, list_fallback = funcs_engine.make_scaling_t134(dict_bho_solver,
+                                                         dict_type_params,
+                                                         list_extremes)
+A_QMAX_t134 = funcs_engine.scale_mini_extremes(scaling, dict_var_amax)
+A_QMIN_t134 = funcs_engine.scale_mini_extremes(scaling, dict_var_amin)
 
-# loop downscaling of cotrechos
-conta=0
-hconta = 100./len(list_to_downscale)
-ttipo=1 #auxiliary
-for c in list_to_downscale:
+# annual extremes (years x cotrechos) of the fallback, filled during the loop
+times = [dstart + timedelta(days=i) for i in list_t]
+years, ystart = funcs_extremes.year_bounds(times)
+A_QMAX_fb = np.full((len(years), len(list_fallback)), np.nan)
+A_QMIN_fb = np.full((len(years), len(list_fallback)), np.nan)
+list_amax_fb = []     # cotrechos in columns of A_QMAX_fb
 
-    # get type of solver
-    tipo = dict_bho_solver.get(c)     #1,2,3 or 4
 
-    #DEBUG:TESTING RESULTS
-    #if tipo!=ttipo:
-    #    continue
-    if (ignore_t3 and tipo==3):
+
+#--------------------------------------------------------------------------
+# Q95 and QMLT of types 1, 3 and 4 from mini-level stats (no time series)
+#--------------------------------------------------------------------------
+# stats only at the mini of the scaling (q(f*Q) = f*q(Q) for f>0)
+dict_var_q95 = {}
+dict_var_qmlt = {}
+for var, mmapfile in dict_var_mmapfile.items():
+    cols = np.unique(scaling['mini'][scaling['var'] == var]) - 1
+    if mmapfile is None or not len(cols):
         continue
+    st = funcs_engine.make_mini_stats(mmapfile, list_t, ['qmlt','q95'], cols=cols)
+    dict_var_q95[var] = st['q95'][None,:]
+    dict_var_qmlt[var] = st['qmlt'][None,:]
+
+if dict_var_q95:
+    A_Q95_t134 = funcs_engine.scale_mini_extremes(scaling, dict_var_q95)[0]
+    A_QMLT_t134 = funcs_engine.scale_mini_extremes(scaling, dict_var_qmlt)[0]
+else:
+    A_Q95_t134 = A_QMLT_t134 = np.zeros(0)
+
+for c, tipo, q95, qmlt in zip(scaling['cotrecho'].tolist(), scaling['tipo'].tolist(),
+                              A_Q95_t134, A_QMLT_t134):
+
+    # store results (m3/s), stats and time series are the same for a single mini
+    D_Q95[c] = D_Q95_ts[c] = round(q95,6)
+    D_QMLT[c] = D_QMLT_ts[c] = round(qmlt,6)
+
+    #specific discharge (m3/s.km2)
+    nuareamont = dict_type_params.get(tipo).get(c).get('nuareamont')
+    if isinstance(nuareamont,list):
+        nuareamont = nuareamont[0]
+    D_Q95e[c] = D_Q95e_ts[c] = round(q95/nuareamont,12)
+    D_QMLTe[c] = D_QMLTe_ts[c] = round(qmlt/nuareamont,12)
+
+
+
+# loop downscaling of cotrechos that require time series (fallback)
+frame = funcs_instrument.begin('solver_loop')
+prog = funcs_instrument.new_progress(len(list_fallback), 'downscaling')
+for c in list_fallback:
+
+    # get type of solver
+    tipo = dict_bho_solver.get(c)     #1,2,3 or 4
 
     # counter
-    conta = conta+1
-    print(" - downscaling {} - {}% ".format(conta,round(conta*hconta,2)))
+    funcs_instrument.update_progress(prog)
 
 
     # get parameters
@@ -254,12 +318,6 @@ for c in list_to_downscale:
     q95_ts = df_qts.quantile(0.05).values[0] # calculate stats from ts
     qmlt_ts = df_qts.mean().values[0]        # calculate stats from ts
 
-    #export time-series
-    #if tipo in flags_export_ts:
-    #    file_ts = "./timeseries/mgbbhods_cotrecho_{}.xlsx".format(c)
-    #    print(" - saving {} to xlsx".format(c) )
-    #    df_qts.to_excel(file_ts)
-
 
     # method ii - downscale via stats (q95,qmlt)
     df_q95  = pd.DataFrame(df_flow.quantile(0.05)).transpose()
@@ -269,67 +327,11 @@ for c in list_to_downscale:
     qmlt = func(c, d_params, df_qmlt)  # downscale stats
 
 
-    # annual aggregation from time series
-    df_annual_q95 = df_qts.groupby(df_qts.index.year).quantile(0.05)
-    df_annual_qmlt = df_qts.groupby(df_qts.index.year).mean()
-
-    # gumbel annual max discharge (using downscale from time series)
-    # aula plinio tomaz
-    # yt = - ln(ln(T/(T-1)))
-    # K = (yt-yn)/sn
-    # xt = x_mu + K*x_std = xmu + (yt-yn)/sn * x_std
-    # tabela yn e sn
-    # (yn=0.577,sn=1.2825,n=inf)
-    # (yn=0.5463,sn=1.1285,n=35, 1.11)
-    # K ~(yt-0.546)/1.1285
-    # intervalo confianca
-    # b = sqrt(1+1.3*K + 1.1*K*K)
-    # s.e. = b*x_std/(sqrt(N)) ::  (xt-1.96*s.e. , xt+1.96*se)
-    """
-    def f_gumbel_max(col_ts, gum_tr=2.):
-        #
-        # if apply over df_flow to process over stats:
-        #    df_flow = funcs_solver.mmap_to_dataframe(mmapfile, list_t, list_c, dstart)
-        #    df_qtr2 = df_flow.apply(f_gumbel_max,axis=0).to_frame().transpose()
-        #    qtr2 = func(c,d_params,df_qtr2)
-        #
-        annual_qmax = col_ts.groupby(col_ts.index.year).max()
-        gum_n = len(annual_qmax)
-        gum_mu = annual_qmax.mean()
-        gum_std =annual_qmax.std(ddof=1)
-        #gum_tr = 1.5
-        gum_yt = -np.log(np.log(gum_tr/(gum_tr-1.)))
-        gum_k = (gum_yt-0.546)/1.1285
-        #gum_k = (gum_yt-0.577)/1.2825 #n->inf
-        gum_se = np.sqrt(1+1.3*gum_k + 1.1*(gum_k**2))*gum_std/np.sqrt(gum_n)
-        qmaxtr = gum_mu + gum_std*gum_k
-        qmaxtr_lb = qmaxtr - 1.96*gum_se
-        qmaxtr_ub = qmaxtr + 1.96*gum_se
-        return qmaxtr
-        ##return qmaxtr,qmaxtr_lb,qmaxtr_ub
-    """
-
-    def gumbel_max(df_qts, gum_tr=2.):
-        '''
-        if apply over df_qts to process over downscaled time-series:
-        df_qts = pd.DataFrame(func(c,d_params,df_flow),index = df_flow.index)
-        qmax_tr2,qmax_tr2_lb, qmax_tr2_ub  = gumbel_max(df_qts,2.)
-        '''
-        df_annual_qmax = df_qts.groupby(df_qts.index.year).max()
-        gum_n = len(df_annual_qmax)
-        gum_mu = df_annual_qmax.mean().values[0]
-        gum_std = df_annual_qmax.std(ddof=1).values[0]
-        #gum_tr = 1.5
-        gum_yt = -np.log(np.log(gum_tr/(gum_tr-1.)))
-        gum_k = (gum_yt-0.546)/1.1285
-        #gum_k = (gum_yt-0.577)/1.2825 #n->inf
-        gum_se = np.sqrt(1+1.3*gum_k + 1.1*(gum_k**2))*gum_std/np.sqrt(gum_n)
-        qmaxtr = gum_mu + gum_std*gum_k
-        qmaxtr_lb = qmaxtr - 1.96*gum_se
-        qmaxtr_ub = qmaxtr + 1.96*gum_se
-        return qmaxtr,qmaxtr_lb,qmaxtr_ub
-
-    qmax_tr2,qmax_tr2_lb, qmax_tr2_ub = gumbel_max(df_qts,2.)
+    # annual extremes discharge (using downscale from time series)
+    ifb = len(list_amax_fb)
+    A_QMAX_fb[:,ifb] = funcs_extremes.annual_maxima(df_qts.values, ystart)[:,0]
+    A_QMIN_fb[:,ifb] = funcs_extremes.annual_minima(df_qts.values, ystart)[:,0]
+    list_amax_fb.append(c)
 
 
     # store results (m3/s)
@@ -340,16 +342,6 @@ for c in list_to_downscale:
     D_QMLT_ts[c] = round(qmlt_ts,6)
 
 
-    D_QMAX_TR2[c] = round(qmax_tr2,6)
-    D_QMAX_TR2_lb[c] = round(qmax_tr2_lb,6)
-    D_QMAX_TR2_ub[c] = round(qmax_tr2_ub,6)
-
-
-    #if tipo == 3:
-    #    print(df_qts)
-    #    break
-
-
     #specific discharge (m3/s.km2)
     nuareamont = d_params.get(c).get('nuareamont')
     if isinstance(nuareamont,list):
@@ -361,14 +353,34 @@ for c in list_to_downscale:
     D_QMLTe_ts[c] = round(qmlt_ts/nuareamont,12)
 
 
+funcs_instrument.close_progress(prog)
+funcs_instrument.end(frame)
+
+
+#--------------------------------------------------------------------------
+# Return levels of annual extremes (all cotrechos at once)
+#--------------------------------------------------------------------------
+nfb = len(list_amax_fb)
+list_amax = scaling['cotrecho'].tolist() + list_amax_fb
+A_QMAX = np.hstack((A_QMAX_t134, A_QMAX_fb[:,:nfb]))
+A_QMIN = np.hstack((A_QMIN_t134, A_QMIN_fb[:,:nfb]))
+
+rl = funcs_extremes.return_levels(A_QMAX, list_tr, method=method_extremes)
+rl_min = funcs_extremes.return_levels(A_QMIN, list_tr_min, method=method_extremes, how='min')
+
+# dicts of results {'D_QMAX_TR2':{cotrecho:value},...}
+D_QMAX = {}
+for itr,tr in enumerate(list_tr):
+    label_tr = 'D_QMAX_TR{:g}'.format(tr)
+    D_QMAX[label_tr] = dict(zip(list_amax, np.round(rl['q'][itr],6)))
+    D_QMAX[label_tr + '_lb'] = dict(zip(list_amax, np.round(rl['lb'][itr],6)))
+    D_QMAX[label_tr + '_ub'] = dict(zip(list_amax, np.round(rl['ub'][itr],6)))
+
+for itr,tr in enumerate(list_tr_min):
+    label_tr = 'D_QMIN_TR{:g}'.format(tr)
+    D_QMAX[label_tr] = dict(zip(list_amax, np.round(rl_min['q'][itr],6)))
+
 
-    '''
-    if tipo==ttipo:
-        print(ttipo)
-        print(df_q95.values,q95,type(q95))
-        print(df_qmlt.values,qmlt,type(qmlt))
-        ttipo=ttipo+1
-    '''
 
 
 #--------------------------------------------------------------------------
@@ -429,13 +441,12 @@ gdf_tble_bho = gpd.read_file(FILE_GDF_BHO)
 # dicts for new columns
 label = ('D_Q95','D_QMLT','D_Q95_ts','D_QMLT_ts',
          'D_Q95e','D_QMLTe','D_Q95e_ts','D_QMLTe_ts',
-         'D_QMAX_TR2','D_QMAX_TR2_lb','D_QMAX_TR2_ub', #linhas qtr2
          'mini_t1','mini_t2','mini_t3','solver')
 kvs = (D_Q95,D_QMLT,D_Q95_ts,D_QMLT_ts,
        D_Q95e,D_QMLTe,D_Q95e_ts,D_QMLTe_ts,
-       D_QMAX_TR2,D_QMAX_TR2_lb,D_QMAX_TR2_ub,  #linhas qtr2
        dict_bho_mini_t1,dict_bho_mini_t2,dict_bho_mini_t3,dict_bho_solver)
 D = dict(zip(label,kvs))
+D.update(D_QMAX)       #linhas qtr
 
 
 # pass dicts to dataframe and export
@@ -472,6 +483,8 @@ finish=time.time()
 #TODO: salvar em dataframe ao inves de dicionarios?!
 # ou uma lista com stats em dicionario unico
 
+funcs_instrument.dump_profile('profile_solver_base_gumbel')
+
 
 
 
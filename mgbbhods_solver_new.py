@@ -3,6 +3,10 @@
 """
 Main script to runs the downscaling of MGB results into BHO drainage
 Updated to run over pre-calculated statistics at .npy files
+  - linear stats (qmlt) come from mini-level stats via the downscaling operator
+  - nonlinear stats (q95) of type 2 use the exact time-domain path
+  - regional runs (region) downscale a sub-basin, reading only its mini
+    and exporting only its reaches
 
 @author: Mino Sorribas
 
@@ -29,6 +33,10 @@ import geopandas as gpd
 import funcs_io
 import funcs_solver, funcs_solver_new
 import funcs_gpkg
+import funcs_store
+import funcs_engine
+import funcs_region
+import funcs_instrument
 
 
 
@@ -38,6 +46,7 @@ print(" Running MGB-BHO Downscaling                       ")
 print("---------------------------------------------------")
 
 start=time.time()
+funcs_instrument.start_profile('solver_new')
 
 
 
@@ -62,7 +71,7 @@ FILE_GDF_BHO = PATH_INPUT +'geoft_bhae_trecho_drenagem.gpkg'
 #-----------------------------------------------------------------------------
 version = '1979'
 version = 'enkf_1979'
-nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version)
+nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version, PATH_INPUT)
 
 file_qtudo_npy = file_qtudo.strip('.MGB') + '_stats.npy'
 file_qcel_npy = file_qcel.strip('.MGB') + '_stats.npy'
@@ -78,6 +87,26 @@ list_t = list_t[ihotstart:]
 flags_export_ts = [-9999] # disable timeseries to xlsx
 #flags_export_ts = [1,2] # select drainage types 1 and 2 to timeseries xlsx
 
+# exact nonlinear stats (q95) for type 2 -> requires QTUDO binary (.MGB)
+# (False -> downscale q95 of mini, which is only an approximation for type 2)
+flag_exact_nonlinear = True
+
+# format of MGB binaries: 'mgb' (raw) or 'zarr' (see mgbbhods_convert_zarr.py)
+fmt_binary = 'mgb'
+
+# evaluate long runs by chunks of time (e.g. 5*365), bounding memory
+# by chunk x active mini (None -> whole record at once, exact quantiles)
+# (chunks -> quantiles from a log-histogram, ~1% of resolution)
+chunk_size = None
+
+# region of a regional run (None -> all available cotrechos), see funcs_region
+# mini stats of a region come straight from the binaries (no .npy stats)
+region = None
+#region = {'cobacia': '8628'}                  # Otto Pfafstetter prefix
+#region = {'outlet': 8628123}                  # cotrecho and everything upstream
+#region = {'bbox': (-52., -20., -50., -18.)}   # xmin, ymin, xmax, ymax
+FILE_REGION_INDEX = 'region_index_bho.npz'
+
 
 #-----------------------------------------------------------------------------
 # Dump binaries to numpy
@@ -92,14 +121,12 @@ if flag_build_npy:
     # build qtudo .npy
     filebin = PATH_INPUT + file_qtudo
     fileout = file_qtudo_npy
-    #_ = funcs_solver.dump_mgb_binary_to_npy(filebin, fileout, nt, nc)
-    _ = funcs_solver_new.dump_mgb_binary_to_stats_npy(filebin, fileout, nt, nc, ihotstart)
+    _ = funcs_solver_new.dump_mgb_binary_to_stats_npy(filebin, fileout, nt, nc, ihotstart, chunk_size)
 
     # build qcel .npy
     filebin = PATH_INPUT + file_qcel
     fileout = file_qcel_npy
-    #_ = funcs_solver.dump_mgb_binary_to_npy(filebin, fileout, nt, nc)
-    _ = funcs_solver_new.dump_mgb_binary_to_stats_npy(filebin, fileout, nt, nc, ihotstart)
+    _ = funcs_solver_new.dump_mgb_binary_to_stats_npy(filebin, fileout, nt, nc, ihotstart, chunk_size)
 
 
 
@@ -153,28 +180,26 @@ dict_type_params = {
 
 
 #--------------------------------------------------------------------------
-# Prepare switcher for solvers and reading .NPY "on the fly"
+# Prepare reading .NPY (stats) and .MGB (time series) "on the fly"
 #--------------------------------------------------------------------------
-# TODO: this block could be defined in funcs_solver.
+# pre-mapping arrays of stats (rows: qm, q95)
+if region is None:
+    dict_var_stats = {
+        funcs_engine.VAR_QTUDO: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
+        funcs_engine.VAR_QCEL: funcs_solver.read_npy_as_mmap(file_qcel_npy),
+        }
 
-# identify dict of required 'mini' for each cotrecho (partial process)
-dict_bho_ixc = funcs_solver.make_dict_bho_ixc(the_dicts)
+    # mini-level stats {stat:{var:values}}
+    dict_stat_mini = {
+        'qmlt': {k:v[0] for k,v in dict_var_stats.items()},
+        'q95': {k:v[1] for k,v in dict_var_stats.items()},
+        }
 
-# pointer for downscaling solvers
-dict_tipo_fsolver = {
-    1: funcs_solver.f_downscaling_t1,
-    2: funcs_solver.f_downscaling_t2,
-    3: funcs_solver.f_downscaling_t3,
-    4: funcs_solver.f_downscaling_t4,
-    }
-
-# pre-mapping arrays
-dict_tipo_mmapfile={
-    1: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
-    2: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
-    3: funcs_solver.read_npy_as_mmap(file_qcel_npy),
-    4: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
-    }
+# pre-mapping time series for the exact path (type 2 uses only QTUDO)
+dict_var_mmap = None
+if flag_exact_nonlinear:
+    mmap_qtudo = funcs_store.open_mgb(PATH_INPUT + file_qtudo, nc, nt, fmt_binary)
+    dict_var_mmap = {funcs_engine.VAR_QTUDO: mmap_qtudo}
 
 
 
@@ -186,134 +211,62 @@ dict_tipo_mmapfile={
 if 'list_to_downscale' not in locals():
     list_to_downscale = available_to_downscale.copy()
 
+# regional run: cotrechos of the region only
+if region is not None:
+    index_region = funcs_region.region_index_from_file(FILE_GDF_BHO, FILE_REGION_INDEX)
+    list_to_downscale = funcs_region.select_cotrechos(index_region, region, dict_bho_solver)
+    print(" Region {}: {} cotrechos".format(region, len(list_to_downscale)))
+
 
 
 
 
 #--------------------------------------------------------------------------
-# Main loop block for downscaling
+# Main block for downscaling (batched engine)
 #--------------------------------------------------------------------------
 
-# dicts for results
-D_Q95 = {}
-D_QMLT = {}
+# compile downscaling operator (weights of mini for each cotrecho)
+op = funcs_engine.make_downscaling_operator(dict_bho_solver,
+                                            dict_type_params,
+                                            list_to_downscale)
+
+# export operator as sparse matrices (W @ Q for any output of MGB)
+flag_export_operator = True
+if flag_export_operator:
+    funcs_engine.dump_operator_npz('downscaling_operator.npz', op, nc)
+
+# regional run: mini-level stats only at the mini read by the operator
+if region is not None:
+    dict_var_region = {
+        funcs_engine.VAR_QTUDO: funcs_store.open_mgb(PATH_INPUT + file_qtudo, nc, nt, fmt_binary),
+        funcs_engine.VAR_QCEL: funcs_store.open_mgb(PATH_INPUT + file_qcel, nc, nt, fmt_binary),
+        }
+    dict_stat_mini = funcs_region.region_mini_stats(op, dict_var_region, list_t,
+                                                    ['qmlt','q95'], chunk_size)
+
+# downscale stats: linear -> operator, nonlinear -> exact (batched) path
+results = funcs_engine.downscale_stats(op,
+                                       ['qmlt','q95'],
+                                       dict_stat_mini = dict_stat_mini,
+                                       dict_var_mmap = dict_var_mmap,
+                                       list_t = list_t,
+                                       exact = flag_exact_nonlinear,
+                                       chunk_size = chunk_size)
+
+# dicts for results (m3/s)
+cotrechos = op['cotrecho'].tolist()
+D_Q95 = dict(zip(cotrechos, np.round(results['q95'],6)))
+D_QMLT = dict(zip(cotrechos, np.round(results['qmlt'],6)))
 D_Q95_ts = {}
 D_QMLT_ts = {}
 
+#specific discharge (m3/s.km2)
+D_Q95e = dict(zip(cotrechos, np.round(results['q95']/op['nuareamont'],12)))
+D_QMLTe = dict(zip(cotrechos, np.round(results['qmlt']/op['nuareamont'],12)))
 
-D_Q95e = {}
-D_QMLTe = {}
-D_Q95e_ts = {}
-D_QMLTe_ts = {}
-
-
-
-# loop downscaling of cotrechos
-conta=0
-hconta = 100./len(list_to_downscale)
-ttipo=1 #auxiliary
-for c in list_to_downscale:
-
-    # get type of solver
-    tipo = dict_bho_solver.get(c)     #1,2,3 or 4
-
-    #DEBUG:TESTING RESULTS
-    #if tipo!=ttipo:
-    #    continue
-
-    # counter
-    conta = conta+1
-    print(" - downscaling {} - {}% ".format(conta,round(conta*hconta,2)))
-
-
-    # get parameters
-    d_params = dict_type_params.get(tipo) ##.get(c)
-
-    # get downscaling function
-    func = dict_tipo_fsolver.get(tipo)
-
-    # data mmap (pre-mapped)
-    mmapfile = dict_tipo_mmapfile.get(tipo)
-
-    # required mini
-    list_c = dict_bho_ixc.get(c)
-
-
-    # # calculate stats and downscale
-    # # get time series from memmap of binary
-    # df_flow = funcs_solver.mmap_to_dataframe(mmapfile, list_t, list_c, dstart)
-    #
-    # ## method i - downscale via time-series
-    # #df_qts = pd.DataFrame(func(c,d_params,df_flow),index = df_flow.index) #ts downscale!
-    # #q95_ts = df_qts.quantile(0.05).values[0] # calculate stats from ts
-    # #qmlt_ts = df_qts.mean().values[0]        # calculate stats from ts
-    #
-    # #export time-series
-    # #if tipo in flags_export_ts:
-    # #    file_ts = "./timeseries/mgbbhods_cotrecho_{}.xlsx".format(c)
-    # #    print(" - saving {} to xlsx".format(c) )
-    # #    df_qts.to_excel(file_ts)
-    #
-    #
-    # # method ii - downscale via stats (q95,qmlt)
-    # df_q95  = pd.DataFrame(df_flow.quantile(0.05)).transpose()
-    # df_qmlt = pd.DataFrame(df_flow.mean()).transpose()
-    #
-    # q95 = func(c, d_params, df_q95)    # downscale stats
-    # qmlt = func(c, d_params, df_qmlt)  # downscale stats
-    #
-    # ## annual aggregation from time series
-    # #df_annual_q95 = df_qts.groupby(df_qts.index.year).quantile(0.05)
-    # #df_annual_qmlt = df_qts.groupby(df_qts.index.year).mean()    
-    
-    
-    # get stats pre-calculated stats and downscale
-    df_st = funcs_solver_new.stats_mmap_to_dataframe(mmapfile, list_c, list_st = [0,1])
-    df_st = df_st.T
-    df_q95 = df_st['q95'].to_frame().transpose()
-    df_qmlt  = df_st['qm'].to_frame().transpose()
-    q95 = func(c, d_params, df_q95)    # downscale stats
-    qmlt = func(c, d_params, df_qmlt)  # downscale stats
-
-
-
-
-
-    # store results (m3/s)
-    D_Q95[c] = round(q95,6)
-    D_QMLT[c] = round(qmlt,6)
-
-    #D_Q95_ts[c] = round(q95_ts,6)
-    #D_QMLT_ts[c] = round(qmlt_ts,6)
-
-
-
-    #if tipo == 3:
-    #    print(df_qts)
-    #    break
-
-
-    #specific discharge (m3/s.km2)
-    nuareamont = d_params.get(c).get('nuareamont')
-    if isinstance(nuareamont,list):
-        nuareamont = nuareamont[0]
-    D_Q95e[c] = round(q95/nuareamont,12)
-    D_QMLTe[c] = round(qmlt/nuareamont,12)
-    
-    #D_Q95e_ts[c] = round(q95_ts/nuareamont,12)
-    #D_QMLTe_ts[c] = round(qmlt_ts/nuareamont,12)
-
-    #dummy solution
-    D_Q95e_ts[c] = D_Q95e[c]
-    D_QMLTe_ts[c] = D_QMLTe[c]   
-
-    '''
-    if tipo==ttipo:
-        print(ttipo)
-        print(df_q95.values,q95,type(q95))
-        print(df_qmlt.values,qmlt,type(qmlt))
-        ttipo=ttipo+1
-    '''
+#dummy solution
+D_Q95e_ts = D_Q95e.copy()
+D_QMLTe_ts = D_QMLTe.copy()
 
 
 #--------------------------------------------------------------------------
@@ -362,8 +315,13 @@ dict_bho_mini_t2 = the_dicts['dict_bho_mini_t2_post']
 dict_bho_mini_t3 = the_dicts['dict_bho_mini_t3_post']
 
 
-# read BHO geodataframe
-gdf_tble_bho = gpd.read_file(FILE_GDF_BHO)
+# read BHO geodataframe (regional run: only the reaches of the region)
+suffix = 'flows_1979_new'
+if region is None:
+    gdf_tble_bho = gpd.read_file(FILE_GDF_BHO)
+else:
+    gdf_tble_bho = funcs_region.read_gdf_cotrechos(index_region, list_to_downscale, FILE_GDF_BHO)
+    suffix = suffix + '_' + funcs_region.region_suffix(region)
 
 # dicts for new columns
 #label = ('D_Q95','D_QMLT','D_Q95_ts','D_QMLT_ts','mini_t1','mini_t2','mini_t3','solver')
@@ -382,7 +340,7 @@ D = dict(zip(label,kvs))
 
 
 # pass dicts to dataframe and export
-G = funcs_gpkg.f_dicts_to_bho_gpkg(gdf_tble_bho, D, suffix='flows_1979_new')
+G = funcs_gpkg.f_dicts_to_bho_gpkg(gdf_tble_bho, D, suffix=suffix)
 
 del gdf_tble_bho
 
@@ -415,6 +373,8 @@ finish=time.time()
 #TODO: salvar em dataframe ao inves de dicionarios?!
 # ou uma lista com stats em dicionario unico
 
+funcs_instrument.dump_profile('profile_solver_new')
+
 
 
 
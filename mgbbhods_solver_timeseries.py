@@ -43,6 +43,10 @@ import geopandas as gpd
 import funcs_io
 import funcs_solver
 import funcs_gpkg
+import funcs_store
+import funcs_pipeline
+import funcs_checkpoint
+import funcs_instrument
 
 
 
@@ -52,6 +56,8 @@ print(" Running MGB-BHO Downscaling for Time Series       ")
 print("---------------------------------------------------")
 
 start=time.time()
+funcs_instrument.start_profile('solver_timeseries')
+funcs_instrument.set_progress(interval = 2., quiet = False)  # progress of loops (quiet -> no messages)
 
 
 
@@ -61,7 +67,7 @@ start=time.time()
 PATH_MAIN = '../'
 PATH_INPUT = PATH_MAIN + 'input/'
 
-# actually, PATH_INPUT gets .bin files... but processing is local with .npy
+# PATH_INPUT gets .MGB binaries (memory-mapped in place)
 
 
 #could use for filters
@@ -80,10 +86,7 @@ with open('dict_posto_cotrecho.pickle','rb') as f:
 # Get mgb-sa setup
 #-----------------------------------------------------------------------------
 version = '1979'
-nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version)
-
-file_qtudo_npy = file_qtudo.strip('.MGB') + '.npy'
-file_qcel_npy = file_qcel.strip('.MGB') + '.npy'
+nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version, PATH_INPUT)
 
 
 # list of time intervals
@@ -98,19 +101,12 @@ list_to_daily_ts = []       #user-defined -> easier to do after reading dicts.
 
 
 #-----------------------------------------------------------------------------
-# Dump binaries to numpy
+# Memory-map MGB binaries (raw .MGB in place or chunked .zarr)
 #-----------------------------------------------------------------------------
-flag_build_npy = False
-if flag_build_npy:
-    # build qtudo .npy
-    filebin = PATH_INPUT + file_qtudo
-    fileout = file_qtudo_npy
-    _ = funcs_solver.dump_mgb_binary_to_npy(filebin, fileout, nt, nc)
-
-    # build qcel .npy
-    filebin = PATH_INPUT + file_qcel
-    fileout = file_qcel_npy
-    _ = funcs_solver.dump_mgb_binary_to_npy(filebin, fileout, nt, nc)
+# format of MGB binaries: 'mgb' (raw) or 'zarr' (see mgbbhods_convert_zarr.py)
+fmt_binary = 'mgb'
+mmap_qtudo = funcs_store.open_mgb(PATH_INPUT + file_qtudo, nc, nt, fmt_binary)
+mmap_qcel = funcs_store.open_mgb(PATH_INPUT + file_qcel, nc, nt, fmt_binary)
 
 
 
@@ -178,10 +174,10 @@ dict_tipo_fsolver = {
 
 # pre-mapping arrays
 dict_tipo_mmapfile={
-    1: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
-    2: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
-    3: funcs_solver.read_npy_as_mmap(file_qcel_npy),
-    4: funcs_solver.read_npy_as_mmap(file_qtudo_npy),
+    1: mmap_qtudo,
+    2: mmap_qtudo,
+    3: mmap_qcel,
+    4: mmap_qtudo,
     }
 
 
@@ -213,7 +209,7 @@ list_from_gauges = list(dict_posto_cotrecho.values()) #could repeat
 
 
 # list to downscale timeseries (monthtly and annual)
-list_to_downscale = list( set(list_from_user + list_from_gauges) )
+list_to_downscale = sorted( set(list_from_user + list_from_gauges) )   # stable blocks (checkpoint)
 
 # list to downscale daily timeseries
 list_to_daily_ts = list(set(list_from_gauges[:]))
@@ -231,121 +227,152 @@ def hydroyear(year,month):
     return year,month
 
 
+# checkpoint of blocks of cotrechos (re-run with --resume skips finished blocks)
+# (csv files are written per cotrecho, blocks only record what is finished)
+# (inputs: dicts of the pre-processing and identity of binaries)
+config_run = {'script':'solver_timeseries', 'version':version, 'ihotstart':ihotstart,
+              'daily':sorted(list_to_daily_ts),
+              'dicts':funcs_checkpoint.data_hash((dict_bho_solver, dict_type_params)),
+              'binaries':[funcs_pipeline.file_fingerprint(PATH_INPUT + file_qtudo),
+                          funcs_pipeline.file_fingerprint(PATH_INPUT + file_qcel)],
+              'fmt_binary':fmt_binary}
+ckpt = funcs_checkpoint.init_checkpoint('./checkpoint_solver_timeseries/',
+                                        config_run,
+                                        list_to_downscale,
+                                        block_size = 500,
+                                        resume = funcs_checkpoint.resume_from_argv())
+
 # loop downscaling of cotrechos
-conta=0
-nconta = len(list_to_downscale)
-hconta = 100./nconta
+frame = funcs_instrument.begin('solver_loop')
+prog = funcs_instrument.new_progress(len(list_to_downscale), 'downscaling',
+                                     count = len(ckpt['done'])*ckpt['block_size'])
 
 #debug
 #ttipo=1 #dummy
 
-for c in list_to_downscale:
+for iblock, list_block in funcs_checkpoint.pending_blocks(ckpt):
+
+    # cotrechos with exported time series (block)
+    D_DONE = {}
+
+    for c in list_block:
 
-    # get type of solver
-    tipo = dict_bho_solver.get(c)     #1,2,3 or 4
+        # get type of solver
+        tipo = dict_bho_solver.get(c)     #1,2,3 or 4
 
-    if tipo is None:
-        print(" - can't solve for cotrecho {}. next... ".format(c))
-        continue
+        if tipo is None:
+            print(" - can't solve for cotrecho {}. next... ".format(c))
+            continue
 
-    #DEBUG:TESTING RESULTS
-    #if tipo!=ttipo:
-    #    continue
+        #DEBUG:TESTING RESULTS
+        #if tipo!=ttipo:
+        #    continue
 
-    # counter
-    conta = conta+1
-    print(" - downscaling {}/{} - {}%  ".format(conta,nconta,round(conta*hconta,2)))
+        # counter
+        funcs_instrument.update_progress(prog)
 
 
-    # get parameters
-    d_params = dict_type_params.get(tipo) ##.get(c)
+        # get parameters
+        d_params = dict_type_params.get(tipo) ##.get(c)
 
-    # get downscaling function
-    func = dict_tipo_fsolver.get(tipo)
+        # get downscaling function
+        func = dict_tipo_fsolver.get(tipo)
 
-    # data mmap (pre-mapped)
-    mmapfile = dict_tipo_mmapfile.get(tipo)
+        # data mmap (pre-mapped)
+        mmapfile = dict_tipo_mmapfile.get(tipo)
 
-    # required mini
-    list_c = dict_bho_ixc.get(c)
+        # required mini
+        list_c = dict_bho_ixc.get(c)
 
-    # --
-    # downscale
-    # get time series from memmap of binary
-    df_flow = funcs_solver.mmap_to_dataframe(mmapfile, list_t, list_c, dstart)
+        # --
+        # downscale
+        # get time series from memmap of binary
+        df_flow = funcs_solver.mmap_to_dataframe(mmapfile, list_t, list_c, dstart)
 
-    # method i - downscale via time-series
-    df_qts = pd.DataFrame(func(c,d_params,df_flow),index = df_flow.index) #ts downscale!
+        # method i - downscale via time-series
+        df_qts = pd.DataFrame(func(c,d_params,df_flow),index = df_flow.index) #ts downscale!
 
-    # --
-    # hydrologic year
-    hyd_month = np.where(df_qts.index.month>=10,df_qts.index.month-10+1,df_qts.index.month+3)
-    hyd_year = np.where(df_qts.index.month>=10,df_qts.index.year+1,df_qts.index.year)
+        # --
+        # hydrologic year
+        hyd_month = np.where(df_qts.index.month>=10,df_qts.index.month-10+1,df_qts.index.month+3)
+        hyd_year = np.where(df_qts.index.month>=10,df_qts.index.year+1,df_qts.index.year)
 
-    # --
-    # annual aggregation from time series
-    #calendar year
-    df_annual_q95 = df_qts.groupby(df_qts.index.year).quantile(0.05).rename(columns={0:'q95'})
-    df_annual_qmlt = df_qts.groupby(df_qts.index.year).mean().rename(columns={0:'qmlt'})
+        # --
+        # annual aggregation from time series
+        #calendar year
+        df_annual_q95 = df_qts.groupby(df_qts.index.year).quantile(0.05).rename(columns={0:'q95'})
+        df_annual_qmlt = df_qts.groupby(df_qts.index.year).mean().rename(columns={0:'qmlt'})
 
-    #hydrological year
-    df_hyd_annual_q95 = df_qts.groupby(hyd_year).quantile(0.05).rename(columns={0:'hyd_q95'})
-    df_hyd_annual_qmlt = df_qts.groupby(hyd_year).mean().rename(columns={0:'hyd_qmlt'})
+        #hydrological year
+        df_hyd_annual_q95 = df_qts.groupby(hyd_year).quantile(0.05).rename(columns={0:'hyd_q95'})
+        df_hyd_annual_qmlt = df_qts.groupby(hyd_year).mean().rename(columns={0:'hyd_qmlt'})
 
-    #join annual stats
-    df_annual_stats = pd.concat([df_annual_q95,df_annual_qmlt,df_hyd_annual_q95,df_hyd_annual_qmlt],axis=1)
-    df_annual_stats.index.rename('year',inplace=True)
+        #join annual stats
+        df_annual_stats = pd.concat([df_annual_q95,df_annual_qmlt,df_hyd_annual_q95,df_hyd_annual_qmlt],axis=1)
+        df_annual_stats.index.rename('year',inplace=True)
 
 
-    # --
-    # monthly aggregation from time series
-    #calendar year
-    cal_map = {'level_0':'year','level_1':'month'}
-    iyymm = [df_qts.index.year,df_qts.index.month]
-    df_monthly_q95 = df_qts.groupby(iyymm).quantile(0.05).rename(columns={0:'q95'}).rename(columns=cal_map)
-    df_monthly_qmlt = df_qts.groupby(iyymm).mean().rename(columns={0:'qmlt'}).rename(columns=cal_map)
+        # --
+        # monthly aggregation from time series
+        #calendar year
+        cal_map = {'level_0':'year','level_1':'month'}
+        iyymm = [df_qts.index.year,df_qts.index.month]
+        df_monthly_q95 = df_qts.groupby(iyymm).quantile(0.05).rename(columns={0:'q95'}).rename(columns=cal_map)
+        df_monthly_qmlt = df_qts.groupby(iyymm).mean().rename(columns={0:'qmlt'}).rename(columns=cal_map)
 
-    #hydrological year
-    hyd_map = {'level_0':'hyd_year','level_1':'hyd_month'}
-    iyymm = [hyd_year,hyd_month]
-    df_hyd_monthly_q95 = df_qts.groupby(iyymm).quantile(0.05).rename(columns={0:'hyd_q95'}).rename(columns=hyd_map)
-    df_hyd_monthly_qmlt = df_qts.groupby(iyymm).mean().rename(columns={0:'hyd_qmlt'}).rename(columns=hyd_map)
+        #hydrological year
+        hyd_map = {'level_0':'hyd_year','level_1':'hyd_month'}
+        iyymm = [hyd_year,hyd_month]
+        df_hyd_monthly_q95 = df_qts.groupby(iyymm).quantile(0.05).rename(columns={0:'hyd_q95'}).rename(columns=hyd_map)
+        df_hyd_monthly_qmlt = df_qts.groupby(iyymm).mean().rename(columns={0:'hyd_qmlt'}).rename(columns=hyd_map)
 
-    #join monthly stats
-    df_monthly_cal = pd.concat([df_monthly_q95,df_monthly_qmlt],axis=1).reset_index().rename(columns=cal_map)
-    df_monthly_hyd = pd.concat([df_hyd_monthly_q95,df_hyd_monthly_qmlt],axis=1).reset_index().rename(columns=hyd_map)
-    df_monthly_stats = pd.concat([df_monthly_cal,df_monthly_hyd],axis=1)
-    df_monthly_stats.index.rename('index',inplace=True)
+        #join monthly stats
+        df_monthly_cal = pd.concat([df_monthly_q95,df_monthly_qmlt],axis=1).reset_index().rename(columns=cal_map)
+        df_monthly_hyd = pd.concat([df_hyd_monthly_q95,df_hyd_monthly_qmlt],axis=1).reset_index().rename(columns=hyd_map)
+        df_monthly_stats = pd.concat([df_monthly_cal,df_monthly_hyd],axis=1)
+        df_monthly_stats.index.rename('index',inplace=True)
 
 
-    # --
-    # export time-series to xlsx
-    df_qts = df_qts.rename(columns = {0:c} )    # column '0' -> 'cotrecho'
+        # --
+        # export time-series to xlsx
+        df_qts = df_qts.rename(columns = {0:c} )    # column '0' -> 'cotrecho'
 
-    #file_ts = "./timeseries/mgbbhods_cotrecho_{}.xlsx".format(c)
-    #df_qts.to_excel(file_ts)
+        #file_ts = "./timeseries/mgbbhods_cotrecho_{}.xlsx".format(c)
+        #df_qts.to_excel(file_ts)
 
-    # --
-    # export daily time-series as csv
-    if c in list_to_daily_ts: # 'if' is a bad implementation cause we know a priori.
-        file_ts = "./timeseries_daily/mgbbhods_cotrecho_{}_daily.csv".format(c)
-        df_qts.to_csv(file_ts,sep=';', float_format='%6.6f')
+        # --
+        # export daily time-series as csv
+        if c in list_to_daily_ts: # 'if' is a bad implementation cause we know a priori.
+            file_ts = "./timeseries_daily/mgbbhods_cotrecho_{}_daily.csv".format(c)
+            df_qts.to_csv(file_ts,sep=';', float_format='%6.6f')
 
-    # --
-    # export annual aggregation
-    file_ts = "./timeseries/mgbbhods_cotrecho_{}_yearly.csv".format(c)
-    df_annual_stats.to_csv(file_ts, sep=';', float_format='%6.6f')
+        # --
+        # export annual aggregation
+        file_ts = "./timeseries/mgbbhods_cotrecho_{}_yearly.csv".format(c)
+        df_annual_stats.to_csv(file_ts, sep=';', float_format='%6.6f')
 
-    # --
-    # export annual aggregation
-    file_ts = "./timeseries/mgbbhods_cotrecho_{}_monthly.csv".format(c)
-    df_monthly_stats.to_csv(file_ts, sep=';', float_format='%6.6f')
+        # --
+        # export annual aggregation
+        file_ts = "./timeseries/mgbbhods_cotrecho_{}_monthly.csv".format(c)
+        df_monthly_stats.to_csv(file_ts, sep=';', float_format='%6.6f')
 
-    print(" - saving time-series of cotrecho {}".format(c) )
+        D_DONE[c] = tipo
+
+    # save block
+    funcs_checkpoint.save_block(ckpt, iblock, {'D_DONE':D_DONE})
+
+funcs_instrument.close_progress(prog)
+funcs_instrument.end(frame)
+
+# check all blocks (no duplicated cotrechos)
+merged = funcs_checkpoint.merge_blocks(ckpt)
+print(" - time series of {} cotrechos".format(len(merged.get('D_DONE',{}))))
 
 
 finish=time.time()
 
+funcs_instrument.dump_profile('profile_solver_timeseries')
+
 
 
 
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental update of mini-level statistics when a MGB run is extended
+    with new days (see funcs_incremental)
+
+Save:
+ - <QTUDO>_state.npz / <QITUDO>_state.npz :: accumulators of every mini
+ - <QTUDO>_state_stats.npz / <QITUDO>_state_stats.npz :: qmlt and q95 of
+   the states with their period (the exact _stats.npy of
+   mgbbhods_solver_new.py are not touched)
+ - D_QMLT.pickle :: QMLT downscaled through the operator (linear stats,
+   no reading of the binaries)
+
+Notes:
+ - q95 of the states comes from the log-histogram (~1% of resolution),
+   as the chunked evaluation of funcs_engine
+ - nonlinear stats of type 2 still need the time-domain path
+   (mgbbhods_solver_new.py)
+
+@author: Mino Sorribas
+
+"""
+
+import os
+os.environ['USE_PYGEOS'] = '0'
+# standard python
+import time
+import pickle
+
+# numpy
+import numpy as np
+
+# downscaling
+import funcs_io
+import funcs_solver
+import funcs_store
+import funcs_engine
+import funcs_incremental
+import funcs_instrument
+
+
+print("---------------------------------------------------")
+print(" Update statistics of MGB binaries (new days)      ")
+print("---------------------------------------------------")
+
+start=time.time()
+funcs_instrument.start_profile('stats_update')
+
+
+
+#-----------------------------------------------------------------------------
+# SETTINGS
+#-----------------------------------------------------------------------------
+PATH_MAIN = '../'
+PATH_INPUT = PATH_MAIN + 'input/'
+
+version = '1979'
+nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version, PATH_INPUT)
+
+ihotstart = 365                   # hotstart (first timestep of the stats)
+chunk_size = 365                  # days read by chunk
+fmt_binary = 'mgb'                # 'mgb' (raw) or 'zarr'
+
+# check the updated states against exact statistics (reads everything)
+flag_check = False
+
+# re-downscale linear stats through the operator
+flag_downscale = True
+
+funcs_instrument.set_progress(interval = 2., quiet = False)
+
+
+
+#-----------------------------------------------------------------------------
+# Update the states with the appended days
+#-----------------------------------------------------------------------------
+dict_var_file = {
+    funcs_engine.VAR_QTUDO: file_qtudo,
+    funcs_engine.VAR_QCEL: file_qcel,
+    }
+
+dict_var_state = {}
+dict_var_ref = {}
+for var, file_mgb in dict_var_file.items():
+    filebin = PATH_INPUT + file_mgb
+    filestate = file_mgb.strip('.MGB') + '_state.npz'
+    filestats = file_mgb.strip('.MGB') + '_state_stats.npz'
+
+    # whole binary (nt of the file, it grows with the operational run)
+    dados_mmap = funcs_store.open_mgb(filebin, nc, None, fmt_binary)
+
+    state = None
+    if os.path.isfile(filestate):
+        state = funcs_incremental.read_state(filestate)
+        t_end = state['t_end']
+        try:
+            funcs_incremental.update_state(state, dados_mmap, chunk_size=chunk_size)
+            print(" - {}: +{} days (t = {} -> {})".format(file_mgb, state['t_end'] - t_end,
+                                                          t_end, state['t_end']))
+        except ValueError as e:
+            print(" - {}: {}".format(file_mgb, e))
+            state = None
+
+    if state is None:
+        state = funcs_incremental.make_state(dados_mmap, ihotstart, dstart, chunk_size=chunk_size)
+        print(" - {}: new state (t = {} -> {})".format(file_mgb, ihotstart, state['t_end']))
+
+    funcs_incremental.dump_state(state, filestate)
+    funcs_incremental.dump_state_stats(state, filestats)
+    dict_var_state[var] = state
+
+    if flag_check:
+        dict_var_ref[var] = funcs_incremental.reference_stats(state, dados_mmap,
+                                                              ['qmlt', 'q95', 'qmax', 'qmin'])
+        # q95 of short series may exceed STATE_RTOL_HIST with a correct state
+        # (gaps between order statistics, see funcs_incremental.compare_stats)
+        diffs, ok = funcs_incremental.compare_stats(state, dict_var_ref[var])
+        print(" - check {}: {} {}".format(file_mgb, 'ok' if ok else 'FAILED', diffs))
+
+
+
+#-----------------------------------------------------------------------------
+# Re-downscale linear stats through the operator
+#-----------------------------------------------------------------------------
+if flag_downscale:
+    the_dicts = funcs_io.read_the_dicts()
+    dict_bho_solver = the_dicts['dict_bho_solver']
+    dict_type_params = {
+        1: the_dicts['dict_parameters_t1'],
+        2: the_dicts['dict_parameters_t2'],
+        3: the_dicts['dict_parameters_t3'],
+        4: the_dicts['dict_parameters_t4'],
+        }
+
+    op = funcs_engine.make_downscaling_operator(dict_bho_solver,
+                                                dict_type_params,
+                                                list(dict_bho_solver.keys()))
+
+    dict_stat_mini = funcs_incremental.states_to_stat_mini(dict_var_state, ['qmlt'])
+    results = funcs_engine.downscale_stats(op, ['qmlt'], dict_stat_mini = dict_stat_mini)
+
+    cotrechos = op['cotrecho'].tolist()
+    D_QMLT = dict(zip(cotrechos, np.round(results['qmlt'],6)))
+    with open('D_QMLT.pickle','wb') as f:
+        pickle.dump(D_QMLT,f)
+
+    if flag_check:
+        dict_stat_ref = {'qmlt': {var: ref['qmlt'] for var, ref in dict_var_ref.items()}}
+        results_ref = funcs_engine.downscale_stats(op, ['qmlt'], dict_stat_mini = dict_stat_ref)
+        diff = np.nanmax(np.abs(results['qmlt'] - results_ref['qmlt'])
+                         /np.maximum(np.abs(results_ref['qmlt']), 1.e-12), initial=0.)
+        print(" - check downscaled qmlt: {} (max rel diff {:.2e})".format(
+            'ok' if diff <= funcs_incremental.STATE_RTOL else 'FAILED', diff))
+
+
+
+end = time.time()
+print("\n Done in {} seconds".format(round(end-start,2)))
+funcs_instrument.dump_profile('profile_stats_update')
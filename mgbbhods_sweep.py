@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweep of the MGB-BHO pre-processing
+    e.g. calibration of area_threshold_t12, dmax and tolerance table of type 1
+
+Shared stages (domain, t0, t3) run once, the other stages run for each
+configuration in parallel (see funcs_sweep), with the cache of
+mgbbhods_pipeline.py (PATH_CACHE)
+
+Save:
+ - sweep_results.xlsx :: per configuration, number of reaches of type
+                         1/2/3/4, lost_t4 and differences of Q95 against
+                         the reference (params)
+
+@author: Mino Sorribas
+
+"""
+
+# standard python
+import time
+import warnings
+
+# downscaling functions
+import funcs_io
+import funcs_solver
+import funcs_engine
+import funcs_pipeline
+import funcs_sweep
+import funcs_instrument
+
+# ignore warnings
+warnings.filterwarnings('ignore')
+
+
+#-----------------------------------------------------------------------------
+# INPUT PATHS AND FILES
+#-----------------------------------------------------------------------------
+PATH_MAIN = '../'
+PATH_INPUT = PATH_MAIN + 'input/'
+PATH_CACHE = './cache_prepro/'
+
+files = {
+    'file_mini': PATH_INPUT + 'mini.xlsx',
+    'file_gdf_bho': PATH_INPUT + 'geoft_bho_2017_5k_trecho_drenagem.gpkg',
+    'file_mgb_catchments_shp': PATH_INPUT + 'mgb_sa_unit_catchments_sirgas2000.shp',
+    }
+
+
+#-----------------------------------------------------------------------------
+# REFERENCE PARAMETERS AND GRID
+#-----------------------------------------------------------------------------
+params = {
+    'area_threshold_t1': 800.,
+    'area_limite_minijus': 10000.,
+    'dmax': 0.5,
+    'tble_tol': None,
+    'area_threshold_t12': 1000.,
+    }
+
+# tolerance tables of type 1 (area_lb, area_ub, max_error %), see funcs_io.TBLE_AREA_TOL_T1
+tble_tol_strict = tuple((lb, ub, 0.5*tol) for lb, ub, tol in funcs_io.TBLE_AREA_TOL_T1)
+
+grid = {
+    'area_threshold_t12': [500., 800., 1000., 1500.],
+    'dmax': [0.3, 0.5],
+    'tble_tol': [None, tble_tol_strict],
+    }
+
+# number of processes (None -> all cpus)
+nproc = None
+
+
+#-----------------------------------------------------------------------------
+# Q95 OF MINI (None -> only counts)
+#-----------------------------------------------------------------------------
+flag_q95 = True
+version = '1979'
+fmt_binary = 'mgb'
+ihotstart = 365
+chunk_size = None                 # None -> exact quantiles, as mgbbhods_solver_new.py
+
+
+# guard for the pool of processes (spawn in windows)
+if __name__ == '__main__':
+
+    print("---------------------------------------------------")
+    print(" Parameter sweep of the MGB-BHO pre-processing     ")
+    print("---------------------------------------------------")
+
+    start = time.time()
+    funcs_instrument.start_profile('sweep')
+
+    dict_var_q95 = None
+    binaries = None
+    if flag_q95:
+        print(" Q95 of mini... ")
+        nt, nc, dstart, file_qtudo, file_qcel = funcs_solver.mgbsa_default(version, PATH_INPUT)
+        list_t = list(range(nt))[ihotstart:]
+        binaries = {'files': {funcs_engine.VAR_QTUDO: PATH_INPUT + file_qtudo,
+                              funcs_engine.VAR_QCEL: PATH_INPUT + file_qcel},
+                    'nc': nc, 'nt': nt, 'fmt': fmt_binary,
+                    'list_t': list_t, 'chunk_size': chunk_size}
+        dict_var_q95 = {}
+        for var, dados_mmap in funcs_sweep.open_binaries(binaries).items():
+            res = funcs_engine.make_mini_stats(dados_mmap, list_t, ['q95'], chunk_size)
+            dict_var_q95[var] = res['q95']
+
+
+    print(" Running {} configurations... ".format(len(funcs_sweep.make_configs(grid))))
+    stages = funcs_pipeline.make_stages_mgbbho()
+    df_sweep, dict_q95 = funcs_sweep.run_sweep(stages, files, params,
+                                               funcs_sweep.make_configs(grid),
+                                               PATH_CACHE,
+                                               dict_var_q95 = dict_var_q95,
+                                               binaries = binaries,
+                                               nproc = nproc)
+
+    print(df_sweep.to_string(index=False))
+    df_sweep.to_excel('sweep_results.xlsx', index=False)
+
+
+    end = time.time()
+    print("\n Done in {} seconds".format(round(end-start,2)))
+    funcs_instrument.dump_profile('profile_sweep')
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic MGB + BHO dataset (see funcs_synthetic)
+
+Save (at PATH_OUT):
+ - geoft_bho_synthetic.gpkg :: BHO-like drainage
+ - mini.xlsx :: MGB catchments table
+ - mgb_catchments_synthetic.shp :: polygons of mini
+ - QTUDO_synthetic.MGB, QITUDO_synthetic.MGB :: binaries (nt x nc, float32)
+ - synthetic.mgbrun.json :: sidecar of the run (funcs_datasets)
+
+Then point PATH_INPUT of the scripts to PATH_OUT, with the files above and
+version = 'synthetic' (e.g. mgbbhods_pipeline.py, mgbbhods_solver_base.py)
+
+@author: Mino Sorribas
+
+"""
+
+import os
+os.environ['USE_PYGEOS'] = '0'
+# standard python
+import time
+
+# downscaling functions
+import funcs_synthetic
+import funcs_instrument
+
+
+#-----------------------------------------------------------------------------
+# SETTINGS
+#-----------------------------------------------------------------------------
+PATH_OUT = '../synthetic/'
+
+n_reaches = 100000          # number of BHO reaches (e.g. 10k, 100k, 500k)
+nt = 5*365                  # days of the binaries
+seed = 0
+reaches_per_mini = 60       # typical number of reaches of a mini
+
+
+
+print("---------------------------------------------------")
+print(" Synthetic MGB + BHO dataset                      ")
+print("---------------------------------------------------")
+
+start = time.time()
+funcs_instrument.start_profile('synthetic')
+
+files = funcs_synthetic.make_synthetic_dataset(PATH_OUT, n_reaches, nt, seed,
+                                               reaches_per_mini = reaches_per_mini)
+for k, v in files.items():
+    print(" {} :: {}".format(k, v))
+
+
+end = time.time()
+print("\n Done in {} seconds".format(round(end-start,2)))
+funcs_instrument.dump_profile('profile_synthetic')
@@ -5,6 +5,8 @@ Link hidroreference (gauges at bho) to MGB downscale results.
 SAVE
  - base_mgbbhods_postos_20211013.xlsx'
 
+the pickle of gauges x cotrecho is made by mgbbhods_gauges.py
+
 @author: Mino Sorribas
 """
 